@@ -0,0 +1,166 @@
+'''
+Throughput of the list and temp-link endpoints:
+sync DRF views under WSGI vs sync views under ASGI vs async-native views under ASGI.
+
+Requests are driven in-process by a minimal uvicorn-style runner
+(ASGI scope / receive / send on one event loop) and by a thread pool calling
+the WSGI callable, so no network stack is measured.
+
+    python -m benchmarks.async_views --requests 2000 --concurrency 32
+'''
+import argparse
+import asyncio
+import importlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import (create_user_with_images, format_latencies,
+                              setup_django, teardown_django)
+
+
+def use_routes(async_routes):
+    '''
+    Re-imports the url conf with a different THUMBS_ASYNC_ROUTES selection
+    '''
+    from django.conf import settings
+    from django.urls import clear_url_caches
+
+    import img_thumbs.urls
+    import thumbs.urls
+
+    settings.THUMBS_ASYNC_ROUTES = async_routes
+    importlib.reload(thumbs.urls)
+    importlib.reload(img_thumbs.urls)
+    clear_url_caches()
+
+def split_path(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+def run_wsgi(application, paths, cookie, concurrency):
+    def request(path):
+        path_info, query = split_path(path)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path_info,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'testserver',
+            'HTTP_COOKIE': cookie,
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        start = time.perf_counter()
+        statuses = []
+        body = application(environ, lambda s, h, *a: statuses.append(s))
+        b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+        return time.perf_counter() - start, int(statuses[0].split()[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(request, paths))
+    return time.perf_counter() - start, results
+
+def run_asgi(application, paths, cookie, concurrency):
+    async def request(path):
+        path_info, query = split_path(path)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path_info,
+            'raw_path': path_info.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'cookie', cookie.encode()),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        return time.perf_counter() - start, messages[0]['status']
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(path):
+            async with semaphore:
+                return await request(path)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[limited(p) for p in paths])
+        return time.perf_counter() - start, results
+
+    return asyncio.run(main())
+
+def report(name, total_time, results):
+    latencies = [r[0] for r in results]
+    errors = len([r for r in results if r[1] >= 400])
+    print(format_latencies(name, latencies, total_time) + f' errors={errors}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--images', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    try:
+        import datetime
+
+        from django.core.asgi import get_asgi_application
+        from django.core.wsgi import get_wsgi_application
+        from django.test import Client
+        from django.utils import timezone
+
+        from thumbs.models import ImageTempLink
+
+        user, roots = create_user_with_images('bench_user', args.images)
+        client = Client()
+        client.force_login(user)
+        cookie = f'sessionid={client.cookies["sessionid"].value}'
+
+        expiration = timezone.now() + datetime.timedelta(hours=1)
+        links = [
+            ImageTempLink.objects.create(image=root, expiration=expiration).generate_link()
+            for root in roots
+        ]
+
+        endpoints = {
+            'list_img': ['/thumbs/list_img/'] * args.requests,
+            'tmpLink': [links[i % len(links)] for i in range(args.requests)],
+        }
+
+        for route, paths in endpoints.items():
+            use_routes([])
+            report(f'{route} wsgi/sync', *run_wsgi(get_wsgi_application(), paths, cookie, args.concurrency))
+            report(f'{route} asgi/sync', *run_asgi(get_asgi_application(), paths, cookie, args.concurrency))
+            use_routes([route])
+            report(f'{route} asgi/async', *run_asgi(get_asgi_application(), paths, cookie, args.concurrency))
+    finally:
+        teardown_django()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Queries and latency per request of session vs signed token authentication.
+Sessions load the session row and the user on every request, tokens are verified
+by their signature and the plan is memoized per process.
+
+    python -m benchmarks.auth_queries --requests 500
+'''
+import argparse
+import json
+
+from benchmarks.utils import (create_user_with_images, format_latencies,
+                              setup_django, teardown_django, timed)
+
+
+def measure(client, method, path, data, requests, **extra):
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+
+    # requests reset the query log when they start, the capture has to start from an empty one
+    reset_queries()
+    with CaptureQueriesContext(connection) as context:
+        response = getattr(client, method)(path, data, **extra)
+    assert response.status_code < 300, response.status_code
+    # captured queries are read from the log, before further requests reset it
+    queries = len(context)
+
+    latencies = [timed(getattr(client, method), path, data, **extra)[0] for _ in range(requests)]
+    return queries, latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--images', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    try:
+        from django.test import Client
+
+        from thumbs.authentication import create_token
+
+        user, roots = create_user_with_images('bench_user', args.images)
+
+        session_client = Client()
+        session_client.force_login(user)
+        token_client = Client(HTTP_AUTHORIZATION=f'Bearer {create_token(user)}')
+
+        ids = json.dumps({'ids': [root.pk for root in roots], 'exp': 300})
+        endpoints = [
+            ('list_img', 'get', '/thumbs/list_img/', None, {}),
+            ('get_img_temp_link', 'get', '/thumbs/get_img_temp_link/', {'img': roots[0].pk, 'exp': 300}, {}),
+            ('get_img_temp_links', 'post', '/thumbs/get_img_temp_links/', ids, {'content_type': 'application/json'}),
+        ]
+
+        for name, method, path, data, extra in endpoints:
+            for auth, client in [('session', session_client), ('token', token_client)]:
+                queries, latencies = measure(client, method, path, data, args.requests, **extra)
+                print(format_latencies(f'{name} {auth}', latencies) + f' queries={queries}')
+    finally:
+        teardown_django()
+
+if __name__ == '__main__':
+    main()
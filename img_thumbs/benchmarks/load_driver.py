@@ -0,0 +1,229 @@
+'''
+Concurrent load driver for a running server, with users seeded by the seed_load command.
+Stdlib only (threads + urllib), no load testing framework needed.
+
+Virtual users log in as seeded users (session auth), then a pool of threads sends
+a weighted mix of requests - the schedule is generated from a fixed seed.
+Latency percentiles are reported per endpoint.
+
+    python manage.py project_init
+    python manage.py seed_load --users 2000 --password load-password
+    python manage.py runserver --noreload
+    python -m benchmarks.load_driver --url http://127.0.0.1:8000 --password load-password \
+        --users 50 --requests 5000 --concurrency 32
+'''
+import argparse
+import http.cookiejar
+import io
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import format_latencies
+
+LOAD_USER_PREFIX = 'load-'
+
+ENDPOINTS = ['list_img', 'get_img_temp_link', 'tmpLink', 'upload_img']
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    '''
+    Temp links redirect to the file - the redirect itself is measured
+    '''
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def send(opener, url, data=None, headers=None, method=None):
+    '''
+    Returns latency (seconds), status (0 on connection errors) and body of a request
+    '''
+    request = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+    start = time.perf_counter()
+    try:
+        with opener.open(request) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status = e.code
+    except urllib.error.URLError:
+        body = b''
+        status = 0
+    return time.perf_counter() - start, status, body
+
+def encode_multipart(field, filename, content, content_type):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def create_upload_image(seed):
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.new('RGB', (1200, 900), tuple(rng.randrange(256) for _ in range(3)))
+    fp = io.BytesIO()
+    image.save(fp, format='JPEG')
+    return fp.getvalue()
+
+
+class VirtualUser():
+    '''
+    A logged in seeded user, with ids of its images and temp links issued to it
+    '''
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies),
+            NoRedirectHandler()
+        )
+        self.image_ids = []
+        self.can_link = False
+        self.links = []
+
+    def url(self, path):
+        return urllib.parse.urljoin(self.base_url, path)
+
+    def get_cookie(self, name):
+        return next((c.value for c in self.cookies if c.name == name), None)
+
+    def login(self, password):
+        send(self.opener, self.url('/api-auth/login/'))
+        data = urllib.parse.urlencode({
+            'username': self.username,
+            'password': password,
+            'csrfmiddlewaretoken': self.get_cookie('csrftoken') or '',
+            'next': '/thumbs/list_img/'
+        }).encode()
+        send(self.opener, self.url('/api-auth/login/'), data=data, headers={'Referer': self.url('/api-auth/login/')})
+        return self.get_cookie('sessionid') is not None
+
+    def prepare(self):
+        '''
+        Collects ids of images with kept sources and checks if the plan has expiring links
+        '''
+        _, status, body = send(self.opener, self.url('/thumbs/list_img/'))
+        if status != 200:
+            return
+        self.image_ids = [img['urls']['original']['id'] for img in json.loads(body) if 'original' in img['urls']]
+        if self.image_ids:
+            self.can_link = self.request_link(self.image_ids[0])[1] == 201
+
+    def request_link(self, image_id):
+        query = urllib.parse.urlencode({'img': image_id, 'exp': 3600})
+        latency, status, body = send(self.opener, self.url(f'/thumbs/get_img_temp_link/?{query}'))
+        if status == 201:
+            self.links.append(json.loads(body))
+        return latency, status, body
+
+    def get_endpoints(self):
+        endpoints = ['list_img', 'upload_img']
+        if self.can_link:
+            endpoints.append('get_img_temp_link')
+        if self.links:
+            endpoints.append('tmpLink')
+        return endpoints
+
+    def run(self, endpoint, rng, upload):
+        if endpoint == 'list_img':
+            return send(self.opener, self.url('/thumbs/list_img/'))[:2]
+        if endpoint == 'get_img_temp_link':
+            return self.request_link(rng.choice(self.image_ids))[:2]
+        if endpoint == 'tmpLink':
+            return send(self.opener, rng.choice(self.links))[:2]
+
+        body, content_type = encode_multipart('file', 'load.jpg', upload, 'image/jpeg')
+        return send(self.opener, self.url('/thumbs/upload_img/'), data=body, headers={
+            'Content-Type': content_type,
+            'X-CSRFToken': self.get_cookie('csrftoken') or '',
+            'Referer': self.url('/thumbs/upload_img/')
+        })[:2]
+
+
+def log_in_users(base_url, count, password, concurrency):
+    def log_in(idx):
+        user = VirtualUser(base_url, f'{LOAD_USER_PREFIX}{idx}')
+        if not user.login(password):
+            return None
+        user.prepare()
+        return user
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return [user for user in executor.map(log_in, range(count)) if user is not None]
+
+def get_schedule(users, weights, requests, rng):
+    '''
+    (user, endpoint, seed of the request) items - endpoints a user can't call are skipped when picking
+    '''
+    schedule = []
+    for _ in range(requests):
+        user = rng.choice(users)
+        endpoints = [e for e in user.get_endpoints() if weights[e]]
+        if not endpoints:
+            continue
+        endpoint = rng.choices(endpoints, [weights[e] for e in endpoints])[0]
+        schedule.append((user, endpoint, rng.getrandbits(32)))
+    return schedule
+
+def run_load(schedule, concurrency, upload):
+    results = {}
+    lock = threading.Lock()
+
+    def run(item):
+        user, endpoint, seed = item
+        latency, status = user.run(endpoint, random.Random(seed), upload)
+        with lock:
+            results.setdefault(endpoint, []).append((latency, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(run, schedule))
+    return time.perf_counter() - start, results
+
+def report(total_time, results):
+    for endpoint in ENDPOINTS:
+        if endpoint not in results:
+            continue
+        latencies = [r[0] for r in results[endpoint]]
+        # redirects of temp links are successful responses
+        errors = len([r for r in results[endpoint] if r[1] == 0 or r[1] >= 400])
+        print(format_latencies(endpoint, latencies, total_time) + f' errors={errors}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--password', required=True, help='password of the seeded users')
+    parser.add_argument('--users', type=int, default=50, help='seeded users to log in as')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    for endpoint, weight in [('list_img', 5), ('get_img_temp_link', 2), ('tmpLink', 3), ('upload_img', 0)]:
+        parser.add_argument(f'--{endpoint.replace("_", "-")}-weight', type=int, default=weight, dest=f'{endpoint}_weight')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    users = log_in_users(args.url, args.users, args.password, args.concurrency)
+    if not users:
+        raise SystemExit('No user logged in - check --url, --password and seed_load')
+    print(f'{len(users)} users logged in')
+
+    weights = {endpoint: getattr(args, f'{endpoint}_weight') for endpoint in ENDPOINTS}
+    schedule = get_schedule(users, weights, args.requests, rng)
+    upload = create_upload_image(args.seed) if weights['upload_img'] else None
+
+    report(*run_load(schedule, args.concurrency, upload))
+
+if __name__ == '__main__':
+    main()
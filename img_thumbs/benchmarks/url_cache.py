@@ -0,0 +1,78 @@
+'''
+List response building (get_all_urls) for 10k variants, with and without
+the storage url cache. Uses a storage that signs every url with HMAC,
+the way presigned object store urls are generated.
+
+    python -m benchmarks.url_cache --variants 10000
+'''
+import argparse
+import hashlib
+import hmac
+import os
+import time
+
+import django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', type=int, default=10000)
+    parser.add_argument('--variants-per-image', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'img_thumbs.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.core.files.storage import FileSystemStorage
+
+    from thumbs.models import UserImage
+    from thumbs.storage_urls import url_provider
+
+    class SigningStorage(FileSystemStorage):
+        querystring_auth = True
+        querystring_expire = 3600
+
+        def url(self, name):
+            expires = int(time.time()) + self.querystring_expire
+            signature = hmac.new(
+                b'secret-key',
+                f'GET\n{expires}\n{name}'.encode(),
+                hashlib.sha256
+            ).hexdigest()
+            return f'{super().url(name)}?Expires={expires}&Signature={signature}'
+
+    UserImage._meta.get_field('file').storage = SigningStorage(base_url='/media/')
+
+    images = []
+    for idx in range(args.variants // args.variants_per_image):
+        img = UserImage(pk=idx, file=f'photos/1/{idx}.jpg')
+        img.manifest = [
+            {'key': 200 * (v + 1), 'id': idx * 10 + v, 'name': f'photos/1/{idx}_{v}.jpg', 'format': 'JPEG', 'size': 0}
+            for v in range(args.variants_per_image)
+        ]
+        images.append(img)
+
+    def build_response():
+        start = time.perf_counter()
+        [{'id': img.pk, 'urls': img.get_all_urls()} for img in images]
+        return time.perf_counter() - start
+
+    def run(name, prepare):
+        times = []
+        for _ in range(args.rounds):
+            prepare()
+            times.append(build_response())
+        best = min(times) * 1000
+        print(f'{name:<12} variants={len(images) * args.variants_per_image} best={best:8.2f}ms')
+
+    settings.THUMBS_URL_CACHE_TTL = 0
+    run('no cache', lambda: None)
+
+    settings.THUMBS_URL_CACHE_TTL = 3600
+    run('cold cache', url_provider.clear)
+    run('warm cache', lambda: None)
+
+if __name__ == '__main__':
+    main()
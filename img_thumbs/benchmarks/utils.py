@@ -0,0 +1,95 @@
+'''
+Shared helpers for the benchmark scripts.
+Run the scripts from the project dir, e.g. `python -m benchmarks.async_views`.
+'''
+import os
+import statistics
+import time
+
+import django
+
+
+def setup_django():
+    '''
+    Configures django and creates a throwaway test database
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'img_thumbs.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+def teardown_django():
+    from django.db import connection
+    connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+
+def create_user_with_images(username, image_count, rule_heights=(200, 400), use_expiring_links=True):
+    '''
+    Creates a user with image trees directly in DB (no files are written).
+    Returns the user and a list of root images.
+    '''
+    from django.contrib.auth.models import User
+
+    from thumbs.models import ThumbPlan, ThumbRule, ThumbUser, UserImage
+
+    rules = [ThumbRule.objects.get_or_create(height=h, width__isnull=True)[0] for h in rule_heights]
+    plan, _ = ThumbPlan.objects.get_or_create(
+        name=f'BENCH_{len(rules)}',
+        defaults={'use_source_img': True, 'use_expiring_links': use_expiring_links}
+    )
+    plan.thumb_rules.set(rules)
+
+    # images are created before the ThumbUser profile, so the thumbnail pipeline is skipped
+    user = User.objects.create_user(username=username)
+
+    # bulk_create doesn't return pks on every backend, so roots are created one by one
+    roots = [
+        UserImage.objects.create(user=user, file=f'photos/{user.pk}/{idx}.jpg')
+        for idx in range(image_count)
+    ]
+
+    UserImage.objects.bulk_create([
+        UserImage(
+            user=user,
+            parent=root,
+            thumb_rule=rule,
+            file=f'photos/{user.pk}/{root.pk}_{rule.height}.jpg'
+        )
+        for root in roots for rule in rules
+    ])
+
+    # files don't exist, so manifests are written with fake sizes
+    for root in roots:
+        root.manifest = [
+            {'key': thumb.thumb_rule.get_key(), 'id': thumb.pk, 'name': thumb.file.name, 'format': 'JPEG', 'size': 0}
+            for thumb in root.thumbs.select_related('thumb_rule')
+        ] + [{'key': 'original', 'id': root.pk, 'name': root.file.name, 'format': 'JPEG', 'size': 0}]
+    UserImage.objects.bulk_update(roots, ['manifest'])
+
+    ThumbUser.objects.create(user=user, plan=plan)
+    return user, roots
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def format_latencies(name, latencies, total_time=None):
+    '''
+    Formats a one line summary of a list of latencies (in seconds)
+    '''
+    latencies = sorted(latencies)
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    line = (
+        f'{name:<32} n={len(latencies):<6} '
+        f'mean={statistics.mean(latencies) * 1000:8.2f}ms '
+        f'p50={pct(0.50):8.2f}ms p95={pct(0.95):8.2f}ms p99={pct(0.99):8.2f}ms'
+    )
+    if total_time:
+        line += f' rps={len(latencies) / total_time:8.1f}'
+    return line
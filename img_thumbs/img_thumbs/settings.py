@@ -84,9 +84,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # read replica of default (the same file in development), used if listed in THUMBS_READ_REPLICAS
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
 
+DATABASE_ROUTERS = ['thumbs.db_routing.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -139,3 +146,137 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 #Temp links
 TEMP_LINK_MIN_SECONDS = 300
 TEMP_LINK_MAX_SECONDS = 30000
+#max images in a single batch request
+TEMP_LINK_BATCH_MAX = 500
+
+#Storage url cache
+#memoized storage.url() results - seconds (0 disables the cache) and max entries per process
+THUMBS_URL_CACHE_TTL = int(os.getenv('THUMBS_URL_CACHE_TTL', 3600))
+THUMBS_URL_CACHE_SIZE = 100000
+#signed urls are dropped from the cache this many seconds before they expire
+THUMBS_URL_CACHE_SIGNED_MARGIN = 300
+
+#Upload idempotency keys
+#cache alias for stored responses - has to be shared between processes in production
+THUMBS_IDEMPOTENCY_CACHE = 'default'
+#seconds a response is kept for retries
+THUMBS_IDEMPOTENCY_TTL = 24 * 60 * 60
+#max seconds a duplicate request waits for the in-flight one
+THUMBS_IDEMPOTENCY_LOCK_TIMEOUT = 60
+THUMBS_IDEMPOTENCY_POLL_INTERVAL = 0.2
+
+#Resumable uploads
+THUMBS_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'upload_tmp')
+THUMBS_UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+THUMBS_UPLOAD_MAX_CHUNK = 16 * 1024 * 1024
+#seconds after which unfinished upload sessions are dropped
+THUMBS_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+#Upload throttling (per plan limits are set on ThumbPlan)
+#cache alias for buckets and counters - has to be shared between processes in production
+THUMBS_THROTTLE_CACHE = 'default'
+#seconds after which job counters leaked by killed workers expire
+THUMBS_JOB_SLOT_TIMEOUT = 10 * 60
+
+#Low memory decoding
+#images above this many pixels are reduced on decode (JPEG) or decoded in bands,
+#formats which can't be decoded this way are decoded in full (0 - disabled)
+THUMBS_LOW_MEMORY_PIXELS = int(os.getenv('THUMBS_LOW_MEMORY_PIXELS', 40_000_000))
+
+#Thumbnail jobs scheduling
+#concurrent thumbnail jobs per process, further jobs wait ordered by plan tier and age (0 - no limit)
+THUMBS_SCHEDULER_SLOTS = int(os.getenv('THUMBS_SCHEDULER_SLOTS', 4))
+#max seconds a job waits for a slot, the request fails with 503 after that (0 - no limit)
+THUMBS_SCHEDULER_TIMEOUT = int(os.getenv('THUMBS_SCHEDULER_TIMEOUT', 30))
+#cache alias for rule request counters
+THUMBS_SCHEDULER_CACHE = 'default'
+
+#Upload staging
+#storage prefix files are written to until the upload transaction commits
+THUMBS_STAGING_PREFIX = 'staging'
+#seconds after which staged files are swept (sweep_staged_files command)
+THUMBS_STAGING_TTL = 60 * 60
+
+#Source retention (see ThumbPlan.source_retention_days)
+#storage of retained sources of plans without use_source_img
+THUMBS_COLD_STORAGE_BACKEND = 'django.core.files.storage.FileSystemStorage'
+THUMBS_COLD_STORAGE_OPTIONS = {'location': os.path.join(BASE_DIR, 'cold_storage')}
+#formats gzip compressed in the cold storage, others (JPEG, PNG, GIF, WEBP) don't shrink and are stored as is
+THUMBS_COLD_STORAGE_COMPRESS_FORMATS = ('BMP', 'TIFF', 'PPM')
+THUMBS_COLD_STORAGE_COMPRESS_LEVEL = 6
+#expired sources deleted per batch (expire_cold_sources command)
+THUMBS_COLD_EXPIRY_BATCH = 500
+
+#Storage reclaim (reclaim_storage command)
+#orphaned files modified within this many seconds are kept - their rows may not be committed yet
+THUMBS_RECLAIM_GRACE_SECONDS = 60 * 60
+#orphans deleted per batch, each batch is checked against the DB once more
+THUMBS_RECLAIM_BATCH = 1000
+
+#Profiling of thumbnail jobs (cProfile + tracemalloc, see profile_report command)
+#one in this many jobs is profiled (0 - disabled)
+THUMBS_PROFILE_SAMPLE_RATE = int(os.getenv('THUMBS_PROFILE_SAMPLE_RATE', 0))
+#jobs of staff requests with this header are always profiled
+THUMBS_PROFILE_HEADER = 'X-Thumbs-Profile'
+THUMBS_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+#newest samples kept in the directory
+THUMBS_PROFILE_MAX_SAMPLES = 100
+
+#Metrics (metrics endpoint, Prometheus text format)
+#directory each worker process writes its metrics to, merged on scrape -
+#has to be set (and shared) when running multiple worker processes, otherwise only
+#the metrics of the process serving the scrape are reported
+THUMBS_METRICS_DIR = os.getenv('THUMBS_METRICS_DIR') or None
+#min seconds between writes of process metrics to the directory
+THUMBS_METRICS_FLUSH_INTERVAL = 5
+
+#Signed token auth (Authorization: Bearer <token>, see thumbs.authentication)
+#seconds a token is valid - also the longest a plan change or deactivation of its user takes to apply
+THUMBS_TOKEN_MAX_AGE = 60 * 60
+#seconds plans of token users are memoized per process
+THUMBS_TOKEN_PLAN_CACHE_TTL = 60
+
+REST_FRAMEWORK = {
+    # session auth goes first - unauthenticated requests are still answered with 403
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'thumbs.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ]
+}
+
+#Read replicas (see thumbs.db_routing)
+#DATABASES aliases list and temp link views read from, e.g. 'replica' (empty - all reads from default)
+THUMBS_READ_REPLICAS = [
+    r.strip() for r in os.getenv('THUMBS_READ_REPLICAS', '').split(',') if r.strip()
+]
+#seconds reads of a client stay on default after its upload or temp link creation - a cookie
+THUMBS_REPLICA_STICKY_SECONDS = 30
+THUMBS_REPLICA_STICKY_COOKIE = 'thumbs_primary'
+
+#Admin
+#changelists of tables with more rows show an estimated count (PostgreSQL, MySQL)
+THUMBS_ADMIN_EXACT_COUNT_MAX = 100_000
+#bulk actions run in a background thread, in chunks of this many objects
+THUMBS_ADMIN_JOBS_IN_BACKGROUND = True
+THUMBS_ADMIN_JOB_CHUNK = 500
+
+#Near-duplicate uploads
+#max Hamming distance of perceptual hashes (exact lookups up to 3, None disables the lookup),
+#'flag' only stores duplicate_of, 'reuse' also copies the thumbnails of the duplicate
+THUMBS_DUPLICATE_MAX_DISTANCE = 3
+THUMBS_DUPLICATE_ACTION = os.getenv('THUMBS_DUPLICATE_ACTION', 'flag')
+
+#Sprite sheets
+#thumbnails per sheet, max sheet width in pixels and JPEG quality
+THUMBS_SPRITE_PAGE_SIZE = 100
+THUMBS_SPRITE_MAX_WIDTH = 2048
+THUMBS_SPRITE_QUALITY = 85
+#max seconds a page update holds the per user, rule and page lock
+THUMBS_SPRITE_LOCK_TIMEOUT = 60
+
+#Async views
+#routes served by async-native views (under ASGI), e.g. ['list_img', 'tmpLink']
+THUMBS_ASYNC_ROUTES = [
+    r.strip() for r in os.getenv('THUMBS_ASYNC_ROUTES', '').split(',') if r.strip()
+]
@@ -1,26 +1,97 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
+from thumbs.jobs import purge_expired_links, regenerate_thumbs, run_job
 from thumbs.models import (ImageTempLink, ThumbPlan, ThumbRule, ThumbUser,
-                           UserImage)
+                           UploadSession, UserImage)
+
+ESTIMATED_COUNT_QUERIES = {
+    'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    'mysql': 'SELECT table_rows FROM information_schema.tables '
+             'WHERE table_schema = DATABASE() AND table_name = %s',
+}
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Uses table statistics instead of COUNT(*) for unfiltered changelists
+    of large tables. Exact count is used for small tables, filtered querysets
+    and backends without the statistics.
+    '''
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        sql = ESTIMATED_COUNT_QUERIES.get(connection.vendor)
+
+        if sql is not None and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] and row[0] > settings.THUMBS_ADMIN_EXACT_COUNT_MAX:
+                return int(row[0])
+
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''
+    Changelist of a table with millions of rows - no COUNT(*) of the whole table
+    '''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
-# Register your models here.
 @admin.register(ThumbRule)
 class ThumbRuleAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('__str__', 'width', 'height')
 
 @admin.register(ThumbPlan)
-class ThumbRuleAdmin(admin.ModelAdmin):
-    pass
+class ThumbPlanAdmin(admin.ModelAdmin):
+    list_display = ('name', 'use_source_img', 'use_expiring_links', 'priority')
 
 @admin.register(ThumbUser)
-class ThumbRuleAdmin(admin.ModelAdmin):
-    pass
+class ThumbUserAdmin(admin.ModelAdmin):
+    list_display = ('user', 'plan')
+    list_select_related = ('user', 'plan')
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
 
 @admin.register(UserImage)
-class ThumbRuleAdmin(admin.ModelAdmin):
-    pass
+class UserImageAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'user', 'parent_id', 'thumb_rule', 'file')
+    list_select_related = ('user', 'thumb_rule')
+    raw_id_fields = ('user', 'parent')
+    # exact lookups only, so the searches use indexes
+    search_fields = ('=id', '=user__username')
+    exclude = ('manifest', 'placeholder')
+    actions = ['regenerate_thumbs']
+
+    @admin.action(description='Regenerate thumbnails of selected images')
+    def regenerate_thumbs(self, request, queryset):
+        ids = list(queryset.filter(parent__isnull=True).values_list('pk', flat=True))
+        run_job(regenerate_thumbs, ids)
+        self.message_user(request, f'Regenerating thumbnails of {len(ids)} images.')
 
 @admin.register(ImageTempLink)
-class ThumbRuleAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+class ImageTempLinkAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'expiration')
+    # __str__ shows the image pk, so no join is needed
+    raw_id_fields = ('image',)
+    search_fields = ('=image__id',)
+    actions = ['purge_expired_links']
+
+    @admin.action(description='Purge expired links among selected')
+    def purge_expired_links(self, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        run_job(purge_expired_links, ids)
+        self.message_user(request, f'Purging expired links among {len(ids)} selected.')
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'filename', 'size', 'offset', 'created')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
@@ -0,0 +1,73 @@
+'''
+Async-native versions of the high-volume, read-only endpoints.
+Django ORM is sync only, so DB access runs through a single thread-sensitive
+sync_to_async hop per request, instead of the whole DRF view running in a thread.
+Selected per route with the THUMBS_ASYNC_ROUTES setting.
+'''
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.http.response import HttpResponseRedirect
+from rest_framework import status
+from rest_framework.exceptions import (APIException, AuthenticationFailed,
+                                       NotAuthenticated, PermissionDenied)
+
+from thumbs.authentication import SignedTokenAuthentication
+from thumbs.db_routing import replica_reads
+from thumbs.views import (get_image_list, get_temp_link_url,
+                          parse_temp_link_slug)
+
+
+def error_response(exc):
+    return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+
+@sync_to_async
+def get_authenticated_user(request):
+    '''
+    Evaluates the lazy request.user (session lookup) outside of the event loop,
+    then falls back to a signed token (no DB access)
+    '''
+    user = request.user
+    if user.is_authenticated:
+        return user
+
+    # same as DRF with session auth first - no WWW-Authenticate header, so 403
+    try:
+        result = SignedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed as e:
+        raise PermissionDenied(e.detail)
+    if result is None:
+        raise PermissionDenied(NotAuthenticated.default_detail)
+    return result[0]
+
+async def image_list_view(request):
+    '''
+    Lists all images owned by request user
+    '''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        user = await get_authenticated_user(request)
+        with replica_reads(request):
+            img_list = await sync_to_async(get_image_list)(user)
+    except APIException as e:
+        return error_response(e)
+
+    return JsonResponse(img_list, safe=False, status=status.HTTP_200_OK)
+
+async def parse_image_temp_link_view(request, slug):
+    '''
+    Decodes a slug value, pointing to ImageTempLink objects.
+    If valid, returns a redirect to image file url.
+    '''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        pk = parse_temp_link_slug(slug)
+        with replica_reads(request):
+            url = await sync_to_async(get_temp_link_url)(pk)
+    except APIException as e:
+        return error_response(e)
+
+    return HttpResponseRedirect(url)
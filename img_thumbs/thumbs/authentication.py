@@ -0,0 +1,54 @@
+'''
+Signed token authentication for API clients - Authorization: Bearer <token>.
+A token carries the user and plan ids and is verified by its signature only,
+so authenticating a request takes no queries (unlike sessions, which load
+the session row and the user). Tokens are valid for THUMBS_TOKEN_MAX_AGE
+seconds - plan changes and deactivation of the user take effect once the
+token expires.
+'''
+from django.conf import settings
+from django.core import signing
+from rest_framework.authentication import (BaseAuthentication,
+                                           get_authorization_header)
+from rest_framework.exceptions import AuthenticationFailed
+
+from thumbs.models import ThumbUser, TokenUser
+
+TOKEN_KEYWORD = 'Bearer'
+TOKEN_SALT = 'thumbs.token'
+
+
+def create_token(user):
+    # the current plan, also when a token is renewed with a token
+    plan_id = ThumbUser.objects.filter(user_id=user.pk).values_list('plan_id', flat=True).first()
+    return signing.dumps({'u': user.pk, 'p': plan_id}, salt=TOKEN_SALT)
+
+def parse_token(token):
+    '''
+    Returns a TokenUser of a valid token, without DB access
+    '''
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=settings.THUMBS_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise AuthenticationFailed('Token expired.')
+    except signing.BadSignature:
+        raise AuthenticationFailed('Invalid token.')
+    return TokenUser.from_token(data['u'], data['p'])
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != TOKEN_KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Invalid token header.')
+        return parse_token(token), token
+
+    def authenticate_header(self, request):
+        return TOKEN_KEYWORD
@@ -0,0 +1,61 @@
+'''
+Cold storage tier for originals of plans without use_source_img.
+Sources are kept in a separate storage for ThumbPlan.source_retention_days, so thumbs
+can be regenerated (e.g. for a rule added later) without another upload.
+Only formats without compression of their own (THUMBS_COLD_STORAGE_COMPRESS_FORMATS)
+are gzip compressed, the rest is stored as is.
+'''
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.utils.module_loading import import_string
+
+COLD_SUFFIX = '.gz'
+
+
+def get_cold_storage():
+    storage_class = import_string(settings.THUMBS_COLD_STORAGE_BACKEND)
+    return storage_class(**settings.THUMBS_COLD_STORAGE_OPTIONS)
+
+def should_compress(format):
+    return format in settings.THUMBS_COLD_STORAGE_COMPRESS_FORMATS
+
+def get_cold_name(name, compressed):
+    return name + COLD_SUFFIX if compressed else name
+
+def is_compressed(cold_name):
+    return cold_name.endswith(COLD_SUFFIX)
+
+def get_source_name(cold_name):
+    return cold_name[:-len(COLD_SUFFIX)] if is_compressed(cold_name) else cold_name
+
+def compress_file(fp):
+    '''
+    Returns a gzip compressed copy of a file, spooled to disk if large
+    '''
+    compressed = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=settings.THUMBS_COLD_STORAGE_COMPRESS_LEVEL) as gz:
+        shutil.copyfileobj(fp, gz)
+    compressed.seek(0)
+    return File(compressed)
+
+@contextmanager
+def restore_cold_file(cold_name):
+    '''
+    Copies a cold source to a temp file (decompressed if needed), yields its path
+    '''
+    suffix = os.path.splitext(get_source_name(cold_name))[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as restored:
+        with get_cold_storage().open(cold_name, 'rb') as f:
+            if is_compressed(cold_name):
+                with gzip.GzipFile(fileobj=f, mode='rb') as gz:
+                    shutil.copyfileobj(gz, restored)
+            else:
+                shutil.copyfileobj(f, restored)
+        restored.flush()
+        yield restored.name
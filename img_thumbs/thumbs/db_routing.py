@@ -0,0 +1,76 @@
+'''
+Read replica routing.
+Read-only views (image list, temp links) run their queries on one of the
+THUMBS_READ_REPLICAS databases. Writes always go to the primary (default).
+Clients which wrote recently (uploaded an image, created a temp link) get
+a short lived cookie and are read from the primary until it expires, so they
+see their own writes before the replicas catch up.
+'''
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+read_database = contextvars.ContextVar('read_database', default=None)
+
+
+def get_read_database(request):
+    '''
+    Replica to read from for a request, None (the primary) for clients which wrote recently
+    '''
+    replicas = settings.THUMBS_READ_REPLICAS
+    if not replicas or request.COOKIES.get(settings.THUMBS_REPLICA_STICKY_COOKIE):
+        return None
+    return random.choice(replicas)
+
+@contextmanager
+def reads_from(alias):
+    '''
+    Routes reads of the block to a database (None - the primary)
+    '''
+    token = read_database.set(alias)
+    try:
+        yield alias
+    finally:
+        read_database.reset(token)
+
+def replica_reads(request):
+    return reads_from(get_read_database(request))
+
+def stick_to_primary(response):
+    '''
+    Reads of the client go to the primary for THUMBS_REPLICA_STICKY_SECONDS after it wrote
+    '''
+    if settings.THUMBS_READ_REPLICAS:
+        response.set_cookie(
+            settings.THUMBS_REPLICA_STICKY_COOKIE,
+            '1',
+            max_age=settings.THUMBS_REPLICA_STICKY_SECONDS,
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+class ReplicaRouter():
+    '''
+    Sends reads within reads_from blocks to the selected database, writes to the primary
+    '''
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        # objects read from a replica are written to the primary
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.THUMBS_READ_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *settings.THUMBS_READ_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -0,0 +1,67 @@
+'''
+Near-duplicate detection of uploads (resized or re-encoded copies of the same image).
+A 64-bit perceptual hash (DCT hash) is computed from the decoded source and stored
+on the root image. It is split into HASH_BANDS bands of BAND_BITS bits, indexed per user
+(see ImageHashBucket) - two hashes within HASH_BANDS - 1 bits of each other share
+at least one band, so candidates are found by exact band lookups and only they
+are compared by their Hamming distance.
+'''
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from thumbs.processing import flatten_transparency
+
+DCT_SIZE = 32
+HASH_SIZE = 8
+HASH_BANDS = 4
+BAND_BITS = 64 // HASH_BANDS
+
+
+@lru_cache(maxsize=None)
+def get_dct_matrix(size):
+    '''
+    Orthonormal DCT-II matrix, the DCT of a block is M @ block @ M.T
+    '''
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def to_signed(value):
+    '''
+    Hashes are stored in signed 64-bit columns
+    '''
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+def perceptual_hash(image):
+    '''
+    DCT hash of an image - bits of the lowest HASH_SIZE x HASH_SIZE frequencies of
+    the DCT_SIZE x DCT_SIZE grayscale image, set where they are above their median
+    '''
+    pixels = np.asarray(
+        flatten_transparency(image).convert('L').resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR),
+        dtype=np.float64
+    )
+
+    matrix = get_dct_matrix(DCT_SIZE)
+    low = (matrix @ pixels @ matrix.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # the DC term is left out of the median, it only carries the mean brightness
+    bits = low > np.median(low[1:])
+    return to_signed(int.from_bytes(np.packbits(bits).tobytes(), 'big'))
+
+def get_bands(phash):
+    value = to_unsigned(phash)
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(HASH_BANDS)]
+
+def hamming_distances(phash, hashes):
+    '''
+    Numbers of differing bits between a hash and an array of hashes
+    '''
+    diff = np.bitwise_xor(np.asarray(hashes, dtype=np.int64), np.int64(phash))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+IN_FLIGHT = 'in-flight'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyKeyInFlight(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed.'
+    default_code = 'idempotency_key_in_flight'
+
+
+def get_idempotency_key(request):
+    key = request.META.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({'Idempotency-Key': 'Invalid key.'})
+    return key
+
+def get_upload_fingerprint(request):
+    '''
+    Identifies an upload request, so a key can't be reused for a different file
+    '''
+    file = request.FILES.get('file')
+    if file is None:
+        return ''
+    return f'{file.name}:{file.size}'
+
+
+class IdempotencyStore():
+    '''
+    Keeps responses of processed requests per (user, key) for a configured window.
+    A retry gets the stored response. A duplicate arriving while the first request
+    is still processed waits for its result instead of running the pipeline again.
+    Uses a Django cache - it has to be shared (memcached, redis, db)
+    when the app runs in multiple processes.
+    '''
+    def __init__(self, cache_alias, ttl, lock_timeout, poll_interval):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_cache_key(self, scope, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'thumbs:idempotency:{scope}:{digest}'
+
+    def get_result(self, cache_key, fingerprint):
+        result = self.cache.get(cache_key)
+        if result is None or result == IN_FLIGHT:
+            return result
+        if result['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReused
+        return result
+
+    def get_stored(self, scope, key, fingerprint):
+        '''
+        Returns (status code, data) stored for a processed request, None if there is none yet
+        '''
+        result = self.get_result(self.get_cache_key(scope, key), fingerprint)
+        if result is None or result == IN_FLIGHT:
+            return None
+        return result['status'], result['data']
+
+    def wait_for_result(self, cache_key, fingerprint):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            result = self.get_result(cache_key, fingerprint)
+            if result != IN_FLIGHT:
+                return result
+        raise IdempotencyKeyInFlight
+
+    @contextmanager
+    def keep_in_flight(self, cache_key):
+        '''
+        Refreshes the in-flight marker while the request is processed - it expires
+        lock_timeout after the worker dies, not after the request started
+        '''
+        stop = threading.Event()
+
+        def refresh():
+            try:
+                while not stop.wait(self.lock_timeout / 3):
+                    self.cache.touch(cache_key, self.lock_timeout)
+            finally:
+                # DB connections (of a database cache) are per thread
+                connections.close_all()
+
+        thread = threading.Thread(target=refresh, name='thumbs-idempotency', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def run(self, scope, key, fingerprint, func):
+        '''
+        Returns (status code, data) of a request - either stored or produced by func
+        '''
+        cache_key = self.get_cache_key(scope, key)
+
+        while True:
+            result = self.get_result(cache_key, fingerprint)
+            if result == IN_FLIGHT:
+                result = self.wait_for_result(cache_key, fingerprint)
+            if result is not None:
+                return result['status'], result['data']
+
+            # the original request failed or the result expired - try to take over
+            if self.cache.add(cache_key, IN_FLIGHT, timeout=self.lock_timeout):
+                break
+
+        try:
+            with self.keep_in_flight(cache_key):
+                status_code, data = func()
+        except Exception:
+            self.cache.delete(cache_key)
+            raise
+
+        # conflicts depend on the current state (e.g. an incomplete upload), retries run again
+        if status.is_server_error(status_code) or status_code == status.HTTP_409_CONFLICT:
+            self.cache.delete(cache_key)
+        else:
+            self.cache.set(cache_key, {
+                'fingerprint': fingerprint,
+                'status': status_code,
+                'data': data
+            }, timeout=self.ttl)
+
+        return status_code, data
+
+
+idempotency_store = IdempotencyStore(
+    cache_alias=settings.THUMBS_IDEMPOTENCY_CACHE,
+    ttl=settings.THUMBS_IDEMPOTENCY_TTL,
+    lock_timeout=settings.THUMBS_IDEMPOTENCY_LOCK_TIMEOUT,
+    poll_interval=settings.THUMBS_IDEMPOTENCY_POLL_INTERVAL
+)
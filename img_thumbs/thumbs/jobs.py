@@ -0,0 +1,96 @@
+'''
+Chunked maintenance jobs, started from the admin or management commands.
+Objects are processed in chunks of ids (one transaction per image or chunk),
+so a job over millions of rows neither holds a long transaction
+nor loads all the objects at once.
+'''
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from thumbs.cold_storage import get_cold_storage
+from thumbs.models import ImageTempLink, UserImage
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def run_job(func, *args):
+    '''
+    Runs a job in a background thread (or inline, if background jobs are disabled)
+    '''
+    if not settings.THUMBS_ADMIN_JOBS_IN_BACKGROUND:
+        return func(*args)
+
+    def target():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Job %s failed', func.__name__)
+        finally:
+            # DB connections are per thread, so they are not closed by the request cycle
+            connections.close_all()
+
+    threading.Thread(target=target, name=f'thumbs-{func.__name__}', daemon=True).start()
+
+def regenerate_thumbs(image_ids):
+    '''
+    Renders thumbs of root images again, from the source file or its cold copy.
+    Images with neither are skipped.
+    Returns number of processed images.
+    '''
+    count = 0
+    for chunk in chunked(image_ids, settings.THUMBS_ADMIN_JOB_CHUNK):
+        images = UserImage.objects.filter(
+            pk__in=chunk,
+            parent__isnull=True,
+            user__thumb_user__isnull=False
+        ).filter(
+            Q(file__gt='') | Q(cold_file__gt='')
+        ).select_related('user__thumb_user__plan')
+
+        for image in images:
+            image.regenerate_thumbs()
+            count += 1
+    return count
+
+def purge_expired_links(link_ids):
+    '''
+    Deletes expired links among the given ones. Returns number of deleted links.
+    '''
+    count = 0
+    now = timezone.now()
+    for chunk in chunked(link_ids, settings.THUMBS_ADMIN_JOB_CHUNK):
+        deleted, _ = ImageTempLink.objects.filter(pk__in=chunk, expiration__lt=now).delete()
+        count += deleted
+    return count
+
+def expire_cold_sources():
+    '''
+    Deletes cold copies of sources past their retention, in batches.
+    Rows are cleared first, so a crash leaves only orphaned files (see reclaim_storage --cold).
+    Returns number of deleted copies.
+    '''
+    storage = get_cold_storage()
+    count = 0
+    while True:
+        with transaction.atomic():
+            batch = list(UserImage.objects.filter(
+                cold_expires__lt=timezone.now()
+            ).order_by('cold_expires').values_list('pk', 'cold_file')[:settings.THUMBS_COLD_EXPIRY_BATCH])
+            if not batch:
+                return count
+
+            UserImage.objects.filter(pk__in=[pk for pk, _ in batch]).update(cold_file='', cold_expires=None)
+
+        for _, name in batch:
+            if name:
+                storage.delete(name)
+        count += len(batch)
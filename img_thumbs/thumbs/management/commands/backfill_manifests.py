@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from thumbs.models import UserImage
+
+
+class Command(BaseCommand):
+    help = 'Stores manifests of images uploaded before manifests were introduced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='images updated per query of pks')
+
+    def handle(self, *args, **options):
+        count = 0
+        while True:
+            # updated images drop out of the filter, so the next batch is read from the start again
+            ids = list(UserImage.objects.filter(
+                parent__isnull=True,
+                manifest__isnull=True
+            ).order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+
+            for img in UserImage.objects.filter(pk__in=ids):
+                img.update_manifest()
+            count += len(ids)
+
+        print(f'stored manifests of {count} images')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from thumbs.jobs import expire_cold_sources
+
+
+class Command(BaseCommand):
+    help = 'Deletes cold copies of sources past their retention period'
+
+    def handle(self, *args, **options):
+        count = expire_cold_sources()
+        print(f'removed {count} expired source copies')
@@ -0,0 +1,49 @@
+import os
+import pstats
+import sys
+import tracemalloc
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from thumbs.profiling import CPU_SUFFIX, MEMORY_SUFFIX, get_sample_names
+
+
+class Command(BaseCommand):
+    help = 'Aggregates sampled thumbnail job profiles - top functions and allocation sites'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='rows of each table')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key of functions')
+
+    def handle(self, *args, **options):
+        directory = settings.THUMBS_PROFILE_DIR
+        samples = sorted(get_sample_names(directory))
+        if not samples:
+            raise CommandError(f'no profiles in {directory}')
+
+        peaks = sorted(int(sample_name.rsplit('-peak', 1)[1]) for sample_name in samples)
+        print(f'{len(samples)} samples from {directory}')
+        print(f'traced memory peak: median {peaks[len(peaks) // 2] / 1024 / 1024:.1f} MiB, max {peaks[-1] / 1024 / 1024:.1f} MiB')
+
+        stats = pstats.Stats(os.path.join(directory, samples[0] + CPU_SUFFIX), stream=sys.stdout)
+        for sample_name in samples[1:]:
+            stats.add(os.path.join(directory, sample_name + CPU_SUFFIX))
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+
+        # allocations still held at the end of the jobs, summed over samples
+        sizes = defaultdict(int)
+        counts = defaultdict(int)
+        for sample_name in samples:
+            path = os.path.join(directory, sample_name + MEMORY_SUFFIX)
+            if not os.path.exists(path):
+                continue
+            for stat in tracemalloc.Snapshot.load(path).statistics('lineno'):
+                site = str(stat.traceback[0])
+                sizes[site] += stat.size
+                counts[site] += stat.count
+
+        print('top allocation sites (KiB per sample, blocks):')
+        for site in sorted(sizes, key=sizes.get, reverse=True)[:options['limit']]:
+            print(f'{sizes[site] / 1024 / len(samples):12.1f} {counts[site]:10d}  {site}')
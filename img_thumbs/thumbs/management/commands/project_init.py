@@ -29,7 +29,7 @@ class Command(BaseCommand):
         rules = {}
 
         for h in [200,400]:
-            q = ThumbRule.objects.filter(height=h)
+            q = ThumbRule.objects.filter(height=h, width__isnull=True)
             if q.exists():
                 rules[h] = q.first()
                 continue
@@ -62,7 +62,8 @@ class Command(BaseCommand):
             enterprise_plan = ThumbPlan.objects.create(
                 name='Enterprise',
                 use_source_img=True,
-                use_expiring_links=True
+                use_expiring_links=True,
+                priority=1
             )
             enterprise_plan.thumb_rules.set([rules[200],rules[400]])
             print('created Enterprise plan')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from thumbs.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Removes expired resumable upload sessions and their temp files'
+
+    def handle(self, *args, **options):
+        count = UploadSession.delete_expired()
+        print(f'removed {count} expired upload sessions')
@@ -0,0 +1,37 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from thumbs.cold_storage import get_cold_storage
+from thumbs.sprites import SPRITE_PREFIX
+from thumbs.storage_reclaim import UnsortedNamesError, reclaim_storage
+
+
+class Command(BaseCommand):
+    help = 'Finds stored image and sprite sheet files without a DB row and deletes them in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', action='append',
+            help=f'storage path to walk, can be repeated (photos and {SPRITE_PREFIX} by default)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='only report the orphaned files')
+        parser.add_argument('--cold', action='store_true', help='walk the cold storage of retained sources')
+
+    def handle(self, *args, **options):
+        prefixes = options['prefix']
+        if not prefixes:
+            # sprite sheets are in the default storage only
+            prefixes = ['photos'] if options['cold'] else ['photos', SPRITE_PREFIX]
+
+        for prefix in prefixes:
+            try:
+                found, found_bytes, deleted = reclaim_storage(
+                    get_cold_storage() if options['cold'] else default_storage,
+                    prefix=prefix.strip('/'),
+                    field='cold_file' if options['cold'] else 'file',
+                    dry_run=options['dry_run']
+                )
+            except UnsortedNamesError as e:
+                raise CommandError(f'storage and DB names are not in the same order, stopped: {e}')
+
+            print(f'{prefix}: found {found} orphaned files ({found_bytes} bytes), deleted {deleted}')
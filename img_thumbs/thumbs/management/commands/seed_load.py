@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from thumbs.seeding import (LOAD_USER_PREFIX, LoadSeeder, clear_load_data,
+                            get_load_users)
+
+
+class Command(BaseCommand):
+    help = (
+        f'Bulk inserts synthetic users ({LOAD_USER_PREFIX}0, {LOAD_USER_PREFIX}1, ...) with profiles, '
+        'image trees and temp links for load tests, see benchmarks.load_driver'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=10, help='mean images per user')
+        parser.add_argument('--links', type=int, default=2, help='temp links per image of plans with expiring links')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--password', default=None, help='password of all the users, unusable if not given')
+        parser.add_argument('--batch-size', type=int, default=500, help='users per transaction')
+        parser.add_argument('--clear', action='store_true', help='delete previously seeded users first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            count = clear_load_data()
+            print(f'removed {count} seeded users')
+        elif get_load_users().exists():
+            raise CommandError('Seeded users already exist, use --clear to replace them')
+
+        try:
+            seeder = LoadSeeder(
+                images=options['images'],
+                links=options['links'],
+                seed=options['seed'],
+                password=options['password'],
+                batch_size=options['batch_size']
+            )
+        except ValueError as e:
+            raise CommandError(f'{e}, run project_init first')
+
+        counts = seeder.seed(options['users'])
+        print(
+            f'created {counts["users"]} users, {counts["images"]} images, '
+            f'{counts["thumbs"]} thumbs, {counts["links"]} temp links'
+        )
@@ -0,0 +1,14 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from thumbs.cold_storage import get_cold_storage
+from thumbs.storage_reclaim import sweep_staged_files
+
+
+class Command(BaseCommand):
+    help = 'Promotes or removes stale staged files left by interrupted uploads'
+
+    def handle(self, *args, **options):
+        for storage, field in [(default_storage, 'file'), (get_cold_storage(), 'cold_file')]:
+            promoted, deleted = sweep_staged_files(storage, field)
+            print(f'{field}: promoted {promoted} and removed {deleted} stale staged files')
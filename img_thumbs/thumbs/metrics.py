@@ -0,0 +1,280 @@
+'''
+Counters and histograms of the thumbnail pipeline, exposed in the Prometheus
+text format by the metrics view.
+Values are kept in memory by each process. With THUMBS_METRICS_DIR set, every
+process writes its values to its own file there (at most once per
+THUMBS_METRICS_FLUSH_INTERVAL seconds) and a scrape merges the files of all
+the worker processes - counters of a restarted process start from zero,
+which Prometheus handles as a counter reset.
+'''
+import atexit
+import copy
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# default buckets of latency histograms, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+class Metric():
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def get_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get_label_pairs(self, key):
+        return list(zip(self.labelnames, key))
+
+    def merge(self, value, other):
+        raise NotImplementedError
+
+    def get_samples(self, key, value):
+        '''
+        (name, label pairs, value) exposition lines of a labelled value
+        '''
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be increased')
+        self.registry.update(self, self.get_key(labels), lambda value: (value or 0) + amount)
+
+    def merge(self, value, other):
+        return value + other
+
+    def get_samples(self, key, value):
+        return [(self.name, self.get_label_pairs(key), value)]
+
+
+class Histogram(Metric):
+    '''
+    Observations counted in buckets of upper bounds.
+    A value is stored as [count per bucket (incl. +Inf), sum], buckets are cumulated on exposition.
+    '''
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        if 'le' in labelnames:
+            raise ValueError('le is a reserved label of histograms')
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        index = next(idx for idx, bound in enumerate(self.buckets) if value <= bound)
+
+        def add(stored):
+            stored = stored or [[0] * len(self.buckets), 0]
+            stored[0][index] += 1
+            stored[1] += value
+            return stored
+
+        self.registry.update(self, self.get_key(labels), add)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1]]
+
+    def get_samples(self, key, value):
+        pairs = self.get_label_pairs(key)
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value[0]):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', pairs + [('le', format_value(bound))], cumulative))
+        samples.append((f'{self.name}_sum', pairs, value[1]))
+        samples.append((f'{self.name}_count', pairs, cumulative))
+        return samples
+
+
+class MetricsRegistry():
+    '''
+    Metrics of a process, optionally shared with other processes through THUMBS_METRICS_DIR
+    '''
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.last_flush = 0
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def update(self, metric, key, func):
+        with self.lock:
+            if os.getpid() != self.pid:
+                # a forked worker starts with values of its parent, which reports them itself
+                self.pid = os.getpid()
+                self.values = {}
+                self.last_flush = 0
+
+            values = self.values.setdefault(metric.name, {})
+            values[key] = func(values.get(key))
+
+            if time.monotonic() - self.last_flush >= settings.THUMBS_METRICS_FLUSH_INTERVAL:
+                self.flush_locked()
+
+    def get_path(self, pid):
+        return os.path.join(settings.THUMBS_METRICS_DIR, f'{pid}.json')
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        self.last_flush = time.monotonic()
+        if not settings.THUMBS_METRICS_DIR or not self.values:
+            return
+
+        data = {
+            name: [[list(key), value] for key, value in values.items()]
+            for name, values in self.values.items()
+        }
+        os.makedirs(settings.THUMBS_METRICS_DIR, exist_ok=True)
+        path = self.get_path(self.pid)
+        # written aside and renamed, so scrapes never read a partial file
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+    def read_process_values(self):
+        '''
+        Values written by other processes, a list of {name: {key: value}} dicts
+        '''
+        directory = settings.THUMBS_METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return []
+
+        own_name = os.path.basename(self.get_path(self.pid))
+        result = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json') or name == own_name:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            result.append({
+                metric: {tuple(key): value for key, value in values}
+                for metric, values in data.items()
+            })
+        return result
+
+    def collect(self):
+        '''
+        Values of all the processes, merged per metric and labels
+        '''
+        with self.lock:
+            self.flush_locked()
+            # histogram values are mutable, merging must not change the stored ones
+            merged = copy.deepcopy(self.values)
+
+        for process_values in self.read_process_values():
+            for name, values in process_values.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in values.items():
+                    target[key] = metric.merge(target[key], value) if key in target else value
+        return merged
+
+    def exposition(self):
+        '''
+        All the metrics in the Prometheus text exposition format
+        '''
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(values.get(name, {}).items()):
+                for sample_name, pairs, sample_value in metric.get_samples(key, value):
+                    lines.append(f'{sample_name}{format_labels(pairs)} {format_value(sample_value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+
+uploads = registry.counter(
+    'thumbs_uploads_total', 'Uploaded images by plan', ['plan'])
+thumbs_rendered = registry.counter(
+    'thumbs_rendered_total', 'Thumbnails rendered by rule and format', ['rule', 'format'])
+bytes_written = registry.counter(
+    'thumbs_written_bytes_total', 'Bytes of files written to storages', ['kind'])
+near_duplicates = registry.counter(
+    'thumbs_near_duplicates_total', 'Uploads matched to a near-duplicate image, by action', ['action'])
+stage_seconds = registry.histogram(
+    'thumbs_stage_seconds', 'Latency of decoding sources and resizing and encoding thumbnails', ['stage'])
+scheduler_wait_seconds = registry.histogram(
+    'thumbs_scheduler_wait_seconds', 'Time thumbnail jobs waited for a scheduler slot, by plan tier', ['tier'])
+scheduler_run_seconds = registry.histogram(
+    'thumbs_scheduler_run_seconds', 'Time thumbnail jobs held a scheduler slot, by plan tier', ['tier'])
+scheduler_timeouts = registry.counter(
+    'thumbs_scheduler_timeouts_total', 'Thumbnail jobs not admitted within THUMBS_SCHEDULER_TIMEOUT, by plan tier', ['tier'])
+list_requests = registry.counter(
+    'thumbs_list_requests_total', 'Image list requests')
+listed_images = registry.counter(
+    'thumbs_listed_images_total', 'Images returned by image list requests')
+temp_links_issued = registry.counter(
+    'thumbs_temp_links_issued_total', 'Temp links created')
+temp_links_redeemed = registry.counter(
+    'thumbs_temp_links_redeemed_total', 'Temp links redirected to the image')
+temp_links_expired = registry.counter(
+    'thumbs_temp_links_expired_total', 'Temp links rejected on redeem, as expired')
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0002_thumbplan_use_expiring_links'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userimage',
+            name='parent',
+            field=models.ForeignKey(db_index=False, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thumbs', to='thumbs.userimage'),
+        ),
+        migrations.AddIndex(
+            model_name='userimage',
+            index=models.Index(condition=models.Q(('parent__isnull', True)), fields=['user', 'id'], name='userimage_user_root_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userimage',
+            index=models.Index(fields=['parent', 'thumb_rule'], name='userimage_parent_rule_idx'),
+        ),
+    ]
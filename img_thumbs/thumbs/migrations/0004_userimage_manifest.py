@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0003_userimage_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimage',
+            name='manifest',
+            field=models.JSONField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0004_userimage_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbplan',
+            name='animation_max_fps',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='animation_max_frames',
+            field=models.PositiveIntegerField(default=50),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='animation_max_pixels',
+            field=models.PositiveBigIntegerField(default=20000000),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='poster_frame',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='use_animated_thumbs',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0006_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbplan',
+            name='daily_pixel_budget',
+            field=models.PositiveBigIntegerField(default=2000000000),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='max_concurrent_jobs',
+            field=models.PositiveIntegerField(default=2),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='thumbplan',
+            name='uploads_per_minute',
+            field=models.PositiveIntegerField(default=30),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0007_thumbplan_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimage',
+            name='placeholder',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+    ]
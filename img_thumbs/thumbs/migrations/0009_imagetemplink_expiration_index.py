@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0008_userimage_placeholder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagetemplink',
+            name='expiration',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0009_imagetemplink_expiration_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbplan',
+            name='source_retention_days',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='cold_expires',
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='cold_file',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thumbs', '0010_source_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbrule',
+            name='width',
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='thumbrule',
+            name='height',
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='thumbrule',
+            constraint=models.CheckConstraint(check=models.Q(('width__isnull', False), ('height__isnull', False), _connector='OR'), name='thumbrule_width_or_height'),
+        ),
+        migrations.AddConstraint(
+            model_name='thumbrule',
+            constraint=models.UniqueConstraint(condition=models.Q(('width__isnull', True)), fields=('height',), name='thumbrule_unique_height'),
+        ),
+        migrations.AddConstraint(
+            model_name='thumbrule',
+            constraint=models.UniqueConstraint(condition=models.Q(('height__isnull', True)), fields=('width',), name='thumbrule_unique_width'),
+        ),
+        migrations.AddConstraint(
+            model_name='thumbrule',
+            constraint=models.UniqueConstraint(fields=('width', 'height'), name='thumbrule_unique_box'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('thumbs', '0012_tokenuser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpriteSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.PositiveIntegerField()),
+                ('file', models.FileField(blank=True, default='', max_length=255, upload_to='')),
+                ('width', models.PositiveIntegerField(default=0)),
+                ('height', models.PositiveIntegerField(default=0)),
+                ('entries', models.JSONField(default=list)),
+                ('thumb_rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='thumbs.thumbrule')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sprite_sheets', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='spritesheet',
+            constraint=models.UniqueConstraint(fields=('user', 'thumb_rule', 'page'), name='spritesheet_unique_page'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('thumbs', '0013_spritesheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimage',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='thumbs.userimage'),
+        ),
+        migrations.AddField(
+            model_name='userimage',
+            name='phash',
+            field=models.BigIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='ImageHashBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('key', models.PositiveIntegerField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hash_buckets', to='thumbs.userimage')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='imagehashbucket',
+            index=models.Index(fields=['user', 'band', 'key'], name='hashbucket_lookup_idx'),
+        ),
+    ]
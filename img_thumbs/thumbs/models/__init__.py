@@ -1,3 +1,7 @@
 from thumbs.models.models_plan import ThumbPlan, ThumbRule
-from thumbs.models.models_image import ImageTempLink, UserImage
-from thumbs.models.models_user import ThumbUser
+from thumbs.models.models_image import (ImageHashBucket, ImageTempLink,
+                                        UserImage)
+from thumbs.models.models_user import ThumbUser, TokenUser, plan_cache
+
+from thumbs.models.models_upload import UploadSession
+from thumbs.models.models_sprite import SpriteSheet
@@ -1,16 +1,34 @@
+import datetime
 import os
 import uuid
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import signing
+from django.core.files import File
 from django.core.files.base import ContentFile
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from PIL import Image
 
+from thumbs.cold_storage import (compress_file, get_cold_name,
+                                 get_cold_storage, get_source_name,
+                                 restore_cold_file, should_compress)
+from thumbs.dedup import get_bands, hamming_distances, perceptual_hash
+from thumbs.metrics import (bytes_written, near_duplicates, stage_seconds,
+                            thumbs_rendered)
 from thumbs.models import ThumbRule
+from thumbs.processing import PLACEHOLDER_SIZE, decode_source
+from thumbs.profiling import profiler
+from thumbs.scheduler import order_rules, scheduler
+from thumbs.staging import StagedFiles
+from thumbs.storage_urls import get_file_url
 
 
 def get_unique_name(filename):
@@ -20,14 +38,67 @@ def get_unique_name(filename):
 def user_dir_path(instance, filename):
     return 'photos/{}/{}'.format(instance.user.id, get_unique_name(filename))
 
+def get_file_format(filename):
+    '''
+    Image format (as named by PIL) guessed from the file extension
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    return Image.registered_extensions().get(ext)
+
+def get_manifest_entry(key, image, staged=None):
+    size = staged.size(image.file.name) if staged is not None else image.file.size
+    return {
+        'key': key,
+        'id': image.pk,
+        'name': image.file.name,
+        'format': get_file_format(image.file.name),
+        'size': size,
+        'width': image.width,
+        'height': image.height
+    }
+
 
 class UserImage(models.Model):
     user = models.ForeignKey(User, related_name='images', on_delete=models.CASCADE)
     file = models.ImageField(upload_to=user_dir_path, null=True)
 
-    parent = models.ForeignKey('UserImage', related_name='thumbs', on_delete=models.CASCADE, default=None, null=True)
+    # indexed by the composite (parent, thumb_rule) index below
+    parent = models.ForeignKey('UserImage', related_name='thumbs', on_delete=models.CASCADE, default=None, null=True, db_index=False)
     thumb_rule = models.ForeignKey(ThumbRule, null=True, default=None, on_delete=models.PROTECT)
 
+    # denormalized list of variants (thumbs + original) of a root image, see get_manifest_entry
+    manifest = models.JSONField(null=True, default=None)
+
+    # tiny inline preview (data URI) of a root image, see SourceImage.get_placeholder
+    placeholder = models.TextField(null=True, default=None, blank=True)
+
+    # pixel size - of the thumbnail, or the upright size of a root image source
+    width = models.PositiveIntegerField(null=True, default=None, blank=True)
+    height = models.PositiveIntegerField(null=True, default=None, blank=True)
+
+    # compressed source kept in the cold storage until cold_expires, see thumbs.cold_storage
+    cold_file = models.CharField(max_length=255, blank=True, default='')
+    cold_expires = models.DateTimeField(null=True, default=None, db_index=True)
+
+    # perceptual hash of a root image (see thumbs.dedup) and the near-duplicate found on upload
+    phash = models.BigIntegerField(null=True, default=None, blank=True)
+    duplicate_of = models.ForeignKey('UserImage', related_name='near_duplicates', on_delete=models.SET_NULL, default=None, null=True, blank=True)
+
+    class Meta():
+        indexes = [
+            # image listing: user=... AND parent IS NULL, ordered by pk
+            models.Index(
+                fields=['user', 'id'],
+                condition=models.Q(parent__isnull=True),
+                name='userimage_user_root_idx'
+            ),
+            # thumbnails lookup: parent=... joined to thumb_rule
+            models.Index(
+                fields=['parent', 'thumb_rule'],
+                name='userimage_parent_rule_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'Image {self.pk}'
 
@@ -37,83 +108,404 @@ class UserImage(models.Model):
             return
         
         if self.parent == None:
-            super().save(*args, **kwargs)
-            self.create_thumbs()
-            if not self.user.thumb_user.plan.use_source_img:
-                self.file.delete()
+            self.save_with_thumbs(*args, **kwargs)
         else:
             self.create_thumb_file()
             super().save(*args, **kwargs)
 
-
-    def create_thumbs(self):
+    def save_with_thumbs(self, *args, **kwargs):
         '''
-        Creates thumbs for the image, based on owners plan.
+        Upload pipeline - files are staged and thumbs rendered outside of any transaction,
+        then rows of the image and its thumbs are written in a single one and the files
+        are promoted to their names once it commits (see thumbs.staging)
         '''
         plan = self.user.thumb_user.plan
-        rules = plan.thumb_rules.all()
+        staged = StagedFiles(self.file.storage)
+        cold_staged = StagedFiles(get_cold_storage())
+        try:
+            name = self.file.field.generate_filename(self, self.file.name)
+            self.file.name = staged.save(name, self.file)
+            self.file._committed = True
+            bytes_written.inc(staged.size(self.file.name), kind='source')
+
+            thumbs = self.render_thumbs(staged, detect_duplicates=True)
+            if not plan.use_source_img:
+                if plan.source_retention_days:
+                    self.retain_source(staged, cold_staged, plan.source_retention_days)
+                staged.discard(self.file.name)
+                self.file.name = ''
+
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                self.save_thumbs(thumbs)
+                self.update_manifest(staged)
 
-        for rule in rules:
-            UserImage.objects.create(
-                user=self.user,
-                parent=self,
-                thumb_rule=rule
+                staged.promote_on_commit()
+                cold_staged.promote_on_commit()
+        except Exception:
+            staged.delete_all()
+            cold_staged.delete_all()
+            raise
+
+    def retain_source(self, staged, cold_staged, days):
+        '''
+        Keeps a copy of the source in the cold storage for a given number of days,
+        compressed unless its format is already
+        '''
+        path = staged.path(self.file.name)
+        with Image.open(path) as image:
+            compressed = should_compress(image.format)
+        with open(path, 'rb') as f:
+            self.cold_file = cold_staged.save(
+                get_cold_name(self.file.name, compressed),
+                compress_file(f) if compressed else File(f)
             )
+        bytes_written.inc(cold_staged.size(self.cold_file), kind='cold')
+        self.cold_expires = timezone.now() + datetime.timedelta(days=days)
+
+    def get_source_name(self):
+        '''
+        Name of the source file, also if only its cold copy is kept
+        '''
+        if self.file.name:
+            return self.file.name
+        return get_source_name(self.cold_file)
 
-    def create_thumb_file(self):
+    @contextmanager
+    def source_path(self, staged):
+        '''
+        Path of the source file - stored or staged one, otherwise restored from the cold storage
+        '''
+        if self.file.name:
+            yield staged.path(self.file.name)
+            return
+
+        with restore_cold_file(self.cold_file) as path:
+            yield path
+
+    def delete(self, *args, **kwargs):
+        # manifest of the parent is updated by remove_from_parent_manifest
+        cold_file = self.cold_file
+        result = super().delete(*args, **kwargs)
+        if cold_file:
+            storage = get_cold_storage()
+            transaction.on_commit(lambda: storage.delete(cold_file))
+        return result
+
+    def render_thumbs(self, staged, detect_duplicates=False):
+        '''
+        Renders thumbs for the image, based on owners plan, returns their unsaved rows (see save_thumbs).
+        Files are written to the staging area, nothing is written to the DB - no transaction
+        is held open while waiting for a slot and rendering.
+        The perceptual hash is computed from the decoded source. With detect_duplicates,
+        a near-duplicate of the same user is set as duplicate_of and, with
+        THUMBS_DUPLICATE_ACTION = 'reuse', its thumbs are copied instead of rendered.
+        '''
+        plan = self.user.thumb_user.plan
+        rules = list(plan.thumb_rules.all())
+        thumbs = []
+
+        # jobs wait for a free slot by plan tier, rules are rendered cheapest first
+        sample_name = f'image-{Path(self.get_source_name()).stem}'
+        with scheduler.job(plan.priority), profiler.sample(sample_name), self.source_path(staged) as source_path:
+            # decode the source once and share it between all the rules and the placeholder
+            with stage_seconds.time(stage='decode'):
+                source = decode_source(
+                    source_path,
+                    [(PLACEHOLDER_SIZE, PLACEHOLDER_SIZE)] + [rule.get_box() for rule in rules],
+                    limits=plan.get_animation_limits(),
+                    poster_frame=plan.poster_frame,
+                    low_memory_pixels=settings.THUMBS_LOW_MEMORY_PIXELS
+                )
+
+            self.phash = perceptual_hash(source.image)
+            reused = {}
+            if detect_duplicates:
+                self.duplicate_of = self.find_duplicate()
+                if self.duplicate_of is not None:
+                    action = settings.THUMBS_DUPLICATE_ACTION
+                    if action == 'reuse':
+                        reused = self.duplicate_of.get_reusable_thumbs(source)
+                    near_duplicates.inc(action=action)
+
+            for rule in order_rules(rules):
+                thumb = UserImage(
+                    user=self.user,
+                    parent=self,
+                    thumb_rule=rule
+                )
+                if rule.pk in reused:
+                    thumb.copy_thumb_file(reused[rule.pk], staged)
+                else:
+                    thumb.create_thumb_file(source, staged)
+                thumbs.append(thumb)
+
+            self.placeholder = source.get_placeholder()
+            self.width, self.height = source.source_size
+        return thumbs
+
+    def save_thumbs(self, thumbs):
+        '''
+        Writes rows of rendered thumbs, the image's size, placeholder and hash, in the caller's transaction
+        '''
+        for thumb in thumbs:
+            # rendered before the image row was written
+            thumb.parent = self
+            thumb.save()
+
+        UserImage.objects.filter(pk=self.pk).update(
+            placeholder=self.placeholder,
+            width=self.width,
+            height=self.height,
+            phash=self.phash,
+            duplicate_of=self.duplicate_of
+        )
+        ImageHashBucket.index(self)
+
+    def find_duplicate(self):
+        '''
+        Closest near-duplicate among other images of the owner, within THUMBS_DUPLICATE_MAX_DISTANCE bits
+        '''
+        if settings.THUMBS_DUPLICATE_MAX_DISTANCE is None:
+            return None
+        match = ImageHashBucket.find_near_duplicate(
+            self.user,
+            self.phash,
+            settings.THUMBS_DUPLICATE_MAX_DISTANCE,
+            exclude=self.pk
+        )
+        return match[0] if match is not None else None
+
+    def regenerate_thumbs(self):
+        '''
+        Replaces thumbs of the image with new ones, based on current rules of owners plan.
+        Needs the source file or its cold copy. New thumbs are rendered outside of the transaction,
+        their files are promoted and old ones removed once it commits.
+        '''
+        staged = StagedFiles(self.file.storage)
+        try:
+            thumbs = self.render_thumbs(staged)
+
+            with transaction.atomic():
+                old_thumbs = list(self.thumbs.all())
+                self.save_thumbs(thumbs)
+
+                for thumb in old_thumbs:
+                    if thumb.file.name:
+                        staged.discard(thumb.file.name)
+                UserImage.objects.filter(pk__in=[thumb.pk for thumb in old_thumbs]).delete()
+                self.update_manifest(staged)
+
+                staged.promote_on_commit()
+        except Exception:
+            staged.delete_all()
+            raise
+
+    def create_thumb_file(self, source=None, staged=None):
         '''
         Creates a resized image, based on a rule provieded.
+        Source is a decoded parent image, shared between rules - decoded here if not given.
+        With staged files given, the file is written to the staging area.
         '''
         if self.file.name:
             return
 
-        source_path = self.parent.file.path
-        source_image = Image.open(source_path)
-        width = int(source_image.size[0] * self.thumb_rule.height /  source_image.size[1])
+        if source is None:
+            plan = self.user.thumb_user.plan
+            with stage_seconds.time(stage='decode'):
+                source = decode_source(
+                    self.parent.file.path,
+                    [self.thumb_rule.get_box()],
+                    limits=plan.get_animation_limits(),
+                    poster_frame=plan.poster_frame,
+                    low_memory_pixels=settings.THUMBS_LOW_MEMORY_PIXELS
+                )
 
-        thumb_image = source_image.resize((width,self.thumb_rule.height), Image.ANTIALIAS)
         thumb_io = BytesIO()
-
-        thumb_image.save(thumb_io, format=source_image.format)
+        self.width, self.height = source.save_thumb(
+            self.thumb_rule.get_box(),
+            thumb_io,
+            timer=lambda stage: stage_seconds.time(stage=stage)
+        )
+        thumbs_rendered.inc(rule=self.thumb_rule.get_key(), format=source.format)
+        bytes_written.inc(len(thumb_io.getvalue()), kind='thumb')
         
-        path_obj = Path(self.parent.file.name)
+        thumb_path = self.get_thumb_path()
+        content = ContentFile(thumb_io.getvalue())
+
+        if staged is None:
+            self.file.save(thumb_path, content=content, save=False)
+            return
+
+        self.file.name = staged.save(thumb_path, content)
+        self.file._committed = True
+
+    def get_reusable_thumbs(self, source):
+        '''
+        Thumbs of the image by rule, which can be copied for a near-duplicate source.
+        Thumbs are written in the source format, so they are reused only if they are
+        of the same format and equally animated or still - none are reused otherwise.
+        '''
+        thumbs = {}
+        for thumb in self.thumbs.exclude(file='').exclude(file__isnull=True):
+            with thumb.file.open('rb') as f, Image.open(f) as image:
+                if image.format != source.format or getattr(image, 'is_animated', False) != source.is_animated:
+                    return {}
+            thumbs[thumb.thumb_rule_id] = thumb
+        return thumbs
+
+    def get_thumb_path(self):
+        path_obj = Path(self.parent.get_source_name())
         filename = get_unique_name(path_obj.name)
-        thumb_path = os.path.join(path_obj.parent, filename)
+        return os.path.join(path_obj.parent, filename)
 
-        self.file.save(
-            thumb_path,
-            content=ContentFile(thumb_io.getvalue()),
-            save=False
-        )
+    def copy_thumb_file(self, thumb, staged):
+        '''
+        Copies the file of another image's thumb of the same rule to the staging area,
+        instead of rendering one - thumbs of near-duplicates are reused
+        '''
+        with thumb.file.open('rb') as f:
+            self.file.name = staged.save(self.get_thumb_path(), f)
+        self.file._committed = True
+        self.width, self.height = thumb.width, thumb.height
+        bytes_written.inc(staged.size(self.file.name), kind='thumb')
 
-    def get_all_urls(self):
+    def build_manifest(self, staged=None):
         '''
-        Creates a dict of urls to the image, incl. all thumbnails.
-        Keys are thumbnail numeric height values or 'original' for the original image, if present
+        Collects variants of the image from DB and storage (or staged files, not promoted yet)
         '''
-        urls = {}
+        manifest = []
 
-        for thumb in self.thumbs.all().prefetch_related('thumb_rule'):
-            urls[thumb.thumb_rule.height] = {
-                'id':thumb.pk,
-                'url':thumb.file.url
-            }
+        for thumb in self.thumbs.select_related('thumb_rule').order_by('height', 'pk'):
+            manifest.append(get_manifest_entry(thumb.thumb_rule.get_key(), thumb, staged))
 
         if self.file.name:
-            urls['original'] = {
-                'id':self.pk,
-                'url':self.file.url
+            manifest.append(get_manifest_entry('original', self, staged))
+
+        return manifest
+
+    def update_manifest(self, staged=None):
+        '''
+        Rebuilds and stores the manifest, without triggering the save pipeline
+        '''
+        self.manifest = self.build_manifest(staged)
+        UserImage.objects.filter(pk=self.pk).update(manifest=self.manifest)
+
+    def get_all_urls(self):
+        '''
+        Creates a dict of urls to the image, incl. all thumbnails, with their pixel size and bytes.
+        Keys are rule keys (see ThumbRule.get_key) or 'original' for the original image, if present.
+        Read-only - manifests of images stored before they were introduced are built on each call,
+        until stored by the 'backfill_manifests' command.
+        '''
+        manifest = self.manifest
+        if manifest is None:
+            manifest = self.build_manifest()
+
+        urls = {}
+        storage = self.file.storage
+
+        for variant in manifest:
+            urls[variant['key']] = {
+                'id':variant['id'],
+                'url':get_file_url(variant['name'], storage),
+                # manifests built before sizes were stored have none
+                'width': variant.get('width'),
+                'height': variant.get('height'),
+                'size': variant['size']
             }
 
         return urls
         
 
+@receiver(post_delete, sender=UserImage)
+def remove_from_parent_manifest(sender, instance, **kwargs):
+    '''
+    Removes a deleted thumb from the manifest of its image - also on queryset
+    and CASCADE deletes, which don't call UserImage.delete
+    '''
+    if instance.parent_id is None:
+        return
+
+    parent = UserImage.objects.filter(pk=instance.parent_id).only('manifest').first()
+    if parent is None or parent.manifest is None:
+        # deleted together with the thumb, or not built yet
+        return
+
+    manifest = [variant for variant in parent.manifest if variant['id'] != instance.pk]
+    if len(manifest) != len(parent.manifest):
+        UserImage.objects.filter(pk=parent.pk).update(manifest=manifest)
+
+
+class ImageHashBucket(models.Model):
+    '''
+    A band of the perceptual hash of a root image (see thumbs.dedup).
+    Each image has a row per band, near-duplicates are looked up by exact
+    band values of a user, so only images sharing a band are compared.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    image = models.ForeignKey(UserImage, related_name='hash_buckets', on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    key = models.PositiveIntegerField()
+
+    class Meta():
+        indexes = [
+            # near-duplicate lookup: user=... AND (band, key) IN (...)
+            models.Index(
+                fields=['user', 'band', 'key'],
+                name='hashbucket_lookup_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'Hash band {self.band} of image {self.image_id}'
+
+    @classmethod
+    def index(cls, image):
+        '''
+        Replaces the bands of a root image with the ones of its current hash
+        '''
+        cls.objects.filter(image=image).delete()
+        if image.phash is None:
+            return
+        cls.objects.bulk_create([
+            cls(user_id=image.user_id, image=image, band=band, key=key)
+            for band, key in enumerate(get_bands(image.phash))
+        ])
+
+    @classmethod
+    def find_near_duplicate(cls, user, phash, max_distance, exclude=None):
+        '''
+        Root image of a user closest to a hash, within max_distance bits (the lowest pk of equally close ones).
+        Lookups are exact up to HASH_BANDS - 1 bits, larger distances only match images sharing a band.
+        Returns (image, distance) or None.
+        '''
+        lookup = models.Q()
+        for band, key in enumerate(get_bands(phash)):
+            lookup |= models.Q(band=band, key=key)
+
+        candidates = cls.objects.filter(lookup, user=user)
+        if exclude is not None:
+            candidates = candidates.exclude(image_id=exclude)
+        candidates = sorted(set(candidates.values_list('image_id', 'image__phash')))
+        if not candidates:
+            return None
+
+        ids, hashes = zip(*candidates)
+        distances = hamming_distances(phash, hashes)
+        best = int(distances.argmin())
+        if distances[best] > max_distance:
+            return None
+        return UserImage.objects.get(pk=ids[best]), int(distances[best])
+
+
 class ImageTempLink(models.Model):
     image = models.ForeignKey(UserImage, on_delete=models.CASCADE)
-    expiration = models.DateTimeField()
+    # indexed for purging of expired links
+    expiration = models.DateTimeField(db_index=True)
 
     def __str__(self):
-        return f'Link for image {self.image.pk}'
+        return f'Link for image {self.image_id}'
 
     def generate_link(self):
         '''
@@ -1,20 +1,120 @@
+import re
+
 from django.db import models
 
+from thumbs.processing import AnimationLimits
+
 
 class ThumbRule(models.Model):
-    height = models.IntegerField(unique=True)
+    '''
+    Size of a thumbnail - a height, a width or a bounding box (both),
+    the aspect ratio of the source is always kept
+    '''
+    width = models.IntegerField(null=True, blank=True, default=None)
+    height = models.IntegerField(null=True, blank=True, default=None)
+
+    class Meta():
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(width__isnull=False) | models.Q(height__isnull=False),
+                name='thumbrule_width_or_height'
+            ),
+            models.UniqueConstraint(
+                fields=['height'],
+                condition=models.Q(width__isnull=True),
+                name='thumbrule_unique_height'
+            ),
+            models.UniqueConstraint(
+                fields=['width'],
+                condition=models.Q(height__isnull=True),
+                name='thumbrule_unique_width'
+            ),
+            models.UniqueConstraint(
+                fields=['width', 'height'],
+                name='thumbrule_unique_box'
+            ),
+        ]
 
     def __str__(self):
-        return f'{self.height}px Thumb Rule'
+        if self.width is None:
+            return f'{self.height}px Thumb Rule'
+        if self.height is None:
+            return f'{self.width}px wide Thumb Rule'
+        return f'{self.width}x{self.height}px Thumb Rule'
+
+    def get_box(self):
+        return (self.width, self.height)
+
+    def get_key(self):
+        '''
+        Key of the thumbnail in image urls - numeric height for height rules,
+        e.g. '300w' for width rules and '300x200' for bounding boxes
+        '''
+        if self.width is None:
+            return self.height
+        if self.height is None:
+            return f'{self.width}w'
+        return f'{self.width}x{self.height}'
+
+    @classmethod
+    def get_by_key(cls, key):
+        '''
+        Rule of a key as returned by get_key, None for unknown or invalid keys
+        '''
+        match = re.fullmatch(r'(\d+)(w|x(\d+))?', str(key))
+        if match is None:
+            return None
+
+        size, suffix, box_height = match.groups()
+        if suffix is None:
+            lookup = {'height': size, 'width__isnull': True}
+        elif box_height is None:
+            lookup = {'width': size, 'height__isnull': True}
+        else:
+            lookup = {'width': size, 'height': box_height}
+        return cls.objects.filter(**lookup).first()
+
+    def get_nominal_pixels(self):
+        '''
+        Pixels of the thumbnail of a square source - a rough cost of the rule
+        '''
+        return (self.width or self.height) * (self.height or self.width)
 
 class ThumbPlan(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
     use_source_img = models.BooleanField(default=False)
+    # days a compressed source is kept in the cold storage without use_source_img (0 - not kept)
+    source_retention_days = models.PositiveIntegerField(default=0)
     use_expiring_links = models.BooleanField(default=False)
     thumb_rules = models.ManyToManyField(
         ThumbRule
     )
 
+    # animated sources - animated thumbs within the limits below,
+    # or a static thumb of the poster frame
+    use_animated_thumbs = models.BooleanField(default=False)
+    poster_frame = models.PositiveIntegerField(default=0)
+    animation_max_frames = models.PositiveIntegerField(default=50)
+    animation_max_fps = models.PositiveIntegerField(default=10)
+    # frames * width * height of the largest thumb
+    animation_max_pixels = models.PositiveBigIntegerField(default=20_000_000)
+
+    # upload limits (0 - unlimited), see thumbs.throttling
+    uploads_per_minute = models.PositiveIntegerField(default=30)
+    max_concurrent_jobs = models.PositiveIntegerField(default=2)
+    daily_pixel_budget = models.PositiveBigIntegerField(default=2_000_000_000)
+    # jobs of plans with higher priority are admitted first, see thumbs.scheduler
+    priority = models.PositiveSmallIntegerField(default=0)
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+    def get_animation_limits(self):
+        if not self.use_animated_thumbs:
+            return None
+        return AnimationLimits(
+            max_frames=self.animation_max_frames,
+            max_fps=self.animation_max_fps,
+            max_pixels=self.animation_max_pixels
+        )
\ No newline at end of file
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+from thumbs.models import ThumbRule
+
+
+class SpriteSheet(models.Model):
+    '''
+    A page of thumbnails of one rule of a user, composed into a single image (see thumbs.sprites).
+    Entries are offsets of the thumbnails in the sheet, in the order of their images.
+    '''
+    user = models.ForeignKey(User, related_name='sprite_sheets', on_delete=models.CASCADE)
+    thumb_rule = models.ForeignKey(ThumbRule, on_delete=models.CASCADE)
+    page = models.PositiveIntegerField()
+    file = models.FileField(max_length=255, blank=True, default='')
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    # [{'id': image pk, 'thumb': thumb pk, 'x', 'y', 'width', 'height'}]
+    entries = models.JSONField(default=list)
+
+    class Meta():
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'thumb_rule', 'page'],
+                name='spritesheet_unique_page'
+            ),
+        ]
+
+    def __str__(self):
+        return f'Sprite sheet {self.page} of {self.thumb_rule} for user {self.user_id}'
@@ -0,0 +1,97 @@
+import datetime
+import os
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
+from django.db import models
+from django.utils import timezone
+
+
+class SessionUploadedFile(UploadedFile):
+    '''
+    Assembled file of an upload session. Exposes its path like TemporaryUploadedFile,
+    so it is validated from disk instead of being read into memory.
+    '''
+    def __init__(self, session):
+        super().__init__(open(session.temp_path, 'rb'), name=session.filename, size=session.size)
+        self.path = session.temp_path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class UploadSession(models.Model):
+    '''
+    Resumable upload of a large original.
+    Chunks are appended to a temp file, thumbnails are created on finalize only.
+    '''
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Upload session {self.pk}'
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.THUMBS_UPLOAD_TEMP_DIR, f'{self.pk}.part')
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    @property
+    def is_expired(self):
+        return self.created + datetime.timedelta(seconds=settings.THUMBS_UPLOAD_SESSION_TTL) < timezone.now()
+
+    def append_chunk(self, offset, stream, length):
+        '''
+        Writes a chunk at a given offset and moves the session offset.
+        Bytes written past the stored offset by an interrupted request are overwritten.
+        '''
+        os.makedirs(settings.THUMBS_UPLOAD_TEMP_DIR, exist_ok=True)
+
+        mode = 'r+b' if os.path.exists(self.temp_path) else 'wb'
+        with open(self.temp_path, mode) as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = stream.read(min(remaining, 64 * 1024))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+            f.truncate()
+            written = length - remaining
+
+        self.offset = offset + written
+        self.save(update_fields=['offset'])
+        return written
+
+    def open_file(self):
+        return SessionUploadedFile(self)
+
+    def delete_temp_file(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def delete(self, *args, **kwargs):
+        self.delete_temp_file()
+        return super().delete(*args, **kwargs)
+
+    @classmethod
+    def delete_expired(cls):
+        '''
+        Removes abandoned sessions with their temp files, returns the count
+        '''
+        limit = timezone.now() - datetime.timedelta(seconds=settings.THUMBS_UPLOAD_SESSION_TTL)
+        count = 0
+        for session in cls.objects.filter(created__lt=limit).iterator():
+            session.delete()
+            count += 1
+        return count
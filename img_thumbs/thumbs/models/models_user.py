@@ -1,5 +1,10 @@
+import threading
+import time
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
+from rest_framework.exceptions import AuthenticationFailed
 
 from thumbs.models import ThumbPlan
 
@@ -10,3 +15,68 @@ class ThumbUser(models.Model):
 
     def __str__(self):
         return f'Thumb User profile for {self.user.username}'
+
+
+class PlanCache():
+    '''
+    Plans by pk, memoized per process for THUMBS_TOKEN_PLAN_CACHE_TTL seconds
+    '''
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, plan_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(plan_id)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        plan = ThumbPlan.objects.filter(pk=plan_id).first()
+        with self.lock:
+            self.entries[plan_id] = (plan, now + settings.THUMBS_TOKEN_PLAN_CACHE_TTL)
+        return plan
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+plan_cache = PlanCache()
+
+
+class TokenUser(User):
+    '''
+    User of a signed token (see thumbs.authentication), built without DB access.
+    Only the pk is loaded, other fields are loaded together on first access.
+    The plan comes from the token, so thumb_user.plan needs no user queries.
+    is_active isn't loaded (AbstractBaseUser defaults it to True) - check it with a query.
+    '''
+    class Meta():
+        proxy = True
+
+    @classmethod
+    def from_token(cls, user_id, plan_id):
+        user = cls.from_db(DEFAULT_DB_ALIAS, [cls._meta.pk.attname], [user_id])
+        user.token_plan_id = plan_id
+        return user
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None:
+            # the first access of a deferred field loads all of them at once
+            fields = set(fields) | self.get_deferred_fields()
+        try:
+            super().refresh_from_db(using=using, fields=fields)
+        except User.DoesNotExist:
+            raise AuthenticationFailed('User not found.')
+
+    @property
+    def thumb_user(self):
+        thumb_user = getattr(self, '_token_thumb_user', None)
+        if thumb_user is None:
+            plan = plan_cache.get(self.token_plan_id) if self.token_plan_id is not None else None
+            if plan is None:
+                raise User.thumb_user.RelatedObjectDoesNotExist('User has no thumb_user.')
+            thumb_user = ThumbUser(user=self, plan=plan)
+            self._token_thumb_user = thumb_user
+        return thumb_user
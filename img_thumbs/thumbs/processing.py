@@ -0,0 +1,487 @@
+import base64
+from contextlib import nullcontext
+from io import BytesIO
+
+import PIL
+from PIL import Image
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# orientations which swap image width and height
+SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+# the pre-reduced source is kept at least this many times larger
+# than the biggest thumbnail, so the final antialias pass has enough data
+REDUCING_GAP = 2
+
+# modes supported by Image.reduce
+REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# formats which can be saved as animations
+ANIMATED_FORMATS = ('GIF', 'WEBP')
+
+# size of a frame sample used to compute a shared animation palette
+PALETTE_SAMPLE_SIZE = 64
+
+# frame duration used when a source doesn't specify one
+DEFAULT_FRAME_DURATION = 100
+
+# source frames read per kept frame at most - enough to decimate 50 fps sources to 10 fps,
+# longer sources are truncated, as reaching a frame decodes all the frames before it
+SOURCE_FRAMES_PER_FRAME = 5
+
+# bounding box of the inline placeholder (LQIP) and its JPEG quality
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 70
+
+# formats reduced on decode (draft mode), so they never need a full resolution bitmap
+DRAFT_FORMATS = ('JPEG',)
+
+# bytes per pixel of raw modes which can be decoded in row bands
+RAW_MODE_BYTES = {
+    'L': 1, 'P': 1, 'LA': 2, 'RGB': 3, 'BGR': 3,
+    'RGBA': 4, 'RGBX': 4, 'BGRA': 4, 'BGRX': 4,
+}
+
+# memory used by a single decoded band in the low memory mode
+LOW_MEMORY_BAND_BYTES = 16 * 1024 * 1024
+
+
+PILLOW_VERSION = tuple(int(part) for part in PIL.__version__.split('.')[:2])
+
+# bands are decoded by setting the private Image._size (behind Image.size since Pillow 5.3),
+# with Pillow versions without it images are decoded in full
+BAND_DECODING = PILLOW_VERSION >= (5, 3) and hasattr(Image.new('L', (1, 1)), '_size')
+
+
+class AnimationLimits():
+    '''
+    Per plan bounds for animated thumbnails.
+    max_fps drops frames of fast animations, max_frames caps the frame count
+    and max_pixels caps frames * width * height of the largest thumbnail,
+    which bounds both the memory held and the resizing work done per upload.
+    '''
+    def __init__(self, max_frames, max_fps, max_pixels):
+        self.max_frames = max_frames
+        self.max_fps = max_fps
+        self.max_pixels = max_pixels
+
+
+class SourceImage():
+    '''
+    Decoded source image shared by all thumbnails of a single upload.
+    The bitmap is already upright (EXIF orientation applied)
+    and reduced as far as the largest thumbnail allows.
+    Animated sources carry the sampled frames and their durations as well.
+    '''
+    def __init__(self, image, format, frames=None, durations=None, loop=None, source_size=None):
+        self.image = image
+        self.format = format
+        # upright size of the original, before any reduction
+        self.source_size = source_size or image.size
+        self.frames = frames
+        self.durations = durations
+        self.loop = loop
+        self._palette_image = None
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def is_animated(self):
+        return bool(self.frames) and len(self.frames) > 1
+
+    def get_thumb_size(self, box):
+        return fit_size(self.size, box)
+
+    def resize(self, box):
+        return self.image.resize(self.get_thumb_size(box), Image.ANTIALIAS)
+
+    def get_palette_image(self):
+        '''
+        Adaptive palette of all the frames, computed from a small montage of them.
+        Cached, so it is shared between the thumbnails of all the rules.
+        '''
+        if self._palette_image is None:
+            montage = Image.new('RGB', (PALETTE_SAMPLE_SIZE * len(self.frames), PALETTE_SAMPLE_SIZE))
+            for idx, frame in enumerate(self.frames):
+                sample = frame.convert('RGB').resize((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE), Image.BILINEAR)
+                montage.paste(sample, (idx * PALETTE_SAMPLE_SIZE, 0))
+            self._palette_image = montage.quantize(colors=255)
+        return self._palette_image
+
+    def get_placeholder(self):
+        '''
+        Tiny blurred-up preview of the image (LQIP), as a data URI
+        to be inlined by clients before any image request
+        '''
+        # JPEG has no alpha
+        image = flatten_transparency(self.image).convert('RGB')
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.ANTIALIAS)
+
+        fp = BytesIO()
+        image.save(fp, format='JPEG', quality=PLACEHOLDER_QUALITY)
+        return 'data:image/jpeg;base64,' + base64.b64encode(fp.getvalue()).decode('ascii')
+
+    def save_thumb(self, box, fp, timer=None):
+        '''
+        Writes a thumbnail fitted to a (width, height) box, in the source format.
+        Returns the thumbnail size.
+        timer(stage) is an optional context manager timing the 'resize' and 'encode' stages.
+        '''
+        if timer is None:
+            timer = lambda stage: nullcontext()
+
+        size = self.get_thumb_size(box)
+        if not self.is_animated:
+            with timer('resize'):
+                thumb = self.resize(box)
+            with timer('encode'):
+                thumb.save(fp, format=self.format)
+            return size
+
+        with timer('resize'):
+            frames = [frame.resize(size, Image.ANTIALIAS) for frame in self.frames]
+
+        with timer('encode'):
+            if self.format == 'GIF':
+                # a single palette is computed once and reused by all the frames
+                palette_image = self.get_palette_image()
+                frames = [
+                    frame.convert('RGB').quantize(palette=palette_image)
+                    for frame in frames
+                ]
+
+            options = {}
+            if self.loop is not None:
+                options['loop'] = self.loop
+
+            frames[0].save(
+                fp,
+                format=self.format,
+                save_all=True,
+                append_images=frames[1:],
+                duration=self.durations,
+                **options
+            )
+        return size
+
+
+def flatten_transparency(image):
+    '''
+    Image with transparent areas flattened on white, images without transparency as they are
+    '''
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image
+
+def fit_size(size, box):
+    '''
+    Size of an image resized to a (width, height) box, keeping the aspect ratio.
+    Either bound may be None - a height or width only box.
+    '''
+    width, height = box
+    if height and (not width or width * size[1] >= height * size[0]):
+        return (max(int(size[0] * height / size[1]), 1), height)
+    return (width, max(int(size[1] * width / size[0]), 1))
+
+def get_orientation(image):
+    try:
+        return image.getexif().get(EXIF_ORIENTATION_TAG)
+    except Exception:
+        return None
+
+def get_upright_height(image, orientation):
+    if orientation in SWAPPED_ORIENTATIONS:
+        return image.size[0]
+    return image.size[1]
+
+def get_upright_size(image, orientation):
+    if orientation in SWAPPED_ORIENTATIONS:
+        return image.size[::-1]
+    return image.size
+
+def reduce_and_transpose(image, orientation, target_height):
+    '''
+    Cheap box reduce towards the target height, then a single transpose
+    at the reduced size
+    '''
+    factor = get_upright_height(image, orientation) // target_height
+    if factor >= 2 and image.mode in REDUCE_MODES:
+        image = image.reduce(factor)
+
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    if method is not None:
+        image = image.transpose(method)
+
+    return image
+
+def get_max_frames(limits, frame_pixels):
+    '''
+    Frames of an animated thumbnail allowed by the frame cap and the pixel budget
+    '''
+    if frame_pixels:
+        return min(limits.max_frames, limits.max_pixels // frame_pixels)
+    return limits.max_frames
+
+def seek_frames(image, limit):
+    '''
+    Seeks to each of at most limit frames, yielding their indexes.
+    Stops at the end of the animation without counting its frames first,
+    n_frames of a GIF decodes the whole file.
+    '''
+    for idx in range(limit):
+        try:
+            image.seek(idx)
+        except EOFError:
+            return
+        yield idx
+
+def sample_frames(durations, limits, frame_pixels):
+    '''
+    Picks frames of an animation within the limits.
+    Returns a list of (frame index, duration) - durations of dropped frames
+    are added to the previous kept frame, so the playback time doesn't change.
+    '''
+    max_frames = get_max_frames(limits, frame_pixels)
+    if max_frames < 2:
+        return []
+
+    # frame-rate decimation
+    min_interval = 1000 / limits.max_fps if limits.max_fps else 0
+    selected = []
+    elapsed = 0
+    next_slot = 0
+    for idx, duration in enumerate(durations):
+        if elapsed >= next_slot or not selected:
+            selected.append([idx, 0])
+            next_slot = elapsed + min_interval
+        selected[-1][1] += duration
+        elapsed += duration
+
+    # frame count cap - keep evenly spaced frames
+    if len(selected) > max_frames:
+        step = len(selected) / max_frames
+        capped = []
+        for n in range(max_frames):
+            start = int(n * step)
+            end = int((n + 1) * step)
+            capped.append([selected[start][0], sum(d for _, d in selected[start:end])])
+        selected = capped
+
+    return [tuple(s) for s in selected]
+
+def decode_frames(image, orientation, target_height, max_height, limits):
+    '''
+    Decodes sampled frames of an animated image, each reduced and transposed
+    right after decoding, so only the reduced frames are kept in memory
+    '''
+    upright_height = get_upright_height(image, orientation)
+    upright_width = image.size[1] if orientation in SWAPPED_ORIENTATIONS else image.size[0]
+    frame_pixels = max(int(upright_width * max_height / upright_height), 1) * max_height
+
+    max_frames = get_max_frames(limits, frame_pixels)
+    if max_frames < 2:
+        return None, None
+
+    durations = [
+        image.info.get('duration') or DEFAULT_FRAME_DURATION
+        for _ in seek_frames(image, max_frames * SOURCE_FRAMES_PER_FRAME)
+    ]
+
+    selected = sample_frames(durations, limits, frame_pixels)
+    if not selected:
+        return None, None
+
+    frames = []
+    for idx, _ in selected:
+        # frames of GIF and WebP are decoded sequentially anyway, so seeking forward is cheap
+        image.seek(idx)
+        frame = image.convert('RGBA')
+        frames.append(reduce_and_transpose(frame, orientation, target_height))
+
+    return frames, [d for _, d in selected]
+
+def get_raw_bands(image, band_rows):
+    '''
+    Splits a single raw (uncompressed) tile into tiles of band_rows rows
+    '''
+    decoder, extents, offset, args = image.tile[0]
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    width, height = image.size
+
+    if extents != (0, 0, width, height) or orientation not in (1, -1):
+        return None
+    if not stride:
+        if rawmode not in RAW_MODE_BYTES:
+            return None
+        stride = width * RAW_MODE_BYTES[rawmode]
+
+    bands = []
+    for y0 in range(0, height, band_rows):
+        y1 = min(y0 + band_rows, height)
+        # bottom-up images store the last row first
+        first_row = y0 if orientation == 1 else height - y1
+        bands.append((y0, y1, [
+            (decoder, (0, 0, width, y1 - y0), offset + first_row * stride, (rawmode, stride, orientation))
+        ]))
+    return bands
+
+def get_tile_bands(image, band_rows):
+    '''
+    Groups tiles (e.g. TIFF strips or tiles) into bands of at least band_rows rows
+    '''
+    rows = {}
+    for tile in image.tile:
+        rows.setdefault(tile[1][1], []).append(tile)
+
+    bands = []
+    for y0 in sorted(rows):
+        if not bands or bands[-1][1] - bands[-1][0] >= band_rows:
+            bands.append([y0, y0, []])
+        band = bands[-1]
+        for decoder, extents, offset, args in rows[y0]:
+            band[1] = max(band[1], extents[3])
+            band[2].append((decoder, extents, offset, args))
+
+    return [
+        (y0, y1, [
+            (decoder, (e[0], e[1] - y0, e[2], e[3] - y0), offset, args)
+            for decoder, e, offset, args in tiles
+        ])
+        for y0, y1, tiles in bands
+    ]
+
+def get_bands(image, band_rows):
+    '''
+    Returns a list of (first row, end row, tiles) for images which can be decoded
+    band by band, or None
+    '''
+    if not BAND_DECODING or not image.tile or image.mode not in REDUCE_MODES:
+        return None
+    # compressed TIFFs are decoded by libtiff as a whole
+    if getattr(image, 'use_load_libtiff', False):
+        return None
+
+    if len(image.tile) == 1:
+        if image.tile[0][0] != 'raw':
+            return None
+        return get_raw_bands(image, band_rows)
+
+    return get_tile_bands(image, band_rows)
+
+def get_band_rows(image, factor):
+    bytes_per_row = image.size[0] * len(image.getbands())
+    rows = max(LOW_MEMORY_BAND_BYTES // bytes_per_row, 1)
+    return max(rows // factor, 1) * factor
+
+def needs_low_memory_mode(image, low_memory_pixels):
+    return bool(low_memory_pixels) and image.size[0] * image.size[1] > low_memory_pixels
+
+def can_decode_bounded(image, low_memory_pixels):
+    '''
+    True if an image can be decoded within the low memory limits
+    '''
+    if not needs_low_memory_mode(image, low_memory_pixels):
+        return True
+    if image.format in DRAFT_FORMATS:
+        return True
+    return get_bands(image, get_band_rows(image, 1)) is not None
+
+def decode_in_bands(path, image, factor):
+    '''
+    Decodes an image band by band, each band reduced by factor right away,
+    so only a single full resolution band is kept in memory
+    '''
+    width, height = image.size
+    bands = get_bands(image, get_band_rows(image, factor))
+    out_width = max((width + factor - 1) // factor, 1)
+    output = Image.new(image.mode, (out_width, max((height + factor - 1) // factor, 1)))
+
+    for y0, y1, tiles in bands:
+        with Image.open(path) as band:
+            band._size = (width, y1 - y0)
+            band.tile = tiles
+            band.load()
+
+            # the last band keeps the partial rows, like Image.reduce does
+            out_y0 = y0 // factor
+            out_y1 = output.size[1] if y1 == height else y1 // factor
+            reduced_rows = (y1 - y0 + factor - 1) // factor
+            if y0 % factor == 0 and reduced_rows == out_y1 - out_y0:
+                reduced = band.reduce(factor)
+            else:
+                reduced = band.resize((out_width, max(out_y1 - out_y0, 1)), Image.BOX)
+            output.paste(reduced, (0, out_y0))
+
+    return output
+
+def decode_source(path, boxes, limits=None, poster_frame=0, low_memory_pixels=None):
+    '''
+    Opens the source image once for the whole thumbnail pipeline.
+    Boxes are (width, height) bounds of all the thumbnails (see fit_size),
+    or just the max thumbnail height.
+    The bitmap is reduced on decode (JPEG draft mode) or with a box reduce,
+    and only then transposed according to its EXIF orientation,
+    so the transpose never runs at the full resolution.
+    Animated sources keep sampled frames if animation limits are given,
+    otherwise a single poster frame is used.
+    Images above low_memory_pixels are reduced on decode or decoded in bands where possible,
+    other ones are decoded in full (within Pillow's MAX_IMAGE_PIXELS).
+    '''
+    if isinstance(boxes, int):
+        boxes = [(None, boxes)]
+
+    image = Image.open(path)
+    format = image.format
+    orientation = get_orientation(image)
+    source_size = get_upright_size(image, orientation)
+    max_height = max(fit_size(source_size, box)[1] for box in boxes)
+    target_height = max_height * REDUCING_GAP
+
+    if getattr(image, 'is_animated', False):
+        if limits is not None and format in ANIMATED_FORMATS:
+            frames, durations = decode_frames(image, orientation, target_height, max_height, limits)
+            if frames:
+                return SourceImage(
+                    frames[0], format,
+                    frames=frames, durations=durations, loop=image.info.get('loop'),
+                    source_size=source_size
+                )
+
+        # the last frame of shorter animations
+        for _ in seek_frames(image, poster_frame + 1):
+            pass
+        image = image.convert('RGBA') if image.mode == 'P' else image.copy()
+        return SourceImage(reduce_and_transpose(image, orientation, target_height), format, source_size=source_size)
+
+    # formats which can't be decoded in bands fall through to a full decode
+    band_decode = format not in DRAFT_FORMATS and needs_low_memory_mode(image, low_memory_pixels)
+    if band_decode and can_decode_bounded(image, low_memory_pixels):
+        factor = max(get_upright_height(image, orientation) // target_height, 1)
+        image = decode_in_bands(path, image, factor)
+        return SourceImage(reduce_and_transpose(image, orientation, target_height), format, source_size=source_size)
+
+    scale = target_height / get_upright_height(image, orientation)
+    if scale < 1:
+        image.draft(None, (
+            max(int(image.size[0] * scale), 1),
+            max(int(image.size[1] * scale), 1)
+        ))
+
+    image.load()
+
+    return SourceImage(reduce_and_transpose(image, orientation, target_height), format, source_size=source_size)
@@ -0,0 +1,123 @@
+'''
+Opt-in sampling profiler of thumbnail jobs.
+One in THUMBS_PROFILE_SAMPLE_RATE jobs (and jobs of requests of staff users
+carrying the THUMBS_PROFILE_HEADER header) run under cProfile and tracemalloc.
+Profiles are written to THUMBS_PROFILE_DIR, only the newest
+THUMBS_PROFILE_MAX_SAMPLES samples are kept. See the profile_report command.
+'''
+import contextvars
+import cProfile
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+
+CPU_SUFFIX = '.prof'
+MEMORY_SUFFIX = '.mem'
+
+# frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 10
+
+profiling_forced = contextvars.ContextVar('profiling_forced', default=False)
+
+
+class SamplingProfiler():
+    '''
+    Decides which jobs are sampled and writes their profiles.
+    tracemalloc is process wide, so it runs while any sampled job does.
+    '''
+    def __init__(self):
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.tracing = 0
+
+    def should_sample(self):
+        if profiling_forced.get():
+            return True
+        rate = settings.THUMBS_PROFILE_SAMPLE_RATE
+        return bool(rate) and next(self.counter) % rate == 0
+
+    def start_tracing(self):
+        with self.lock:
+            if self.tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracing += 1
+            # peaks of jobs sampled at the same time overlap
+            tracemalloc.reset_peak()
+
+    def stop_tracing(self):
+        with self.lock:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            self.tracing -= 1
+            if self.tracing == 0:
+                tracemalloc.stop()
+        return snapshot, peak
+
+    @contextmanager
+    def sample(self, name):
+        '''
+        Profiles the block if the job is sampled
+        '''
+        if not self.should_sample():
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self.start_tracing()
+        started = time.time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot, peak = self.stop_tracing()
+            self.save(name, started, profile, snapshot, peak)
+
+    def save(self, name, started, profile, snapshot, peak):
+        directory = settings.THUMBS_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        # names sort by time, so rotation drops the oldest samples
+        sample_name = f'{started:.6f}-{os.getpid()}-{name}-peak{peak}'
+        profile.dump_stats(os.path.join(directory, sample_name + CPU_SUFFIX))
+        snapshot.dump(os.path.join(directory, sample_name + MEMORY_SUFFIX))
+
+        self.rotate(directory)
+
+    def rotate(self, directory):
+        samples = sorted(get_sample_names(directory))
+        for sample_name in samples[:max(len(samples) - settings.THUMBS_PROFILE_MAX_SAMPLES, 0)]:
+            for suffix in (CPU_SUFFIX, MEMORY_SUFFIX):
+                try:
+                    os.remove(os.path.join(directory, sample_name + suffix))
+                except FileNotFoundError:
+                    # removed by another process
+                    pass
+
+
+def get_sample_names(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return set()
+    return {name[:-len(CPU_SUFFIX)] for name in names if name.endswith(CPU_SUFFIX)}
+
+@contextmanager
+def profile_request(request):
+    '''
+    Forces profiling of jobs run by a request of a staff user with the profiling header
+    '''
+    forced = request.user.is_staff and bool(request.headers.get(settings.THUMBS_PROFILE_HEADER))
+    token = profiling_forced.set(forced)
+    try:
+        yield
+    finally:
+        profiling_forced.reset(token)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,108 @@
+'''
+Scheduling of thumbnail work.
+Jobs of a process are admitted to a limited number of slots by plan tier
+(ThumbPlan.priority) and then by age. Within a job, rules are rendered
+from the cheapest to the most expensive per request, so the thumbnail
+clients need first is ready first.
+'''
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from thumbs.metrics import (scheduler_run_seconds, scheduler_timeouts,
+                            scheduler_wait_seconds)
+
+
+class SchedulerBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Thumbnail processing is busy, try again later.'
+    default_code = 'scheduler_busy'
+
+
+class ThumbnailScheduler():
+    '''
+    Priority admission of thumbnail jobs to a fixed number of slots.
+    Waiting jobs are ordered by tier (higher first) and then by enqueue time.
+    A job not admitted within timeout seconds (0 - no limit) leaves the queue with SchedulerBusy.
+    '''
+    def __init__(self, slots, timeout=0):
+        self.slots = slots
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def job(self, tier):
+        enqueued = time.monotonic()
+        entry = (-tier, enqueued, next(self.counter))
+
+        deadline = enqueued + self.timeout if self.timeout else None
+
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            while self.slots and (self.running >= self.slots or self.waiting[0] != entry):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                    scheduler_timeouts.inc(tier=tier)
+                    # the job may have been next in the queue
+                    self.condition.notify_all()
+                    raise SchedulerBusy
+                self.condition.wait(remaining)
+            heapq.heappop(self.waiting)
+            self.running += 1
+            # a free slot may be left for the next job in the queue
+            self.condition.notify_all()
+
+        started = time.monotonic()
+        scheduler_wait_seconds.observe(started - enqueued, tier=tier)
+        try:
+            yield
+        finally:
+            scheduler_run_seconds.observe(time.monotonic() - started, tier=tier)
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+
+scheduler = ThumbnailScheduler(settings.THUMBS_SCHEDULER_SLOTS, settings.THUMBS_SCHEDULER_TIMEOUT)
+
+
+def get_rule_requests_key(rule_id):
+    return f'thumbs:rule_requests:{rule_id}'
+
+def record_rule_request(rule_id):
+    '''
+    Counts a request for a thumbnail of a rule - used to render popular rules first
+    '''
+    cache = caches[settings.THUMBS_SCHEDULER_CACHE]
+    key = get_rule_requests_key(rule_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+def order_rules(rules):
+    '''
+    Orders rules by rendered pixels per request - small and popular rules first
+    '''
+    cache = caches[settings.THUMBS_SCHEDULER_CACHE]
+    requests = cache.get_many([get_rule_requests_key(rule.pk) for rule in rules])
+
+    def cost(rule):
+        count = requests.get(get_rule_requests_key(rule.pk), 0)
+        pixels = rule.get_nominal_pixels()
+        return (pixels / (count + 1), pixels)
+
+    return sorted(rules, key=cost)
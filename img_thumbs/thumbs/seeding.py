@@ -0,0 +1,184 @@
+'''
+Synthetic data for load tests, see the seed_load command.
+Users with ThumbUser profiles, image trees (with manifests) and temp links
+are bulk inserted from a fixed seed - the same seed gives the same data.
+No files are written, the thumbnail pipeline is skipped.
+Seeded users are told apart from real ones by their emails in LOAD_USER_EMAIL_DOMAIN,
+a reserved domain no real address can be in (usernames alone could clash).
+'''
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from thumbs.models import ImageTempLink, ThumbPlan, ThumbUser, UserImage
+from thumbs.processing import fit_size
+
+LOAD_USER_PREFIX = 'load-'
+LOAD_USER_EMAIL_DOMAIN = 'load.invalid'
+
+# source sizes of seeded images
+SOURCE_SIZES = [(4032, 3024), (3024, 4032), (1920, 1080), (1080, 1920), (1200, 1200), (800, 600)]
+# rough JPEG bytes per pixel, for the sizes in manifests
+BYTES_PER_PIXEL = 0.15
+# seeded temp links expire within this many seconds from now, or expired as long ago
+LINK_EXPIRATION_SPREAD = 24 * 60 * 60
+
+
+def get_load_username(idx):
+    return f'{LOAD_USER_PREFIX}{idx}'
+
+def get_load_email(username):
+    return f'{username}@{LOAD_USER_EMAIL_DOMAIN}'
+
+def get_load_users():
+    return User.objects.filter(email__endswith=f'@{LOAD_USER_EMAIL_DOMAIN}')
+
+def clear_load_data():
+    '''
+    Deletes seeded users with their images and links, returns the number of users
+    '''
+    users = get_load_users()
+    count = users.count()
+    with transaction.atomic():
+        ImageTempLink.objects.filter(image__user__in=users).delete()
+        # thumbs first, so roots aren't collected with their whole trees
+        UserImage.objects.filter(user__in=users, parent__isnull=False).delete()
+        UserImage.objects.filter(user__in=users).delete()
+        users.delete()
+    return count
+
+def get_seeded_entry(key, pk, name, size):
+    '''
+    Manifest entry of a seeded variant - as get_manifest_entry, with an estimated file size
+    '''
+    return {
+        'key': key,
+        'id': pk,
+        'name': name,
+        'format': 'JPEG',
+        'size': int(size[0] * size[1] * BYTES_PER_PIXEL),
+        'width': size[0],
+        'height': size[1]
+    }
+
+
+class LoadSeeder():
+    '''
+    Inserts seeded data in batches of users.
+    bulk_create doesn't return pks on every backend, so inserted rows are read back by their unique names.
+    '''
+    def __init__(self, images, links, seed=0, password=None, batch_size=500):
+        self.images = images
+        self.links = links
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+        # one hash for all the users (unusable without a password) - hashing is deliberately slow
+        self.password = make_password(password)
+        self.plans = list(ThumbPlan.objects.prefetch_related('thumb_rules').order_by('pk'))
+        if not self.plans:
+            raise ValueError('No plans to assign users to')
+        self.plan_rules = {plan.pk: list(plan.thumb_rules.all()) for plan in self.plans}
+        self.counts = {'users': 0, 'images': 0, 'thumbs': 0, 'links': 0}
+
+    def seed(self, users):
+        for start in range(0, users, self.batch_size):
+            with transaction.atomic():
+                self.seed_batch(range(start, min(start + self.batch_size, users)))
+        return self.counts
+
+    def seed_batch(self, indexes):
+        names = [get_load_username(idx) for idx in indexes]
+        User.objects.bulk_create([
+            User(username=name, email=get_load_email(name), password=self.password)
+            for name in names
+        ])
+        order = {name: idx for idx, name in enumerate(names)}
+        users = sorted(User.objects.filter(username__in=names), key=lambda u: order[u.username])
+
+        plans = {user.pk: self.rng.choice(self.plans) for user in users}
+        ThumbUser.objects.bulk_create([ThumbUser(user=user, plan=plans[user.pk]) for user in users])
+
+        roots = self.create_roots(users, plans)
+        self.create_thumbs(roots, plans)
+        self.create_links(roots, plans)
+        self.counts['users'] += len(users)
+
+    def create_roots(self, users, plans):
+        sizes = {}
+        roots = []
+        for user in users:
+            for idx in range(self.rng.randint(0, 2 * self.images)):
+                name = f'photos/{user.pk}/{LOAD_USER_PREFIX}{idx}.jpg'
+                sizes[name] = self.rng.choice(SOURCE_SIZES)
+                roots.append(UserImage(
+                    user=user,
+                    # sources of plans without use_source_img aren't kept, the name is in the manifest only
+                    file=name if plans[user.pk].use_source_img else '',
+                    width=sizes[name][0],
+                    height=sizes[name][1],
+                    manifest=[get_seeded_entry('original', None, name, sizes[name])]
+                ))
+        UserImage.objects.bulk_create(roots, batch_size=self.batch_size)
+
+        roots = list(UserImage.objects.filter(
+            user__in=users,
+            parent__isnull=True
+        ).order_by('pk'))
+        self.counts['images'] += len(roots)
+        return roots
+
+    def create_thumbs(self, roots, plans):
+        thumbs = []
+        for root in roots:
+            source = root.manifest[0]
+            size = (source['width'], source['height'])
+            for rule in self.plan_rules[plans[root.user_id].pk]:
+                thumb_size = fit_size(size, rule.get_box())
+                thumbs.append(UserImage(
+                    user_id=root.user_id,
+                    parent=root,
+                    thumb_rule=rule,
+                    file=source['name'].replace('.jpg', f'_{rule.get_key()}.jpg'),
+                    width=thumb_size[0],
+                    height=thumb_size[1]
+                ))
+        UserImage.objects.bulk_create(thumbs, batch_size=self.batch_size)
+
+        entries = {root.pk: [] for root in roots}
+        # filtered by users of the batch - a query parameter per root could exceed backend limits
+        thumbs = UserImage.objects.filter(
+            user__in={root.user_id for root in roots},
+            parent__isnull=False
+        ).select_related('thumb_rule').order_by('height', 'pk')
+        for thumb in thumbs:
+            entries[thumb.parent_id].append(get_seeded_entry(
+                thumb.thumb_rule.get_key(), thumb.pk, thumb.file.name, (thumb.width, thumb.height)
+            ))
+            self.counts['thumbs'] += 1
+
+        for root in roots:
+            source = root.manifest[0]
+            manifest = entries[root.pk]
+            if root.file.name:
+                manifest.append(dict(source, id=root.pk))
+            root.manifest = manifest
+        UserImage.objects.bulk_update(roots, ['manifest'], batch_size=self.batch_size)
+
+    def create_links(self, roots, plans):
+        links = []
+        for root in roots:
+            if not root.file.name or not plans[root.user_id].use_expiring_links:
+                continue
+            for _ in range(self.links):
+                seconds = self.rng.randint(-LINK_EXPIRATION_SPREAD, LINK_EXPIRATION_SPREAD)
+                links.append(ImageTempLink(
+                    image=root,
+                    expiration=self.now + datetime.timedelta(seconds=seconds)
+                ))
+        ImageTempLink.objects.bulk_create(links, batch_size=self.batch_size)
+        self.counts['links'] += len(links)
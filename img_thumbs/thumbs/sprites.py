@@ -0,0 +1,192 @@
+'''
+Sprite sheets of a user's thumbnails of one rule, for gallery pages rendered from one image fetch.
+Thumbnails are packed in rows (shelves) of up to THUMBS_SPRITE_MAX_WIDTH pixels, in pages
+of THUMBS_SPRITE_PAGE_SIZE images, by the order of their images. Only the requested page
+is refreshed: new images are appended to it (the page is recomposed from the thumbnail files,
+offsets of images already on it don't change), removed or regenerated thumbnails make it
+composed again. Other stale pages are left until they are requested.
+Sheet files are staged like uploads, stale ones are handled by thumbs.storage_reclaim.
+'''
+import math
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+
+from thumbs.models import SpriteSheet, UserImage
+from thumbs.staging import StagedFiles
+from thumbs.throttling import cache_lock
+
+SPRITE_PREFIX = 'sprites'
+BACKGROUND = (255, 255, 255)
+
+
+def get_sheet_name(user_id, rule, page):
+    return f'{SPRITE_PREFIX}/{user_id}/{rule.get_key()}_{page}_{uuid.uuid4().hex[:8]}.jpg'
+
+def get_rule_thumbs(user, rule):
+    '''
+    Thumbnails of a rule, ordered by their images
+    '''
+    return UserImage.objects.filter(
+        user=user,
+        thumb_rule=rule,
+        parent__isnull=False
+    ).exclude(file='').exclude(file__isnull=True).order_by('parent_id', 'pk')
+
+def place(entries, size, max_width):
+    '''
+    Offset of the next thumbnail - after the last one, or in a new row below it
+    '''
+    if not entries:
+        return 0, 0
+
+    last = entries[-1]
+    x = last['x'] + last['width']
+    if x > 0 and x + size[0] > max_width:
+        row_height = max(e['height'] for e in entries if e['y'] == last['y'])
+        return 0, last['y'] + row_height
+    return x, last['y']
+
+def open_thumb(storage, name):
+    with storage.open(name) as f:
+        image = Image.open(f)
+        image.load()
+    # thumbs with transparency are flattened onto the background
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        flat = Image.new('RGB', image.size, BACKGROUND)
+        flat.paste(image, mask=image.split()[-1])
+        return flat
+    return image.convert('RGB')
+
+
+class SpriteSheetBuilder():
+    def __init__(self, user, rule):
+        self.user = user
+        self.rule = rule
+        self.storage = SpriteSheet.file.field.storage
+        self.thumb_storage = UserImage.file.field.storage
+        self.page_size = settings.THUMBS_SPRITE_PAGE_SIZE
+        self.max_width = settings.THUMBS_SPRITE_MAX_WIDTH
+
+    def get_sheet(self, page):
+        return SpriteSheet.objects.filter(user=self.user, thumb_rule=self.rule, page=page).first()
+
+    def is_fresh(self, sheet, thumbs):
+        '''
+        Checks a sheet against thumbnails of its page - pks only grow,
+        so added, deleted or regenerated thumbnails change them
+        '''
+        known = [entry['thumb'] for entry in sheet.entries] if sheet else []
+        return known == [thumb['pk'] for thumb in thumbs]
+
+    def refresh(self, page):
+        '''
+        Brings a page up to date with the thumbnails, returns the sheet (None past the last page)
+        and the number of pages. Other pages aren't composed, so a request does a page of work at most.
+        The sheet is composed outside of the transaction, its row is only locked to store it.
+        '''
+        rule_thumbs = get_rule_thumbs(self.user, self.rule)
+        pages = math.ceil(rule_thumbs.count() / self.page_size)
+        if page >= pages:
+            return None, pages
+
+        start = page * self.page_size
+        thumbs = list(rule_thumbs[start:start + self.page_size].values('pk', 'parent_id', 'file'))
+        sheet = self.get_sheet(page)
+        if self.is_fresh(sheet, thumbs):
+            return sheet, pages
+
+        with cache_lock(f'thumbs:sprites:{self.user.pk}:{self.rule.pk}:{page}', timeout=settings.THUMBS_SPRITE_LOCK_TIMEOUT):
+            sheet = self.get_sheet(page)
+            if self.is_fresh(sheet, thumbs):
+                # updated by a concurrent request
+                return sheet, pages
+
+            staged = StagedFiles(self.storage)
+            try:
+                return self.update(page, pages, sheet, thumbs, staged), pages
+            except Exception:
+                staged.delete_all()
+                raise
+
+    def update(self, page, pages, sheet, thumbs, staged):
+        stored = (sheet.pk, sheet.file.name) if sheet else None
+        if sheet is None:
+            sheet = SpriteSheet(user=self.user, thumb_rule=self.rule, page=page)
+
+        known = [entry['thumb'] for entry in sheet.entries]
+        if known != [thumb['pk'] for thumb in thumbs[:len(known)]]:
+            # thumbs were deleted or regenerated, the page is composed again
+            sheet.entries = []
+
+        self.compose(sheet, thumbs[len(sheet.entries):], {thumb['pk']: thumb for thumb in thumbs}, staged)
+
+        with transaction.atomic():
+            current = SpriteSheet.objects.select_for_update().filter(
+                user=self.user,
+                thumb_rule=self.rule,
+                page=page
+            ).values_list('pk', 'file').first()
+            if current != stored:
+                # the sheet was changed in the meantime (the lock expired), theirs is kept
+                staged.delete_all()
+                return self.get_sheet(page)
+
+            # pages left over after images were deleted
+            removed = list(SpriteSheet.objects.select_for_update().filter(
+                user=self.user,
+                thumb_rule=self.rule,
+                page__gte=pages
+            ))
+            for old in removed:
+                if old.file.name:
+                    staged.discard(old.file.name)
+            SpriteSheet.objects.filter(pk__in=[old.pk for old in removed]).delete()
+            sheet.save()
+
+            staged.promote_on_commit()
+        return sheet
+
+    def compose(self, sheet, new, thumbs, staged):
+        '''
+        Adds thumbnails to a sheet and writes it under a new name - urls of changed sheets change too.
+        The row is saved by the caller.
+        '''
+        entries = list(sheet.entries)
+        images = [open_thumb(self.thumb_storage, thumbs[entry['thumb']]['file']) for entry in entries]
+
+        for thumb in new:
+            image = open_thumb(self.thumb_storage, thumb['file'])
+            x, y = place(entries, image.size, self.max_width)
+            entries.append({
+                'id': thumb['parent_id'],
+                'thumb': thumb['pk'],
+                'x': x,
+                'y': y,
+                'width': image.width,
+                'height': image.height
+            })
+            images.append(image)
+
+        width = max(e['x'] + e['width'] for e in entries)
+        height = max(e['y'] + e['height'] for e in entries)
+        canvas = Image.new('RGB', (width, height), BACKGROUND)
+        for entry, image in zip(entries, images):
+            canvas.paste(image, (entry['x'], entry['y']))
+
+        fp = BytesIO()
+        canvas.save(fp, format='JPEG', quality=settings.THUMBS_SPRITE_QUALITY)
+
+        if sheet.file.name:
+            staged.discard(sheet.file.name)
+        sheet.file.name = staged.save(
+            get_sheet_name(self.user.pk, self.rule, sheet.page),
+            ContentFile(fp.getvalue())
+        )
+        sheet.width, sheet.height = width, height
+        sheet.entries = entries
@@ -0,0 +1,86 @@
+'''
+Crash-safe file writes of the upload pipeline.
+Files are written under the staging prefix, while rows already point to
+the final names. Once the transaction commits, staged files are moved to
+the final names (or deleted, if discarded), so a rolled back upload never
+leaves rows without files or files without rows in the storage tree.
+Files left staged by killed workers are swept by
+thumbs.storage_reclaim.sweep_staged_files.
+'''
+import os
+
+from django.conf import settings
+from django.db import transaction
+
+
+def get_staged_name(name):
+    return f'{settings.THUMBS_STAGING_PREFIX}/{name}'
+
+def get_final_name(staged_name):
+    return staged_name[len(settings.THUMBS_STAGING_PREFIX) + 1:]
+
+def move_file(storage, name, new_name):
+    try:
+        path, new_path = storage.path(name), storage.path(new_name)
+    except NotImplementedError:
+        # remote storages - copy and delete
+        with storage.open(name) as f:
+            storage.save(new_name, f)
+        storage.delete(name)
+        return
+
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(path, new_path)
+
+
+class StagedFiles():
+    '''
+    Files written by a single upload (or thumbs regeneration), keyed by their final names
+    '''
+    def __init__(self, storage):
+        self.storage = storage
+        self.staged = {}
+        self.discarded = set()
+
+    def save(self, name, content):
+        '''
+        Writes a file to the staging area, returns its final name
+        '''
+        name = self.storage.get_available_name(name)
+        self.staged[name] = self.storage.save(get_staged_name(name), content)
+        return name
+
+    def path(self, name):
+        return self.storage.path(self.staged.get(name, name))
+
+    def size(self, name):
+        return self.storage.size(self.staged.get(name, name))
+
+    def discard(self, name):
+        '''
+        Marks a file to be deleted once the transaction commits -
+        a staged one (instead of promoting it) or an already stored one
+        '''
+        self.discarded.add(name)
+
+    def promote_on_commit(self):
+        transaction.on_commit(self.promote)
+
+    def promote(self):
+        for name, staged_name in self.staged.items():
+            if name in self.discarded:
+                self.storage.delete(staged_name)
+            else:
+                move_file(self.storage, staged_name, name)
+
+        for name in self.discarded - self.staged.keys():
+            self.storage.delete(name)
+
+        self.staged = {}
+        self.discarded = set()
+
+    def delete_all(self):
+        for staged_name in self.staged.values():
+            self.storage.delete(staged_name)
+        self.staged = {}
+
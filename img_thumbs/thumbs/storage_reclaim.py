@@ -0,0 +1,190 @@
+'''
+Reclaiming of orphaned files - stored files no row points to
+(e.g. thumbs of images deleted through CASCADE).
+The storage tree and the DB file names are both streamed in the same
+(code point) order and diffed with a sorted merge, so neither side
+is loaded at once and no per-file queries are made.
+Stale files of the staging area (see thumbs.staging) are swept here as well.
+Files under the sprites directory belong to sprite sheets (see thumbs.sprites), other ones to images.
+'''
+import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from thumbs.models import SpriteSheet, UserImage
+from thumbs.sprites import SPRITE_PREFIX
+from thumbs.staging import get_final_name, move_file
+
+# binary collations, so the DB orders names the same way as python compares them
+BINARY_COLLATIONS = {
+    'postgresql': 'C',
+    'sqlite': 'BINARY',
+    'mysql': 'utf8mb4_bin',
+}
+
+
+class UnsortedNamesError(ValueError):
+    '''
+    Names are not in the merge order - nothing can be safely reported as orphaned
+    '''
+
+
+def walk_storage(storage, path):
+    '''
+    Yields names of all the files under a storage path, sorted.
+    Entries of a directory are ordered as if directories had a trailing slash,
+    so the whole walk is ordered like the full names.
+    '''
+    try:
+        dirs, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+
+    entries = [(f'{name}/', True) for name in dirs] + [(name, False) for name in files]
+    for name, is_dir in sorted(entries):
+        full_name = f'{path}/{name}' if path else name
+        if is_dir:
+            yield from walk_storage(storage, full_name.rstrip('/'))
+        else:
+            yield full_name
+
+def get_file_model(name, field):
+    '''
+    Model of the rows referencing a stored file (or the files under a prefix)
+    '''
+    if field == 'file' and name.split('/', 1)[0] == SPRITE_PREFIX:
+        return SpriteSheet
+    return UserImage
+
+def get_db_names(prefix, field='file', chunk_size=2000):
+    '''
+    Yields file names (of a given field) of all the rows under a prefix, sorted
+    '''
+    queryset = get_file_model(prefix, field).objects.filter(**{f'{field}__startswith': f'{prefix}/'})
+    collation = BINARY_COLLATIONS.get(connections[queryset.db].vendor)
+    order = Collate(field, collation) if collation else field
+
+    yield from queryset.order_by(order).values_list(field, flat=True).iterator(chunk_size=chunk_size)
+
+def check_sorted(names):
+    previous = None
+    for name in names:
+        if previous is not None and name < previous:
+            raise UnsortedNamesError(f'{name} after {previous}')
+        previous = name
+        yield name
+
+def find_orphans(storage_names, db_names):
+    '''
+    Sorted merge of two ordered name streams, yields storage names missing in the DB
+    '''
+    storage_names = check_sorted(storage_names)
+    db_names = check_sorted(db_names)
+
+    db_name = next(db_names, None)
+    for name in storage_names:
+        while db_name is not None and db_name < name:
+            db_name = next(db_names, None)
+        if name != db_name:
+            yield name
+
+def get_referenced_names(names, field):
+    names_by_model = {}
+    for name in names:
+        names_by_model.setdefault(get_file_model(name, field), []).append(name)
+
+    referenced = set()
+    for model, model_names in names_by_model.items():
+        referenced.update(model.objects.filter(**{f'{field}__in': model_names}).values_list(field, flat=True))
+    return referenced
+
+def delete_batch(storage, batch, field):
+    '''
+    Deletes a batch of orphans, skipping names referenced by rows created in the meantime
+    '''
+    referenced = get_referenced_names(batch, field)
+    for name in batch:
+        if name not in referenced:
+            storage.delete(name)
+    return len(batch) - len(referenced)
+
+def reclaim_storage(storage, prefix='photos', field='file', dry_run=False, grace_seconds=None, batch_size=None):
+    '''
+    Finds orphaned files under a storage prefix and deletes them in batches.
+    Names are diffed against a given field - file, or cold_file for the cold storage.
+    Files modified within the grace period are kept - their rows may not be committed yet.
+    Returns count and bytes of the orphans found, and count of the deleted ones.
+    '''
+    if grace_seconds is None:
+        grace_seconds = settings.THUMBS_RECLAIM_GRACE_SECONDS
+    if batch_size is None:
+        batch_size = settings.THUMBS_RECLAIM_BATCH
+
+    cutoff = timezone.now() - datetime.timedelta(seconds=grace_seconds)
+    found, found_bytes, deleted = 0, 0, 0
+    batch = []
+
+    for name in find_orphans(walk_storage(storage, prefix), get_db_names(prefix, field)):
+        if storage.get_modified_time(name) > cutoff:
+            continue
+
+        found += 1
+        found_bytes += storage.size(name)
+        if dry_run:
+            continue
+
+        batch.append(name)
+        if len(batch) >= batch_size:
+            deleted += delete_batch(storage, batch, field)
+            batch = []
+
+    if batch:
+        deleted += delete_batch(storage, batch, field)
+
+    return found, found_bytes, deleted
+
+
+def sweep_staged_files(storage, field='file', ttl=None, batch_size=1000):
+    '''
+    Handles files staged longer than ttl seconds ago - files of committed rows
+    (the worker died before promoting them) are promoted, the rest is deleted.
+    Returns counts of promoted and deleted files.
+    '''
+    if ttl is None:
+        ttl = settings.THUMBS_STAGING_TTL
+    cutoff = timezone.now() - datetime.timedelta(seconds=ttl)
+
+    promoted, deleted = 0, 0
+    batch = []
+
+    def sweep_batch(batch):
+        names = [get_final_name(staged_name) for staged_name in batch]
+        committed = get_referenced_names(names, field)
+
+        promoted = 0
+        for staged_name, name in zip(batch, names):
+            if name in committed and not storage.exists(name):
+                move_file(storage, staged_name, name)
+                promoted += 1
+            else:
+                storage.delete(staged_name)
+        return promoted, len(batch) - promoted
+
+    for staged_name in walk_storage(storage, settings.THUMBS_STAGING_PREFIX):
+        if storage.get_modified_time(staged_name) > cutoff:
+            continue
+
+        batch.append(staged_name)
+        if len(batch) >= batch_size:
+            counts = sweep_batch(batch)
+            promoted, deleted = promoted + counts[0], deleted + counts[1]
+            batch = []
+
+    if batch:
+        counts = sweep_batch(batch)
+        promoted, deleted = promoted + counts[0], deleted + counts[1]
+
+    return promoted, deleted
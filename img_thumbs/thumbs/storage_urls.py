@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def get_signed_url_expiry(storage):
+    '''
+    Returns lifetime (in seconds) of urls signed by a storage backend,
+    or None for storages returning plain, non expiring urls
+    '''
+    # django-storages backends (S3, Azure, Google Cloud)
+    if not getattr(storage, 'querystring_auth', False):
+        return None
+
+    expire = getattr(storage, 'querystring_expire', None) or getattr(storage, 'expiration', None)
+    if expire is None:
+        return None
+    if hasattr(expire, 'total_seconds'):
+        expire = expire.total_seconds()
+    return int(expire)
+
+def get_storage_key(storage):
+    '''
+    Identifies a storage by its class and where it stores files - storages are instantiated
+    per field or per call, so equal ones share cached urls and a new object at a reused
+    address doesn't get urls of another one
+    '''
+    cls = type(storage)
+    return (
+        f'{cls.__module__}.{cls.__qualname__}',
+        getattr(storage, 'location', None),
+        getattr(storage, 'bucket_name', None),
+        getattr(storage, 'base_url', None)
+    )
+
+
+class CachedUrlProvider():
+    '''
+    Memoizes storage.url() results, keyed on the storage and file name.
+    For signed urls entries expire before the signature does
+    (THUMBS_URL_CACHE_SIGNED_MARGIN seconds earlier), so a cached url
+    is always valid for at least that long after it is returned.
+    Limits not given are read from THUMBS_URL_CACHE_* settings on access.
+    '''
+    def __init__(self, ttl=None, max_size=None, signed_margin=None):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._signed_margin = signed_margin
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return settings.THUMBS_URL_CACHE_TTL if self._ttl is None else self._ttl
+
+    @property
+    def max_size(self):
+        return settings.THUMBS_URL_CACHE_SIZE if self._max_size is None else self._max_size
+
+    @property
+    def signed_margin(self):
+        return settings.THUMBS_URL_CACHE_SIGNED_MARGIN if self._signed_margin is None else self._signed_margin
+
+    def get_ttl(self, storage):
+        expiry = get_signed_url_expiry(storage)
+        if expiry is None:
+            return self.ttl
+        return max(min(self.ttl, expiry - self.signed_margin), 0)
+
+    def url(self, name, storage):
+        key = (get_storage_key(storage), name)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                return entry[0]
+
+        url = storage.url(name)
+
+        ttl = self.get_ttl(storage)
+        if ttl <= 0:
+            return url
+
+        with self.lock:
+            self.entries[key] = (url, now + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return url
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+url_provider = CachedUrlProvider()
+
+def get_file_url(name, storage):
+    '''
+    Returns a (possibly cached) url of a stored file
+    '''
+    if not settings.THUMBS_URL_CACHE_TTL:
+        return storage.url(name)
+    return url_provider.url(name, storage)
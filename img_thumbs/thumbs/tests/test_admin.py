@@ -0,0 +1,140 @@
+import datetime
+import os
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from thumbs.admin import EstimatedCountPaginator
+from thumbs.models import ImageTempLink, ThumbPlan, ThumbUser, UserImage
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+@override_settings(THUMBS_ADMIN_JOBS_IN_BACKGROUND=False, THUMBS_ADMIN_JOB_CHUNK=1)
+class TestAdmin(TestCase):
+    def setUp(self):
+        self.rules = create_test_rules()
+
+        self.plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+        self.plan.thumb_rules.set(self.rules[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = self.plan
+        )
+
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@test.com',
+            password='admin'
+        )
+        self.client.force_login(self.admin)
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def create_image(self, img_file=TEST_IMAGES[0]):
+        with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+        return img
+
+    def create_links(self, image, count, expired=False):
+        delta = datetime.timedelta(seconds=-60 if expired else 600)
+        return ImageTempLink.objects.bulk_create([
+            ImageTempLink(image=image, expiration=timezone.now() + delta)
+            for _ in range(count)
+        ])
+
+    def get_changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return len(context.captured_queries)
+
+    def test_changelist_query_count(self):
+        img = self.create_image()
+        self.image_ids_to_delete.append(img.pk)
+        self.image_ids_to_delete.extend([a.pk for a in img.thumbs.all()])
+        self.create_links(img, 2)
+
+        images_queries = self.get_changelist_queries('/admin/thumbs/userimage/')
+        links_queries = self.get_changelist_queries('/admin/thumbs/imagetemplink/')
+
+        # more rows don't add queries
+        for _ in range(3):
+            thumb = UserImage.objects.create(user=self.user, parent=img, thumb_rule=self.rules[0])
+            self.image_ids_to_delete.append(thumb.pk)
+        self.create_links(img, 10)
+
+        self.assertEqual(images_queries, self.get_changelist_queries('/admin/thumbs/userimage/'))
+        self.assertEqual(links_queries, self.get_changelist_queries('/admin/thumbs/imagetemplink/'))
+
+    def test_paginator_exact_count(self):
+        img = self.create_image()
+        self.image_ids_to_delete.append(img.pk)
+        self.image_ids_to_delete.extend([a.pk for a in img.thumbs.all()])
+        self.create_links(img, 3)
+
+        # no table statistics on SQLite
+        paginator = EstimatedCountPaginator(ImageTempLink.objects.order_by('pk'), 2)
+        self.assertEqual(3, paginator.count)
+
+    def test_regenerate_thumbs_action(self):
+        images = [self.create_image(img_file) for img_file in TEST_IMAGES]
+        old_thumbs = [thumb for img in images for thumb in img.thumbs.all()]
+        old_paths = [thumb.file.path for thumb in old_thumbs]
+
+        self.plan.thumb_rules.set(self.rules[1:3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/thumbs/userimage/', {
+                'action': 'regenerate_thumbs',
+                '_selected_action': [img.pk for img in images]
+            })
+        self.assertEqual(302, response.status_code)
+
+        for img in images:
+            img.refresh_from_db()
+            self.image_ids_to_delete.append(img.pk)
+            self.image_ids_to_delete.extend([a.pk for a in img.thumbs.all()])
+
+            heights = sorted(thumb.thumb_rule.height for thumb in img.thumbs.all())
+            self.assertEqual([400, 600], heights)
+            self.assertEqual([400, 600, 'original'], [v['key'] for v in img.manifest])
+
+        self.assertFalse(UserImage.objects.filter(pk__in=[t.pk for t in old_thumbs]).exists())
+        for path in old_paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_purge_expired_links_action(self):
+        img = self.create_image()
+        self.image_ids_to_delete.append(img.pk)
+        self.image_ids_to_delete.extend([a.pk for a in img.thumbs.all()])
+
+        self.create_links(img, 3, expired=True)
+        self.create_links(img, 2)
+
+        response = self.client.post('/admin/thumbs/imagetemplink/', {
+            'action': 'purge_expired_links',
+            '_selected_action': list(ImageTempLink.objects.values_list('pk', flat=True))
+        })
+        self.assertEqual(302, response.status_code)
+
+        self.assertEqual(2, ImageTempLink.objects.count())
+        self.assertFalse(ImageTempLink.objects.filter(image=img, expiration__lt=timezone.now()).exists())
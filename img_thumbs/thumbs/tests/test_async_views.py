@@ -0,0 +1,107 @@
+import datetime
+import json
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files import File
+from django.test import AsyncRequestFactory, TestCase
+from django.utils import timezone
+from rest_framework import status
+
+from thumbs.async_views import image_list_view, parse_image_temp_link_view
+from thumbs.models import ImageTempLink, ThumbPlan, ThumbUser, UserImage
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.rules = create_test_rules()
+
+        plan = ThumbPlan.objects.create(
+            name = 'MULTIPLE_PLAN',
+            use_source_img=True,
+            use_expiring_links=True
+        )
+        plan.thumb_rules.set(self.rules[:2])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        self.image_ids_to_delete = []
+
+        for img_file in TEST_IMAGES:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+                img = UserImage.objects.create(
+                    user=self.user,
+                    file = File(f)
+                )
+            self.image_ids_to_delete.append(img.pk)
+            self.image_ids_to_delete.extend(
+                [a.pk for a in img.thumbs.all()]
+            )
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    async def test_image_list(self):
+        request = self.factory.get('/thumbs/list_img/')
+        request.user = self.user
+
+        response = await image_list_view(request)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(TEST_IMAGES), len(data))
+        for img in data:
+            self.assertIn('original', img['urls'])
+            for rule in self.rules[:2]:
+                self.assertIn(str(rule.height), img['urls'])
+
+    async def test_image_list_no_login(self):
+        request = self.factory.get('/thumbs/list_img/')
+        request.user = AnonymousUser()
+
+        response = await image_list_view(request)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def create_link(self, seconds):
+        img = UserImage.objects.filter(user=self.user, parent__isnull=True).first()
+        link_obj = ImageTempLink.objects.create(
+            image = img,
+            expiration = timezone.now() + datetime.timedelta(seconds=seconds)
+        )
+        return img, link_obj.generate_link()
+
+    def test_parse_temp_link(self):
+        img, link = self.create_link(settings.TEMP_LINK_MIN_SECONDS)
+        slug = link.split('/')[-1]
+
+        request = self.factory.get(link)
+        response = async_to_sync(parse_image_temp_link_view)(request, slug)
+        self.assertEqual(status.HTTP_302_FOUND, response.status_code)
+        self.assertEqual(response.url, img.file.url)
+
+    def test_parse_temp_link_expired(self):
+        img, link = self.create_link(-1)
+        slug = link.split('/')[-1]
+
+        request = self.factory.get(link)
+        response = async_to_sync(parse_image_temp_link_view)(request, slug)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_parse_temp_link_wrong_sign(self):
+        img, link = self.create_link(settings.TEMP_LINK_MIN_SECONDS)
+        slug = link.split('/')[-1][:-1]
+
+        request = self.factory.get(link)
+        response = async_to_sync(parse_image_temp_link_view)(request, slug)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
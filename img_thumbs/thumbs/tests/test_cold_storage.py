@@ -0,0 +1,163 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from thumbs.cold_storage import get_cold_storage
+from thumbs.jobs import regenerate_thumbs
+from thumbs.models import ThumbPlan, ThumbUser, UserImage
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestSourceRetention(TestCase):
+    def setUp(self):
+        self.cold_root = tempfile.mkdtemp()
+        self.override = override_settings(
+            THUMBS_COLD_STORAGE_OPTIONS={'location': self.cold_root},
+            THUMBS_ADMIN_JOB_CHUNK=1
+        )
+        self.override.enable()
+
+        self.rules = create_test_rules()
+        self.plan = ThumbPlan.objects.create(
+            name = 'NO_SOURCE_PLAN',
+            use_source_img=False,
+            source_retention_days=7
+        )
+        self.plan.thumb_rules.set(self.rules[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = self.plan
+        )
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+        self.override.disable()
+        shutil.rmtree(self.cold_root)
+
+    def create_image(self, img_file):
+        with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+        img.refresh_from_db()
+        return img
+
+    def add_image_for_delete(self, img):
+        self.image_ids_to_delete.append(img.pk)
+        self.image_ids_to_delete.extend(
+            [a.pk for a in img.thumbs.all()]
+        )
+
+    def test_source_retained(self):
+        # compressed formats are stored as is
+        for img_file in TEST_IMAGES:
+            img = self.create_image(img_file)
+            self.add_image_for_delete(img)
+
+            self.assertEqual('', img.file.name)
+            self.assertFalse(img.cold_file.endswith('.gz'))
+            self.assertAlmostEqual(
+                timezone.now() + datetime.timedelta(days=7),
+                img.cold_expires,
+                delta=datetime.timedelta(minutes=1)
+            )
+
+            with get_cold_storage().open(img.cold_file, 'rb') as f, open(img_file, 'rb') as source:
+                self.assertEqual(source.read(), f.read())
+
+    def test_uncompressed_source_retained(self):
+        source = tempfile.NamedTemporaryFile(suffix='.bmp')
+        self.addCleanup(source.close)
+        Image.open(TEST_IMAGES[0]).save(source, format='BMP')
+        source.flush()
+
+        img = self.create_image(source.name)
+
+        self.assertTrue(img.cold_file.endswith('.bmp.gz'))
+        with get_cold_storage().open(img.cold_file, 'rb') as f, open(source.name, 'rb') as original:
+            content = f.read()
+            self.assertEqual(original.read(), gzip.decompress(content))
+        self.assertLess(len(content), os.path.getsize(source.name))
+
+        # thumbs are regenerated from the decompressed copy
+        self.plan.thumb_rules.set(self.rules[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(1, regenerate_thumbs([img.pk]))
+        img.refresh_from_db()
+        self.add_image_for_delete(img)
+        self.assertEqual([200, 400], [v['key'] for v in img.manifest])
+
+    def test_default_retention(self):
+        self.assertEqual(0, ThumbPlan.objects.create(name='DEFAULT_PLAN').source_retention_days)
+
+    def test_source_not_retained(self):
+        self.plan.source_retention_days = 0
+        self.plan.save()
+
+        img = self.create_image(TEST_IMAGES[0])
+        self.add_image_for_delete(img)
+
+        self.assertEqual('', img.cold_file)
+        self.assertIsNone(img.cold_expires)
+
+    def test_regenerate_from_cold_storage(self):
+        img = self.create_image(TEST_IMAGES[0])
+        thumb_name = img.thumbs.get().file.name
+
+        # a rule added later
+        self.plan.thumb_rules.set(self.rules[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(1, regenerate_thumbs([img.pk]))
+
+        img.refresh_from_db()
+        self.add_image_for_delete(img)
+
+        thumbs = list(img.thumbs.select_related('thumb_rule').order_by('thumb_rule__height'))
+        self.assertEqual([200, 400], [thumb.thumb_rule.height for thumb in thumbs])
+        # thumbs are named after the source, next to it
+        for thumb in thumbs:
+            self.assertNotEqual(thumb_name, thumb.file.name)
+            self.assertTrue(thumb.file.name.startswith(f'photos/{self.user.pk}/'))
+            self.assertTrue(thumb.file.name.endswith('.jpg'))
+        self.assertEqual([200, 400], [v['key'] for v in img.manifest])
+
+    def test_expire_cold_sources(self):
+        images = [self.create_image(img_file) for img_file in TEST_IMAGES]
+        for img in images:
+            self.add_image_for_delete(img)
+
+        expired = images[0]
+        UserImage.objects.filter(pk=expired.pk).update(
+            cold_expires=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+        call_command('expire_cold_sources')
+
+        storage = get_cold_storage()
+        self.assertFalse(storage.exists(expired.cold_file))
+        self.assertTrue(storage.exists(images[1].cold_file))
+
+        expired.refresh_from_db()
+        self.assertEqual('', expired.cold_file)
+        self.assertIsNone(expired.cold_expires)
+
+        # images without a source or its copy can't be regenerated
+        self.assertEqual(0, regenerate_thumbs([expired.pk]))
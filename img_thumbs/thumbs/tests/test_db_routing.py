@@ -0,0 +1,130 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import router
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.models import ImageTempLink, ThumbPlan, ThumbUser, UserImage
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+@override_settings(THUMBS_READ_REPLICAS=['replica'])
+class TestReplicaRouting(APITestCase):
+    # two SQLite databases stand in for the primary and a replica lagging behind it
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        plan = ThumbPlan.objects.create(
+            name = 'ENTERPRISE_PLAN',
+            use_source_img=True,
+            use_expiring_links=True
+        )
+        plan.thumb_rules.set(create_test_rules()[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        User(pk=self.user.pk, username=self.user.username).save(using='replica')
+
+        self.client.force_authenticate(self.user)
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def create_image(self, alias, name):
+        '''
+        A root image row (without a file) in one of the databases only
+        '''
+        UserImage.objects.using(alias).bulk_create([UserImage(
+            user=self.user,
+            file=name,
+            manifest=[{'key': 'original', 'id': None, 'name': name, 'format': 'JPEG', 'size': 1}]
+        )])
+        return UserImage.objects.using(alias).get(file=name)
+
+    def create_link(self, alias, image):
+        ImageTempLink.objects.using(alias).bulk_create([ImageTempLink(
+            image=image,
+            expiration=timezone.now() + datetime.timedelta(minutes=5)
+        )])
+        return ImageTempLink.objects.using(alias).get(image=image)
+
+    def list_names(self):
+        response = self.client.get('/thumbs/list_img/')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [img['urls']['original']['url'].split('/')[-1] for img in response.data]
+
+    def test_list_reads_replica(self):
+        self.create_image('replica', 'photos/replica.jpg')
+        self.create_image('default', 'photos/primary.jpg')
+
+        self.assertEqual(['replica.jpg'], self.list_names())
+
+    def test_sticky_after_link_creation(self):
+        image = self.create_image('default', 'photos/primary.jpg')
+
+        response = self.client.get('/thumbs/get_img_temp_link/', {'img': image.pk, 'exp': 300})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        cookie = response.cookies[settings.THUMBS_REPLICA_STICKY_COOKIE]
+        self.assertEqual(settings.THUMBS_REPLICA_STICKY_SECONDS, cookie['max-age'])
+
+        # the client reads its own writes
+        self.assertEqual(['primary.jpg'], self.list_names())
+        response = self.client.get(response.data)
+        self.assertEqual(status.HTTP_302_FOUND, response.status_code)
+
+        # other clients read from the replica
+        self.client.cookies.clear()
+        self.assertEqual([], self.list_names())
+
+    def test_sticky_after_upload(self):
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/thumbs/upload_img/', {'file':f}, format='multipart')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+        self.assertIn(settings.THUMBS_REPLICA_STICKY_COOKIE, response.cookies)
+        self.assertEqual([response.data['id']], [img['id'] for img in self.client.get('/thumbs/list_img/').data])
+
+    def test_temp_link_reads_replica(self):
+        self.client.cookies.clear()
+        link = self.create_link('replica', self.create_image('replica', 'photos/replica.jpg'))
+
+        response = self.client.get(link.generate_link())
+        self.assertEqual(status.HTTP_302_FOUND, response.status_code)
+        self.assertTrue(response.url.endswith('replica.jpg'))
+
+    def test_temp_link_not_replicated_yet(self):
+        # created by another client moments ago
+        link = self.create_link('default', self.create_image('default', 'photos/primary.jpg'))
+
+        response = self.client.get(link.generate_link())
+        self.assertEqual(status.HTTP_302_FOUND, response.status_code)
+        self.assertTrue(response.url.endswith('primary.jpg'))
+
+    @override_settings(THUMBS_READ_REPLICAS=[])
+    def test_without_replicas(self):
+        image = self.create_image('default', 'photos/primary.jpg')
+        self.create_image('replica', 'photos/replica.jpg')
+
+        response = self.client.get('/thumbs/get_img_temp_link/', {'img': image.pk, 'exp': 300})
+        self.assertNotIn(settings.THUMBS_REPLICA_STICKY_COOKIE, response.cookies)
+        self.assertEqual(['primary.jpg'], self.list_names())
+
+    def test_writes_go_to_primary(self):
+        image = self.create_image('replica', 'photos/replica.jpg')
+
+        self.assertEqual('default', router.db_for_write(UserImage, instance=image))
+        self.assertTrue(router.allow_relation(image, self.user))
@@ -0,0 +1,173 @@
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image, ImageOps
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.dedup import get_bands, hamming_distances, perceptual_hash
+from thumbs.models import ImageHashBucket, ThumbPlan, ThumbUser, UserImage
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+def encode(image, format='JPEG', **options):
+    fp = BytesIO()
+    image.save(fp, format=format, **options)
+    fp.seek(0)
+    return fp
+
+
+class TestPerceptualHash(TestCase):
+    def setUp(self):
+        self.image = Image.open(TEST_IMAGES[0])
+
+    def test_near_duplicates(self):
+        phash = perceptual_hash(self.image)
+
+        resized = self.image.resize((self.image.width // 3, self.image.height // 3))
+        copies = [
+            Image.open(TEST_IMAGES[1]),
+            Image.open(encode(resized, quality=40)),
+            self.image.convert('RGBA')
+        ]
+        distances = hamming_distances(phash, [perceptual_hash(copy) for copy in copies])
+        self.assertTrue(all(distances <= 3), distances)
+
+        other = perceptual_hash(ImageOps.flip(self.image))
+        self.assertGreater(hamming_distances(phash, [other])[0], 10)
+
+    def test_bands(self):
+        phash = perceptual_hash(self.image)
+
+        value = 0
+        for band, key in enumerate(get_bands(phash)):
+            self.assertLess(key, 1 << 16)
+            value |= key << (16 * band)
+        self.assertEqual(phash, value - (1 << 64) if value >= 1 << 63 else value)
+
+    def test_hamming_distances(self):
+        self.assertEqual([0, 1, 64, 2], list(hamming_distances(-1, [-1, -2, 0, (1 << 63) - 2])))
+
+
+class TestNearDuplicateUploads(APITestCase):
+    def setUp(self):
+        self.rules = create_test_rules()
+        plan = ThumbPlan.objects.create(name='BASIC_PLAN')
+        plan.thumb_rules.set(self.rules[:2])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        self.client.force_authenticate(self.user)
+
+        self.image = Image.open(TEST_IMAGES[0])
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def upload_image(self, image, format='JPEG', **options):
+        options = options or ({'quality': 90} if format == 'JPEG' else {})
+        name = f'image.{format.lower()}'
+        file = SimpleUploadedFile(name, encode(image, format=format, **options).read(), Image.MIME[format])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/thumbs/upload_img/', {'file':file}, format='multipart')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.image_ids_to_delete.append(response.data['id'])
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+        return response.data
+
+    def get_copy(self):
+        return self.image.resize((self.image.width // 2, self.image.height // 2))
+
+    def test_flagged_duplicate(self):
+        first = self.upload_image(self.image)
+        self.assertIsNone(first['duplicate_of'])
+
+        copy = self.upload_image(self.get_copy(), quality=50)
+        self.assertEqual(first['id'], copy['duplicate_of'])
+        self.assertEqual(first['id'], UserImage.objects.get(pk=copy['id']).duplicate_of_id)
+
+        other = self.upload_image(ImageOps.flip(self.image))
+        self.assertIsNone(other['duplicate_of'])
+
+        # images are indexed by all their bands
+        self.assertEqual(4, ImageHashBucket.objects.filter(image_id=first['id']).count())
+        self.assertEqual(12, ImageHashBucket.objects.filter(user=self.user).count())
+
+    def test_other_users(self):
+        self.upload_image(self.image)
+
+        other_user = User.objects.create_user(username='other_user')
+        ThumbUser.objects.create(user=other_user, plan=self.user.thumb_user.plan)
+        self.client.force_authenticate(other_user)
+
+        self.assertIsNone(self.upload_image(self.image)['duplicate_of'])
+
+    @override_settings(THUMBS_DUPLICATE_ACTION='reuse')
+    def test_reused_thumbs(self):
+        first = self.upload_image(self.image)
+        copy = self.upload_image(self.get_copy(), quality=50)
+        self.assertEqual(first['id'], copy['duplicate_of'])
+
+        for key in (200, 400):
+            original, reused = first['urls'][key], copy['urls'][key]
+            self.assertNotEqual(original['url'], reused['url'])
+            self.assertEqual(
+                (original['width'], original['height'], original['size']),
+                (reused['width'], reused['height'], reused['size'])
+            )
+            with open(UserImage.objects.get(pk=original['id']).file.path, 'rb') as f:
+                content = f.read()
+            with open(UserImage.objects.get(pk=reused['id']).file.path, 'rb') as f:
+                self.assertEqual(content, f.read())
+
+    @override_settings(THUMBS_DUPLICATE_ACTION='reuse')
+    def test_reuse_across_formats(self):
+        # thumbs are rendered in the source format, a JPEG duplicate's thumbs can't be reused for a PNG
+        first = self.upload_image(self.image)
+        copy = self.upload_image(self.get_copy(), format='PNG')
+        self.assertEqual(first['id'], copy['duplicate_of'])
+
+        for key in (200, 400):
+            thumb = UserImage.objects.get(pk=copy['urls'][key]['id'])
+            self.assertTrue(thumb.file.name.endswith('.png'))
+            with Image.open(thumb.file.path) as image:
+                self.assertEqual('PNG', image.format)
+            self.assertEqual('PNG', [
+                variant['format'] for variant in UserImage.objects.get(pk=copy['id']).manifest
+                if variant['key'] == key
+            ][0])
+
+    @override_settings(THUMBS_DUPLICATE_ACTION='reuse')
+    def test_reuse_animated(self):
+        # a still duplicate's thumbs can't be reused for an animated source of the same format
+        ThumbPlan.objects.filter(name='BASIC_PLAN').update(use_animated_thumbs=True)
+        self.user.refresh_from_db()
+        still = self.image.resize((300, 180))
+        frames = [still, ImageOps.autocontrast(still, cutoff=1)]
+
+        first = self.upload_image(still, format='GIF')
+        copy = self.upload_image(frames[0], format='GIF', save_all=True, append_images=frames[1:], duration=100)
+        self.assertEqual(first['id'], copy['duplicate_of'])
+
+        thumb = UserImage.objects.get(pk=copy['urls'][200]['id'])
+        with Image.open(thumb.file.path) as image:
+            self.assertTrue(image.is_animated)
+
+    @override_settings(THUMBS_DUPLICATE_MAX_DISTANCE=None)
+    def test_disabled_lookup(self):
+        self.upload_image(self.image)
+        copy = self.upload_image(self.image)
+
+        self.assertIsNone(copy['duplicate_of'])
+        self.assertIsNotNone(UserImage.objects.get(pk=copy['id']).phash)
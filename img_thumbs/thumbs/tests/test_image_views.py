@@ -1,13 +1,22 @@
 import json
+import os
 import pathlib
+import threading
+import time
+from unittest import mock
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files import File
 from django.db.models import Q
+from django.test import override_settings
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from thumbs.models import ThumbPlan, ThumbUser, UserImage
+from thumbs.idempotency import IN_FLIGHT, idempotency_store
+from thumbs.models import ThumbPlan, ThumbRule, ThumbUser, UserImage
+from thumbs.scheduler import ThumbnailScheduler
 
 from .utils import (NON_IMAGE_FILE, TEST_IMAGES, create_test_rules,
                     delete_test_files)
@@ -26,6 +35,7 @@ class TestImageUploadView(APITestCase):
 
     def tearDown(self):
         delete_test_files(self.image_ids_to_delete)
+        cache.clear()
 
     def test_image_upload_single_thumb(self):
         plan = ThumbPlan.objects.create(
@@ -43,7 +53,7 @@ class TestImageUploadView(APITestCase):
         self.client.force_authenticate(self.user)
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 response = self.client.post(
                     '/thumbs/upload_img/',
                     {'file':f}, format='multipart'
@@ -60,6 +70,7 @@ class TestImageUploadView(APITestCase):
 
             thumb = UserImage.objects.get(pk=thumb_id)
             self.assertIsNotNone(thumb.file.name)
+            self.assertTrue(response.data['placeholder'].startswith('data:image/jpeg;base64,'))
 
             path_obj = pathlib.Path(thumb.file.path)
             self.assertTrue(path_obj.exists())
@@ -79,7 +90,7 @@ class TestImageUploadView(APITestCase):
 
         self.client.force_authenticate(self.user)
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 response = self.client.post(
                     '/thumbs/upload_img/',
                     {'file':f}, format='multipart'
@@ -116,7 +127,7 @@ class TestImageUploadView(APITestCase):
         self.client.force_authenticate(self.user)
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 response = self.client.post(
                     '/thumbs/upload_img/',
                     {'file':f}, format='multipart'
@@ -135,6 +146,170 @@ class TestImageUploadView(APITestCase):
             path_obj = pathlib.Path(img.file.path)
             self.assertTrue(path_obj.exists())
 
+    def test_image_upload_srcset(self):
+        plan = ThumbPlan.objects.create(
+            name = 'RESPONSIVE_PLAN',
+            use_source_img=True
+        )
+
+        plan.thumb_rules.set([
+            self.rules[0],
+            ThumbRule.objects.create(width=300),
+            ThumbRule.objects.create(width=250, height=100)
+        ])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        self.client.force_authenticate(self.user)
+
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart'
+            )
+
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+
+        # 1449x862 source
+        urls = response.data['urls']
+        expected_sizes = {
+            200: (336, 200),
+            '300w': (300, 178),
+            '250x100': (168, 100),
+            'original': (1449, 862)
+        }
+        self.assertEqual(set(expected_sizes), set(urls))
+
+        for key, size in expected_sizes.items():
+            self.assertEqual(size, (urls[key]['width'], urls[key]['height']))
+
+            img = UserImage.objects.get(pk=urls[key]['id'])
+            self.assertEqual(img.file.size, urls[key]['size'])
+            self.assertEqual(size, Image.open(img.file.path).size)
+
+        srcset = ', '.join(
+            f"{urls[key]['url']} {urls[key]['width']}w"
+            for key in ['250x100', '300w', 200, 'original']
+        )
+        self.assertEqual(srcset, response.data['srcset'])
+
+    def create_single_thumb_user(self):
+        plan = ThumbPlan.objects.create(
+            name = 'SINGLE_PLAN',
+            use_source_img=True
+        )
+
+        plan.thumb_rules.set([self.rules[0]])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        self.client.force_authenticate(self.user)
+
+    def upload_with_key(self, img_file, key):
+        with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart',
+                HTTP_IDEMPOTENCY_KEY=key
+            )
+
+        if response.status_code == status.HTTP_201_CREATED:
+            for img in response.data['urls'].values():
+                if img['id'] not in self.image_ids_to_delete:
+                    self.image_ids_to_delete.append(img['id'])
+        return response
+
+    def test_image_upload_idempotency_key(self):
+        self.create_single_thumb_user()
+
+        first = self.upload_with_key(TEST_IMAGES[0], 'upload-1')
+        retry = self.upload_with_key(TEST_IMAGES[0], 'upload-1')
+
+        self.assertEqual(status.HTTP_201_CREATED, first.status_code)
+        self.assertEqual(status.HTTP_201_CREATED, retry.status_code)
+        self.assertEqual(first.data, retry.data)
+        self.assertEqual(1, UserImage.objects.filter(user=self.user, parent__isnull=True).count())
+
+        other = self.upload_with_key(TEST_IMAGES[0], 'upload-2')
+        self.assertNotEqual(first.data['id'], other.data['id'])
+
+    def test_image_upload_idempotency_key_reused(self):
+        self.create_single_thumb_user()
+
+        self.upload_with_key(TEST_IMAGES[0], 'upload-1')
+        response = self.upload_with_key(TEST_IMAGES[1], 'upload-1')
+
+        self.assertEqual(status.HTTP_422_UNPROCESSABLE_ENTITY, response.status_code)
+
+    def test_image_upload_idempotency_key_in_flight(self):
+        self.create_single_thumb_user()
+
+        # a duplicate waits for the result of the in-flight request
+        cache_key = idempotency_store.get_cache_key(self.user.pk, 'upload-1')
+        cache.set(cache_key, IN_FLIGHT)
+        stored = {'fingerprint': 'image.jpg:{}'.format(os.path.getsize(TEST_IMAGES[0])), 'status': 201, 'data': {'id': 1, 'urls': {}}}
+        timer = threading.Timer(0.3, lambda: cache.set(cache_key, stored))
+        timer.start()
+
+        response = self.upload_with_key(TEST_IMAGES[0], 'upload-1')
+        timer.join()
+
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(stored['data'], response.data)
+        self.assertFalse(UserImage.objects.filter(user=self.user).exists())
+
+    def test_idempotency_key_in_flight_refreshed(self):
+        # the marker of a request running longer than the lock timeout doesn't expire
+        cache_key = idempotency_store.get_cache_key(self.user.pk, 'upload-1')
+
+        def func():
+            time.sleep(1)
+            return status.HTTP_201_CREATED, {'marker': cache.get(cache_key)}
+
+        with mock.patch.object(idempotency_store, 'lock_timeout', 0.3):
+            _, data = idempotency_store.run(self.user.pk, 'upload-1', '', func)
+        self.assertEqual(IN_FLIGHT, data['marker'])
+
+    def test_image_upload_scheduler_busy(self):
+        self.create_single_thumb_user()
+
+        busy = ThumbnailScheduler(slots=1, timeout=0.05)
+        with mock.patch('thumbs.models.models_image.scheduler', busy), busy.job(0):
+            with open(TEST_IMAGES[0], 'rb') as f:
+                response = self.client.post(
+                    '/thumbs/upload_img/',
+                    {'file':f}, format='multipart'
+                )
+
+        self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+        self.assertFalse(UserImage.objects.filter(user=self.user).exists())
+
+    @override_settings(THUMBS_LOW_MEMORY_PIXELS=1000)
+    def test_image_upload_above_low_memory_limit(self):
+        # PNGs can't be decoded in bands, they are decoded in full
+        self.create_single_thumb_user()
+
+        with open(TEST_IMAGES[1], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart'
+            )
+
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual((336, 200), (response.data['urls'][200]['width'], response.data['urls'][200]['height']))
+
     def test_image_upload_nologin(self):
         with open(TEST_IMAGES[0], 'rb') as f:
             response = self.client.post(
@@ -228,7 +403,7 @@ class TestImageListView(APITestCase):
 
         for user in self.users:
             for img_file in TEST_IMAGES:
-                with open(img_file, 'rb') as f:
+                with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                     img = UserImage.objects.create(
                         user=user,
                         file = File(f)
@@ -263,6 +438,21 @@ class TestImageListView(APITestCase):
             for img in all_images:
                 self.assertIn(img.file.name, json.dumps(response.data))
 
+            # placeholders are inlined, so no extra request is needed to paint
+            for img in response.data:
+                self.assertTrue(img['placeholder'].startswith('data:image/jpeg;base64,'))
+                self.assertIn(f"{img['urls']['original']['url']} 1449w", img['srcset'])
+
+    def test_image_list_query_count(self):
+        user = self.users[0]
+        self.client.force_authenticate(user)
+
+        # single query for the images, regardless of the thumbs count
+        with self.assertNumQueries(1):
+            response = self.client.get('/thumbs/list_img/')
+
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
     def test_image_list_no_login(self):
         for user in self.users:
             response = self.client.get('/thumbs/list_img/')
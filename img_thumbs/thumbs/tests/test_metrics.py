@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.metrics import MetricsRegistry
+from thumbs.models import ThumbPlan, ThumbUser
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+def get_sample(text, sample):
+    '''
+    Value of a sample line (name with labels) of an exposition, 0 if missing
+    '''
+    for line in text.splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.split(' ')[-1])
+    return 0
+
+
+class TestMetricsRegistry(SimpleTestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            THUMBS_METRICS_DIR=self.metrics_dir,
+            THUMBS_METRICS_FLUSH_INTERVAL=0
+        )
+        self.override.enable()
+
+        self.registry = MetricsRegistry()
+        self.counter = self.registry.counter('test_total', 'Test counter', ['plan'])
+        self.histogram = self.registry.histogram('test_seconds', 'Test histogram', buckets=[0.1, 1])
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.metrics_dir)
+
+    def test_exposition(self):
+        self.counter.inc(plan='Basic')
+        self.counter.inc(2, plan='Basic')
+        self.counter.inc(plan='Say "hi"')
+        self.histogram.observe(0.05)
+        self.histogram.observe(0.5)
+        self.histogram.observe(5)
+
+        self.assertEqual([
+            '# HELP test_total Test counter',
+            '# TYPE test_total counter',
+            'test_total{plan="Basic"} 3',
+            'test_total{plan="Say \\"hi\\""} 1',
+            '# HELP test_seconds Test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ], self.registry.exposition().splitlines())
+
+    def test_labels_validated(self):
+        with self.assertRaises(ValueError):
+            self.counter.inc()
+        with self.assertRaises(ValueError):
+            self.counter.inc(plan='Basic', rule='200')
+        with self.assertRaises(ValueError):
+            self.counter.inc(-1, plan='Basic')
+
+    def test_processes_merged(self):
+        self.counter.inc(plan='Basic')
+        self.histogram.observe(0.05)
+
+        # values written by another worker process
+        with open(os.path.join(self.metrics_dir, '1.json'), 'w') as f:
+            json.dump({
+                'test_total': [[['Basic'], 2], [['Premium'], 1]],
+                'test_seconds': [[[], [[0, 1, 0], 0.5]]],
+                'removed_total': [[[], 1]]
+            }, f)
+
+        text = self.registry.exposition()
+        self.assertEqual(3, get_sample(text, 'test_total{plan="Basic"}'))
+        self.assertEqual(1, get_sample(text, 'test_total{plan="Premium"}'))
+        self.assertEqual(2, get_sample(text, 'test_seconds_count'))
+        self.assertEqual(1, get_sample(text, 'test_seconds_bucket{le="0.1"}'))
+        self.assertNotIn('removed_total', text)
+
+        # own values are written to a file of this process
+        self.assertEqual(
+            sorted(['1.json', f'{os.getpid()}.json']),
+            sorted(os.listdir(self.metrics_dir))
+        )
+        # merging doesn't change own values
+        self.assertEqual(3, get_sample(self.registry.exposition(), 'test_total{plan="Basic"}'))
+
+
+class TestMetricsView(APITestCase):
+    def setUp(self):
+        plan = ThumbPlan.objects.create(
+            name = 'METRICS_PLAN',
+            use_source_img=True,
+            use_expiring_links=True
+        )
+        plan.thumb_rules.set(create_test_rules()[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        self.admin = User.objects.create_user(
+            username='admin_user',
+            email='admin@test.com',
+            is_staff=True
+        )
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def get_metrics(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/thumbs/metrics')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/thumbs/metrics')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_pipeline_metrics(self):
+        samples = [
+            'thumbs_uploads_total{plan="METRICS_PLAN"}',
+            'thumbs_rendered_total{rule="200",format="JPEG"}',
+            'thumbs_stage_seconds_count{stage="decode"}',
+            'thumbs_stage_seconds_count{stage="resize"}',
+            'thumbs_stage_seconds_count{stage="encode"}',
+            'thumbs_scheduler_wait_seconds_count{tier="0"}',
+            'thumbs_scheduler_run_seconds_count{tier="0"}',
+            'thumbs_list_requests_total',
+            'thumbs_listed_images_total',
+            'thumbs_temp_links_issued_total',
+            'thumbs_temp_links_redeemed_total',
+            'thumbs_written_bytes_total{kind="thumb"}',
+        ]
+        text = self.get_metrics()
+        before = {sample: get_sample(text, sample) for sample in samples}
+
+        self.client.force_authenticate(self.user)
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/thumbs/upload_img/', {'file':f}, format='multipart')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        urls = response.data['urls']
+        for img in urls.values():
+            self.image_ids_to_delete.append(img['id'])
+
+        self.client.get('/thumbs/list_img/')
+        response = self.client.get('/thumbs/get_img_temp_link/', {
+            'img': urls['original']['id'],
+            'exp': 300
+        })
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.client.get(response.data)
+
+        text = self.get_metrics()
+        after = {sample: get_sample(text, sample) for sample in samples}
+
+        self.assertEqual({
+            'thumbs_uploads_total{plan="METRICS_PLAN"}': 1,
+            'thumbs_rendered_total{rule="200",format="JPEG"}': 1,
+            'thumbs_stage_seconds_count{stage="decode"}': 1,
+            'thumbs_stage_seconds_count{stage="resize"}': 1,
+            'thumbs_stage_seconds_count{stage="encode"}': 1,
+            'thumbs_scheduler_wait_seconds_count{tier="0"}': 1,
+            'thumbs_scheduler_run_seconds_count{tier="0"}': 1,
+            'thumbs_list_requests_total': 1,
+            'thumbs_listed_images_total': 1,
+            'thumbs_temp_links_issued_total': 1,
+            'thumbs_temp_links_redeemed_total': 1,
+            'thumbs_written_bytes_total{kind="thumb"}': urls[200]['size'],
+        }, {sample: after[sample] - before[sample] for sample in samples})
@@ -1,10 +1,16 @@
+import base64
 import datetime
 import json
+from io import BytesIO
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import signing
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
 from django.utils import timezone
 from PIL import Image
@@ -48,7 +54,7 @@ class TestUserImageModel(TestCase):
         )
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=self.user,
                     file = File(f)
@@ -67,6 +73,105 @@ class TestUserImageModel(TestCase):
                 height = image.size[1]
                 self.assertEqual(height, thumb.thumb_rule.height)
 
+    def test_image_create_exif_rotated(self):
+        plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+
+        plan.thumb_rules.set(self.rules[:2])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        # stored as landscape, displayed as portrait (orientation 6 - rotate 90 CW)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        source_io = BytesIO()
+        Image.new('RGB', (1600, 800)).save(source_io, format='JPEG', exif=exif.tobytes())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = ContentFile(source_io.getvalue(), name='rotated.jpg')
+            )
+        self.add_image_for_delete(img)
+
+        for thumb in img.thumbs.all().select_related('thumb_rule'):
+            image = Image.open(thumb.file.path)
+            self.assertEqual(image.size, (thumb.thumb_rule.height // 2, thumb.thumb_rule.height))
+            self.assertIsNone(image.getexif().get(0x0112))
+
+    def create_animated_gif(self, frame_count, duration):
+        frames = [
+            Image.new('RGB', (400, 200), (idx * 10 % 256, 0, 0))
+            for idx in range(frame_count)
+        ]
+        source_io = BytesIO()
+        frames[0].save(
+            source_io, format='GIF', save_all=True,
+            append_images=frames[1:], duration=duration, loop=0
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = ContentFile(source_io.getvalue(), name='animated.gif')
+            )
+        self.add_image_for_delete(img)
+        return img
+
+    def test_image_create_animated(self):
+        plan = ThumbPlan.objects.create(
+            name = 'ANIMATED_PLAN',
+            use_source_img=True,
+            use_animated_thumbs=True,
+            animation_max_fps=10
+        )
+
+        plan.thumb_rules.set(self.rules[:1])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        # 20 frames at 50 fps, decimated to 10 fps
+        img = self.create_animated_gif(20, 20)
+
+        thumb = img.thumbs.first()
+        image = Image.open(thumb.file.path)
+        self.assertEqual(image.size, (400, 200))
+        self.assertEqual(4, image.n_frames)
+
+        total_duration = 0
+        for idx in range(image.n_frames):
+            image.seek(idx)
+            total_duration += image.info['duration']
+        self.assertEqual(400, total_duration)
+
+    def test_image_create_animated_poster(self):
+        plan = ThumbPlan.objects.create(
+            name = 'POSTER_PLAN',
+            use_source_img=True
+        )
+
+        plan.thumb_rules.set(self.rules[:1])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        img = self.create_animated_gif(5, 100)
+
+        thumb = img.thumbs.first()
+        image = Image.open(thumb.file.path)
+        self.assertEqual(image.size, (400, 200))
+        self.assertFalse(getattr(image, 'is_animated', False))
+
     def test_image_create_source_only(self):
         plan = ThumbPlan.objects.create(
             name = 'MULTI_PLAN',
@@ -79,7 +184,7 @@ class TestUserImageModel(TestCase):
         )
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=self.user,
                     file = File(f)
@@ -91,6 +196,44 @@ class TestUserImageModel(TestCase):
 
             self.assertNotEqual('',img_db_obj.file.name)
 
+    def test_image_create_placeholder(self):
+        plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=False
+        )
+        plan.thumb_rules.set(self.rules[:1])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        for img_file in TEST_IMAGES:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+                img = UserImage.objects.create(
+                    user=self.user,
+                    file = File(f)
+                )
+                self.add_image_for_delete(img)
+
+            img_db_obj = UserImage.objects.get(pk=img.id)
+            prefix = 'data:image/jpeg;base64,'
+            self.assertTrue(img_db_obj.placeholder.startswith(prefix))
+
+            data = base64.b64decode(img_db_obj.placeholder[len(prefix):])
+            placeholder = Image.open(BytesIO(data))
+            self.assertEqual(16, max(placeholder.size))
+
+            # aspect ratio of the thumbnail is kept
+            thumb = Image.open(img_db_obj.thumbs.get().file.path)
+            self.assertEqual(
+                thumb.size[0] >= thumb.size[1],
+                placeholder.size[0] >= placeholder.size[1]
+            )
+
+            # thumbs don't carry their own placeholders
+            self.assertIsNone(img_db_obj.thumbs.get().placeholder)
+
     def test_get_all_urls(self):
         plan = ThumbPlan.objects.create(
             name = 'MULTI_PLAN',
@@ -105,7 +248,7 @@ class TestUserImageModel(TestCase):
         )
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=self.user,
                     file = File(f)
@@ -134,7 +277,7 @@ class TestUserImageModel(TestCase):
         )
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=self.user,
                     file = File(f)
@@ -147,6 +290,93 @@ class TestUserImageModel(TestCase):
             for thumb in img_db_obj.thumbs.all():
                 self.assertIn(thumb.file.name, json.dumps(data))
 
+    def test_manifest(self):
+        plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+
+        plan.thumb_rules.set(self.rules)
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+            self.add_image_for_delete(img)
+
+        img_db_obj = UserImage.objects.get(pk=img.id)
+        manifest = {v['key']: v for v in img_db_obj.manifest}
+
+        self.assertEqual(len(self.rules) + 1, len(manifest))
+        for thumb in img_db_obj.thumbs.all().select_related('thumb_rule'):
+            variant = manifest[thumb.thumb_rule.height]
+            self.assertEqual(thumb.pk, variant['id'])
+            self.assertEqual(thumb.file.name, variant['name'])
+            self.assertEqual(thumb.file.size, variant['size'])
+            self.assertEqual('JPEG', variant['format'])
+        self.assertEqual(img_db_obj.file.name, manifest['original']['name'])
+
+        with self.assertNumQueries(0):
+            data = img_db_obj.get_all_urls()
+        self.assertEqual(set(manifest.keys()), set(data.keys()))
+
+        # removing a thumb updates the manifest
+        thumb = img_db_obj.thumbs.first()
+        self.image_ids_to_delete.remove(thumb.pk)
+        thumb.file.delete(save=False)
+        thumb.delete()
+
+        img_db_obj.refresh_from_db()
+        self.assertEqual(len(self.rules), len(img_db_obj.manifest))
+        self.assertNotIn(thumb.pk, [v['id'] for v in img_db_obj.manifest])
+
+        # also on queryset deletes
+        thumb = img_db_obj.thumbs.first()
+        self.image_ids_to_delete.remove(thumb.pk)
+        thumb.file.delete(save=False)
+        UserImage.objects.filter(pk=thumb.pk).delete()
+
+        img_db_obj.refresh_from_db()
+        self.assertEqual(len(self.rules) - 1, len(img_db_obj.manifest))
+        self.assertNotIn(thumb.pk, [v['id'] for v in img_db_obj.manifest])
+
+    def test_manifest_backfill(self):
+        plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+        plan.thumb_rules.set(self.rules)
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            img = UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+            self.add_image_for_delete(img)
+        manifest = UserImage.objects.get(pk=img.pk).manifest
+
+        # images stored before manifests were introduced
+        UserImage.objects.filter(pk=img.pk).update(manifest=None)
+        img_db_obj = UserImage.objects.get(pk=img.pk)
+
+        # urls are read without storing the manifest
+        data = img_db_obj.get_all_urls()
+        self.assertEqual({v['key'] for v in manifest}, set(data.keys()))
+        self.assertIsNone(UserImage.objects.get(pk=img.pk).manifest)
+
+        call_command('backfill_manifests')
+        self.assertEqual(manifest, UserImage.objects.get(pk=img.pk).manifest)
+
     def test_get_all_urls_no_thumbs(self):
         plan = ThumbPlan.objects.create(
             name = 'NO_THUMBS_PLAN',
@@ -159,7 +389,7 @@ class TestUserImageModel(TestCase):
         )
 
         for img_file in TEST_IMAGES:
-            with open(img_file, 'rb') as f:
+            with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=self.user,
                     file = File(f)
@@ -172,6 +402,38 @@ class TestUserImageModel(TestCase):
             self.assertIn(img_db_obj.file.name, json.dumps(data))
 
 
+class TestUserImageIndexes(TestCase):
+    '''
+    Checks the query planner picks the composite indexes for the hot queries
+    '''
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+
+        if connection.vendor == 'postgresql':
+            # tiny test tables would be seq scanned otherwise
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'EXPLAIN checks not implemented for {connection.vendor}')
+        self.assertIn(index_name, queryset.explain())
+
+    def test_root_images_list_index(self):
+        queryset = UserImage.objects.filter(
+            Q(user=self.user) &
+            Q(parent__isnull=True)
+        ).order_by('pk')
+        self.assertUsesIndex(queryset, 'userimage_user_root_idx')
+
+    def test_thumbs_lookup_index(self):
+        queryset = UserImage.objects.filter(parent=1).select_related('thumb_rule')
+        self.assertUsesIndex(queryset, 'userimage_parent_rule_idx')
+
+
 class TestImageTempLinkModel(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -191,7 +453,7 @@ class TestImageTempLinkModel(TestCase):
 
         self.image_ids_to_delete = []
 
-        with open(TEST_IMAGES[0], 'rb') as f:
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
             self.img = UserImage.objects.create(
                 user=self.user,
                 file = File(f)
@@ -0,0 +1,163 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase
+from PIL import GifImagePlugin, Image, ImageChops
+
+from thumbs.processing import (SOURCE_FRAMES_PER_FRAME, AnimationLimits,
+                               decode_source, fit_size, sample_frames)
+
+# decodes a 100 MB grayscale image in a fresh process and prints the peak RSS growth (in MB)
+PEAK_RSS_SCRIPT = '''
+import resource, sys
+from thumbs.processing import decode_source
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+path, width, height = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+with open(path, 'wb') as f:
+    f.write(b'P5 %d %d 255\\n' % (width, height))
+    row = bytes(range(256)) * (width // 256) + bytes(width % 256)
+    for _ in range(height):
+        f.write(row)
+
+baseline = peak_rss_mb()
+source = decode_source(path, 400, low_memory_pixels=1000000)
+assert source.size[1] >= 400
+print(peak_rss_mb() - baseline)
+'''
+
+
+class TestFitSize(SimpleTestCase):
+    def test_fit_size(self):
+        self.assertEqual((150, 100), fit_size((300, 200), (None, 100)))
+        self.assertEqual((100, 66), fit_size((300, 200), (100, None)))
+        # the tighter bound of a box wins
+        self.assertEqual((90, 60), fit_size((300, 200), (90, 100)))
+        self.assertEqual((120, 80), fit_size((300, 200), (200, 80)))
+
+    def test_decode_for_width_rule(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'wide.png')
+            Image.new('RGB', (1200, 100)).save(path)
+
+            # the height needed by a 300px wide thumb is 25px, so the source is reduced
+            source = decode_source(path, [(300, None)])
+            self.assertEqual((1200, 100), source.source_size)
+            self.assertEqual((600, 50), source.size)
+
+
+class TestSampleFrames(SimpleTestCase):
+    def test_frame_rate_decimation(self):
+        limits = AnimationLimits(max_frames=100, max_fps=10, max_pixels=10**9)
+
+        # 50 fps source
+        selected = sample_frames([20] * 10, limits, 1)
+        self.assertEqual([(0, 100), (5, 100)], selected)
+
+    def test_frame_cap(self):
+        limits = AnimationLimits(max_frames=3, max_fps=0, max_pixels=10**9)
+
+        selected = sample_frames([100] * 9, limits, 1)
+        self.assertEqual([(0, 300), (3, 300), (6, 300)], selected)
+
+    def test_pixel_budget(self):
+        limits = AnimationLimits(max_frames=100, max_fps=0, max_pixels=1000)
+
+        selected = sample_frames([100] * 10, limits, 250)
+        self.assertEqual(4, len(selected))
+        self.assertEqual(1000, sum(d for _, d in selected))
+
+        # not enough budget for an animation
+        self.assertEqual([], sample_frames([100] * 10, limits, 600))
+
+
+class TestDecodeFrames(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'long.gif')
+        frames = [Image.new('L', (20, 20), color) for color in range(0, 250, 2)]
+        frames[0].save(self.path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_source_frames_bounded(self):
+        limits = AnimationLimits(max_frames=3, max_fps=0, max_pixels=10**9)
+        seek = GifImagePlugin.GifImageFile.seek
+        seeks = []
+
+        def record_seek(image, frame):
+            seeks.append(frame)
+            return seek(image, frame)
+
+        # n_frames of a GIF seeks internally, so it isn't read either
+        with mock.patch('PIL.GifImagePlugin.GifImageFile.seek', autospec=True, side_effect=record_seek), \
+                mock.patch('PIL.GifImagePlugin.GifImageFile.n_frames', new_callable=mock.PropertyMock) as n_frames:
+            source = decode_source(self.path, 20, limits=limits)
+
+        n_frames.assert_not_called()
+        self.assertLess(max(seeks), 3 * SOURCE_FRAMES_PER_FRAME)
+        # the animation is truncated to the source frames read
+        self.assertEqual([500] * 3, source.durations)
+
+    def test_poster_frame_of_short_animation(self):
+        # no budget for an animation, the poster frame past the end falls back to the last frame
+        limits = AnimationLimits(max_frames=100, max_fps=0, max_pixels=100)
+
+        source = decode_source(self.path, 20, limits=limits, poster_frame=1000)
+        self.assertIsNone(source.frames)
+        self.assertEqual((248, 255), source.image.convert('LA').getpixel((10, 10)))
+
+
+class TestLowMemoryDecode(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_band_decode_matches_full_decode(self):
+        image = Image.radial_gradient('L').resize((1500, 1000)).convert('RGB')
+
+        for format in ['PPM', 'BMP', 'TIFF']:
+            path = os.path.join(self.temp_dir.name, f'image.{format.lower()}')
+            image.save(path, format=format)
+
+            banded = decode_source(path, 100, low_memory_pixels=1000)
+            full = decode_source(path, 100)
+
+            self.assertEqual(full.size, banded.size)
+            diff = ImageChops.difference(full.image, banded.image)
+            self.assertEqual([(0, 0)] * 3, list(diff.getextrema()))
+
+    def test_full_decode_fallback(self):
+        # PNGs can't be decoded in bands, they are decoded in full
+        path = os.path.join(self.temp_dir.name, 'image.png')
+        Image.radial_gradient('L').resize((100, 100)).save(path, format='PNG')
+
+        source = decode_source(path, 50, low_memory_pixels=1000)
+        full = decode_source(path, 50)
+
+        self.assertEqual(full.size, source.size)
+        self.assertEqual(list(full.image.getdata()), list(source.image.getdata()))
+
+    @unittest.skipUnless(sys.platform.startswith(('linux', 'darwin')), 'needs resource.getrusage')
+    def test_peak_rss(self):
+        path = os.path.join(self.temp_dir.name, 'large.pgm')
+        width, height = 10000, 10000
+
+        result = subprocess.run(
+            [sys.executable, '-c', PEAK_RSS_SCRIPT, path, str(width), str(height)],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        )
+
+        # a full decode would need 100 MB
+        self.assertLess(float(result.stdout), 30)
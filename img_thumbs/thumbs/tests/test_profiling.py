@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.models import ThumbPlan, ThumbUser
+from thumbs.profiling import get_sample_names, profiler
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestSamplingProfiler(APITestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            THUMBS_PROFILE_DIR=self.profile_dir,
+            THUMBS_PROFILE_MAX_SAMPLES=2,
+            THUMBS_PROFILE_SAMPLE_RATE=0
+        )
+        self.override.enable()
+
+        plan = ThumbPlan.objects.create(
+            name = 'SINGLE_PLAN',
+            use_source_img=True
+        )
+        plan.thumb_rules.set(create_test_rules()[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        self.client.force_authenticate(self.user)
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+        self.override.disable()
+        shutil.rmtree(self.profile_dir)
+
+    def upload(self, **headers):
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart', **headers
+            )
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+    def test_sample_rate(self):
+        with override_settings(THUMBS_PROFILE_SAMPLE_RATE=2):
+            # the counter is shared by the process
+            while next(profiler.counter) % 2:
+                pass
+            for _ in range(3):
+                self.upload()
+
+        self.assertEqual(1, len(get_sample_names(self.profile_dir)))
+
+    def test_rotation(self):
+        with override_settings(THUMBS_PROFILE_SAMPLE_RATE=1):
+            for _ in range(3):
+                self.upload()
+
+        # 2 newest samples, cpu and memory profile each
+        self.assertEqual(2, len(get_sample_names(self.profile_dir)))
+        self.assertEqual(4, len(os.listdir(self.profile_dir)))
+
+    def test_profile_header(self):
+        # ignored for regular users
+        self.upload(HTTP_X_THUMBS_PROFILE='1')
+        self.assertEqual(0, len(get_sample_names(self.profile_dir)))
+
+        self.user.is_staff = True
+        self.user.save()
+        self.upload(HTTP_X_THUMBS_PROFILE='1')
+        self.assertEqual(1, len(get_sample_names(self.profile_dir)))
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command('profile_report', '--limit', '50')
+        report = out.getvalue()
+
+        self.assertIn('1 samples', report)
+        self.assertIn('decode_source', report)
+        self.assertIn('save_thumb', report)
+        self.assertIn('top allocation sites', report)
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from thumbs.metrics import registry
+from thumbs.models import ThumbRule
+from thumbs.scheduler import (SchedulerBusy, ThumbnailScheduler, order_rules,
+                              record_rule_request)
+
+
+def get_count(name, tier):
+    '''
+    Observations of a scheduler metric for a tier, from the metrics registry
+    '''
+    value = registry.collect().get(name, {}).get((str(tier),))
+    if value is None:
+        return 0
+    # histograms are stored as [bucket counts, sum]
+    return sum(value[0]) if isinstance(value, list) else value
+
+
+class TestThumbnailScheduler(SimpleTestCase):
+    def test_order_by_tier_and_age(self):
+        scheduler = ThumbnailScheduler(slots=1)
+        order = []
+        waits_before = [get_count('thumbs_scheduler_wait_seconds', tier) for tier in range(2)]
+
+        def run_job(name, tier):
+            with scheduler.job(tier):
+                order.append(name)
+
+        def wait_for_waiting(count):
+            while len(scheduler.waiting) < count:
+                time.sleep(0.001)
+
+        with scheduler.job(0):
+            threads = []
+            for idx, (name, tier) in enumerate([('old_basic', 0), ('enterprise', 1), ('new_basic', 0)]):
+                thread = threading.Thread(target=run_job, args=(name, tier))
+                thread.start()
+                threads.append(thread)
+                wait_for_waiting(idx + 1)
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['enterprise', 'old_basic', 'new_basic'], order)
+
+        waits = [get_count('thumbs_scheduler_wait_seconds', tier) for tier in range(2)]
+        self.assertEqual([3, 1], [after - before for after, before in zip(waits, waits_before)])
+        self.assertEqual(0, scheduler.running)
+
+    def test_timeout(self):
+        scheduler = ThumbnailScheduler(slots=1, timeout=0.1)
+        timeouts_before = get_count('thumbs_scheduler_timeouts_total', 1)
+
+        with scheduler.job(0):
+            with self.assertRaises(SchedulerBusy):
+                with scheduler.job(1):
+                    pass
+            self.assertEqual([], scheduler.waiting)
+
+        # the slot is free again
+        with scheduler.job(0):
+            self.assertEqual(1, scheduler.running)
+        self.assertEqual(1, get_count('thumbs_scheduler_timeouts_total', 1) - timeouts_before)
+
+    def test_unlimited_slots(self):
+        scheduler = ThumbnailScheduler(slots=0)
+
+        with scheduler.job(0):
+            with scheduler.job(0):
+                self.assertEqual(2, scheduler.running)
+
+
+class TestOrderRules(SimpleTestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_order_rules(self):
+        rules = [ThumbRule(pk=idx, height=idx * 200) for idx in range(3, 0, -1)]
+
+        self.assertEqual([200, 400, 600], [r.height for r in order_rules(rules)])
+
+        # a much more requested rule goes first
+        for _ in range(10):
+            record_rule_request(2)
+        self.assertEqual([400, 200, 600], [r.height for r in order_rules(rules)])
@@ -0,0 +1,95 @@
+import io
+from contextlib import redirect_stdout
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from thumbs.models import ImageTempLink, ThumbPlan, ThumbUser, UserImage
+from thumbs.seeding import get_load_users
+
+from .utils import create_test_rules
+
+
+def seed_load(**options):
+    with redirect_stdout(io.StringIO()):
+        call_command('seed_load', **options)
+
+def get_seeded_data():
+    '''
+    Seeded data independent of pks
+    '''
+    return [
+        (
+            user.username,
+            user.thumb_user.plan.name,
+            [(img.file.name.split('/')[-1], img.width, img.height) for img in user.images.order_by('pk')]
+        )
+        for user in get_load_users().select_related('thumb_user__plan').order_by('username')
+    ]
+
+
+class TestSeedLoad(TestCase):
+    def setUp(self):
+        rules = create_test_rules()
+        basic = ThumbPlan.objects.create(name='Basic')
+        basic.thumb_rules.set(rules[:1])
+        enterprise = ThumbPlan.objects.create(
+            name='Enterprise',
+            use_source_img=True,
+            use_expiring_links=True
+        )
+        enterprise.thumb_rules.set(rules[:2])
+
+    def test_seed_load(self):
+        seed_load(users=20, images=3, links=2, seed=1, batch_size=7)
+
+        self.assertEqual(20, get_load_users().count())
+        self.assertEqual(20, ThumbUser.objects.count())
+
+        roots = UserImage.objects.filter(parent__isnull=True).select_related('user__thumb_user__plan')
+        self.assertTrue(roots)
+        for root in roots:
+            plan = root.user.thumb_user.plan
+            urls = root.get_all_urls()
+            rule_count = plan.thumb_rules.count()
+
+            self.assertEqual(rule_count, root.thumbs.count())
+            self.assertEqual(rule_count + int(plan.use_source_img), len(urls))
+            self.assertEqual(200, urls[200]['height'])
+            if plan.use_expiring_links:
+                self.assertEqual(2, ImageTempLink.objects.filter(image=root).count())
+            else:
+                self.assertFalse(ImageTempLink.objects.filter(image=root).exists())
+
+    def test_fixed_seed(self):
+        seed_load(users=10, images=3, seed=1)
+        data = get_seeded_data()
+
+        seed_load(users=10, images=3, seed=2, clear=True)
+        self.assertNotEqual(data, get_seeded_data())
+
+        seed_load(users=10, images=3, seed=1, clear=True)
+        self.assertEqual(data, get_seeded_data())
+
+    def test_real_users_kept(self):
+        # users named like seeded ones aren't treated as seeded
+        real = User.objects.create_user(username='load-admin', email='admin@example.com')
+        seed_load(users=2)
+        self.assertEqual(2, get_load_users().count())
+
+        seed_load(users=2, clear=True)
+        self.assertTrue(User.objects.filter(pk=real.pk).exists())
+
+    def test_existing_users(self):
+        seed_load(users=2)
+
+        with self.assertRaises(CommandError):
+            seed_load(users=2)
+
+    def test_no_plans(self):
+        ThumbPlan.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            seed_load(users=2)
@@ -0,0 +1,208 @@
+import os
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.models import SpriteSheet, ThumbPlan, ThumbUser, UserImage
+from thumbs.sprites import open_thumb
+from thumbs.staging import get_staged_name, move_file
+from thumbs.storage_urls import get_file_url
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestSpriteSheetView(APITestCase):
+    def setUp(self):
+        self.rules = create_test_rules()
+        plan = ThumbPlan.objects.create(name='BASIC_PLAN')
+        plan.thumb_rules.set(self.rules[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        self.client.force_authenticate(self.user)
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        for sheet in SpriteSheet.objects.all():
+            if sheet.file.name:
+                sheet.file.storage.delete(sheet.file.name)
+        delete_test_files(self.image_ids_to_delete)
+
+    def upload_image(self, path=TEST_IMAGES[0]):
+        with open(path, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/thumbs/upload_img/', {'file':f}, format='multipart')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.image_ids_to_delete.append(response.data['id'])
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+        return response.data['id']
+
+    def get_sheet(self, page=0, rule=200):
+        # refreshed sheets are promoted on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/thumbs/sprites/', {'rule': rule, 'page': page})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def assert_sheet_matches_thumbs(self, data):
+        sheet = SpriteSheet.objects.get(user=self.user, page=data['page'])
+        with Image.open(sheet.file.path) as image:
+            self.assertEqual((data['width'], data['height']), image.size)
+
+        for image_id, offset in data['images'].items():
+            thumb = UserImage.objects.get(parent_id=image_id, thumb_rule=self.rules[0])
+            self.assertEqual((thumb.width, thumb.height), (offset['width'], offset['height']))
+            self.assertLessEqual(offset['x'] + offset['width'], data['width'])
+            self.assertLessEqual(offset['y'] + offset['height'], data['height'])
+
+    def test_sprite_sheet(self):
+        first = self.upload_image(TEST_IMAGES[0])
+        second = self.upload_image(TEST_IMAGES[1])
+
+        data = self.get_sheet()
+        self.assertEqual(200, data['rule'])
+        self.assertEqual(1, data['pages'])
+        self.assertEqual([first, second], list(data['images'].keys()))
+        self.assertEqual((0, 0), (data['images'][first]['x'], data['images'][first]['y']))
+        self.assert_sheet_matches_thumbs(data)
+
+        # up to date sheets aren't recomposed - the rule, the thumbnail count,
+        # the thumbnails of the page and the sheet are read
+        with mock.patch('thumbs.sprites.open_thumb') as open_thumb, self.assertNumQueries(4):
+            self.assertEqual(data['url'], self.get_sheet()['url'])
+        open_thumb.assert_not_called()
+
+    def test_incremental_update(self):
+        first = self.upload_image()
+        data = self.get_sheet()
+
+        second = self.upload_image()
+        updated = self.get_sheet()
+
+        self.assertNotEqual(data['url'], updated['url'])
+        self.assertEqual(data['images'][first], updated['images'][first])
+        self.assertIn(second, updated['images'])
+        self.assert_sheet_matches_thumbs(updated)
+
+    @override_settings(THUMBS_SPRITE_PAGE_SIZE=2)
+    def test_pages(self):
+        for _ in range(2):
+            self.upload_image()
+        first_page = self.get_sheet()
+
+        third = self.upload_image()
+        second_page = self.get_sheet(page=1)
+
+        # the full page is left as is
+        self.assertEqual({**first_page, 'pages': 2}, self.get_sheet())
+        self.assertEqual(2, second_page['pages'])
+        self.assertEqual([third], list(second_page['images'].keys()))
+        self.assert_sheet_matches_thumbs(second_page)
+
+        response = self.client.get('/thumbs/sprites/', {'rule': 200, 'page': 2})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_deleted_image(self):
+        first = self.upload_image()
+        second = self.upload_image()
+        data = self.get_sheet()
+        old_name = SpriteSheet.objects.get(user=self.user).file.name
+
+        root = UserImage.objects.get(pk=first)
+        ids = [first] + list(root.thumbs.values_list('pk', flat=True))
+        delete_test_files(ids)
+        self.image_ids_to_delete = [pk for pk in self.image_ids_to_delete if pk not in ids]
+        root.delete()
+
+        rebuilt = self.get_sheet()
+        self.assertNotEqual(data['url'], rebuilt['url'])
+        self.assertEqual([second], list(rebuilt['images'].keys()))
+        self.assertEqual((0, 0), (rebuilt['images'][second]['x'], rebuilt['images'][second]['y']))
+        self.assertFalse(SpriteSheet.file.field.storage.exists(old_name))
+
+    @override_settings(THUMBS_SPRITE_PAGE_SIZE=2)
+    def test_only_requested_page_rebuilt(self):
+        first, second, third, fourth = [self.upload_image() for _ in range(4)]
+        first_page = self.get_sheet()
+        self.get_sheet(page=1)
+
+        root = UserImage.objects.get(pk=first)
+        ids = [first] + list(root.thumbs.values_list('pk', flat=True))
+        delete_test_files(ids)
+        self.image_ids_to_delete = [pk for pk in self.image_ids_to_delete if pk not in ids]
+        root.delete()
+
+        with mock.patch('thumbs.sprites.open_thumb', wraps=open_thumb) as opened:
+            second_page = self.get_sheet(page=1)
+        self.assertEqual([fourth], list(second_page['images'].keys()))
+        self.assertEqual(1, opened.call_count)
+        self.assertEqual(2, second_page['pages'])
+
+        # the stale first page is rebuilt once it is requested
+        self.assertEqual(first_page['url'], get_file_url(
+            SpriteSheet.objects.get(user=self.user, page=0).file.name, SpriteSheet.file.field.storage
+        ))
+        rebuilt = self.get_sheet()
+        self.assertEqual([second, third], list(rebuilt['images'].keys()))
+        self.assert_sheet_matches_thumbs(rebuilt)
+
+    def make_stale(self, name):
+        mtime = time.time() - 2 * 60 * 60
+        os.utime(SpriteSheet.file.field.storage.path(name), (mtime, mtime))
+
+    def test_sweep_staged_sheet(self):
+        # the worker died after the commit, before the sheet was promoted
+        self.upload_image()
+        self.get_sheet()
+        storage = SpriteSheet.file.field.storage
+        name = SpriteSheet.objects.get(user=self.user).file.name
+        move_file(storage, name, get_staged_name(name))
+        self.make_stale(get_staged_name(name))
+
+        call_command('sweep_staged_files')
+
+        self.assertTrue(storage.exists(name))
+        self.assertFalse(storage.exists(get_staged_name(name)))
+
+    def test_reclaim_orphaned_sheet(self):
+        self.upload_image()
+        self.get_sheet()
+        storage = SpriteSheet.file.field.storage
+        sheet = SpriteSheet.objects.get(user=self.user)
+        self.make_stale(sheet.file.name)
+
+        call_command('reclaim_storage', '--prefix', 'sprites')
+        self.assertTrue(storage.exists(sheet.file.name))
+
+        # sheets deleted through CASCADE leave their files behind
+        SpriteSheet.objects.filter(pk=sheet.pk).delete()
+        call_command('reclaim_storage', '--prefix', 'sprites')
+        self.assertFalse(storage.exists(sheet.file.name))
+
+    def test_no_images(self):
+        data = self.get_sheet()
+        self.assertEqual(0, data['pages'])
+        self.assertIsNone(data['url'])
+
+        response = self.client.get('/thumbs/sprites/', {'rule': 200, 'page': 1})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_invalid_params(self):
+        response = self.client.get('/thumbs/sprites/', {'rule': '123w'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+        response = self.client.get('/thumbs/sprites/', {'rule': 200, 'page': 'x'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
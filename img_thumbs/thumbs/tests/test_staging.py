@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from thumbs.models import ThumbPlan, ThumbUser, UserImage
+from thumbs.staging import get_staged_name
+
+from .utils import TEST_IMAGES, create_test_rules
+
+
+class TestUploadStaging(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+        self.plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+        self.plan.thumb_rules.set(create_test_rules()[:2])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = self.plan
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_image(self):
+        with open(TEST_IMAGES[0], 'rb') as f:
+            return UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+
+    def get_stored_files(self):
+        return [
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, files in os.walk(self.media_root)
+            for name in files
+        ]
+
+    def test_files_promoted_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            img = self.create_image()
+
+        names = [img.file.name] + [thumb.file.name for thumb in img.thumbs.all()]
+        self.assertEqual(3, len(names))
+        self.assertEqual(sorted(names), sorted(v['name'] for v in img.manifest))
+
+        # rows point to the final names, files are staged until the commit
+        for name in names:
+            self.assertFalse(default_storage.exists(name))
+            self.assertTrue(default_storage.exists(get_staged_name(name)))
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(sorted(names), sorted(self.get_stored_files()))
+
+    def test_source_discarded_on_commit(self):
+        self.plan.use_source_img = False
+        self.plan.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            img = self.create_image()
+
+        img.refresh_from_db()
+        self.assertEqual('', img.file.name)
+
+        names = [thumb.file.name for thumb in img.thumbs.all()]
+        self.assertEqual(sorted(names), sorted(self.get_stored_files()))
+
+    def test_rendered_before_rows_written(self):
+        # no transaction is held open while thumbs are rendered
+        create_thumb_file = UserImage.create_thumb_file
+        rows = []
+
+        def counting_create_thumb_file(thumb, *args, **kwargs):
+            # also called on save, once the file is rendered
+            if not thumb.file.name:
+                rows.append(UserImage.objects.count())
+            return create_thumb_file(thumb, *args, **kwargs)
+
+        with mock.patch.object(UserImage, 'create_thumb_file', counting_create_thumb_file):
+            with self.captureOnCommitCallbacks(execute=True):
+                img = self.create_image()
+
+        self.assertEqual([0, 0], rows)
+        self.assertEqual(2, img.thumbs.count())
+
+    def test_failed_upload_rolled_back(self):
+        create_thumb_file = UserImage.create_thumb_file
+        calls = []
+
+        def failing_create_thumb_file(thumb, *args, **kwargs):
+            calls.append(thumb)
+            if len(calls) > 1:
+                raise OSError
+            return create_thumb_file(thumb, *args, **kwargs)
+
+        with mock.patch.object(UserImage, 'create_thumb_file', failing_create_thumb_file):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(OSError):
+                    self.create_image()
+
+        # neither rows nor files are left
+        self.assertFalse(UserImage.objects.exists())
+        self.assertEqual([], self.get_stored_files())
+
+    def create_staged_file(self, name, age=2 * 60 * 60):
+        staged_name = default_storage.save(get_staged_name(name), ContentFile(b'0' * 100))
+        mtime = time.time() - age
+        os.utime(default_storage.path(staged_name), (mtime, mtime))
+        return staged_name
+
+    def test_sweep_staged_files(self):
+        # a worker died after the commit, before the files were promoted
+        # (row of a user without a plan, so the upload pipeline doesn't run)
+        user = User.objects.create_user(username='no_plan_user')
+        committed = UserImage.objects.create(user=user, file=f'photos/{user.pk}/committed.jpg')
+        self.create_staged_file(committed.file.name)
+        # a worker died before the commit
+        stale = self.create_staged_file(f'photos/{user.pk}/stale.jpg')
+        # an upload in progress
+        recent = self.create_staged_file(f'photos/{user.pk}/recent.jpg', age=0)
+
+        call_command('sweep_staged_files')
+
+        self.assertTrue(default_storage.exists(committed.file.name))
+        self.assertFalse(default_storage.exists(stale))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertEqual(
+            sorted([committed.file.name, recent]),
+            sorted(self.get_stored_files())
+        )
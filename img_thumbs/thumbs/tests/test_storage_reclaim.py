@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from thumbs.models import ThumbPlan, ThumbUser, UserImage
+from thumbs.storage_reclaim import (UnsortedNamesError, find_orphans,
+                                    walk_storage)
+
+from .utils import TEST_IMAGES, create_test_rules
+
+
+class TestFindOrphans(SimpleTestCase):
+    def test_sorted_merge(self):
+        storage_names = ['a/1.jpg', 'a/2.jpg', 'b/1.jpg', 'c/1.jpg']
+        db_names = ['a/0.jpg', 'a/2.jpg', 'c/1.jpg', 'd/1.jpg']
+
+        self.assertEqual(['a/1.jpg', 'b/1.jpg'], list(find_orphans(storage_names, db_names)))
+
+    def test_unsorted_names(self):
+        with self.assertRaises(UnsortedNamesError):
+            list(find_orphans(['a', 'c', 'b'], ['a', 'b']))
+
+
+class TestReclaimStorage(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+        plan = ThumbPlan.objects.create(
+            name = 'MULTI_PLAN',
+            use_source_img=True
+        )
+        plan.thumb_rules.set(create_test_rules()[:2])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_image(self):
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            return UserImage.objects.create(
+                user=self.user,
+                file = File(f)
+            )
+
+    def create_file(self, name, age=2 * 60 * 60):
+        name = default_storage.save(name, ContentFile(b'0' * 100))
+        mtime = time.time() - age
+        os.utime(default_storage.path(name), (mtime, mtime))
+        return name
+
+    def reclaim(self, *args):
+        call_command('reclaim_storage', *args)
+
+    def test_walk_storage_sorted(self):
+        names = [
+            self.create_file(name)
+            for name in ['photos/1/b.jpg', 'photos/10/a.jpg', 'photos/1-a.jpg', 'photos/1/a.jpg']
+        ]
+        walked = list(walk_storage(default_storage, 'photos'))
+
+        self.assertEqual(sorted(names), walked)
+
+    def test_reclaim_orphans(self):
+        kept_image = self.create_image()
+        deleted_image = self.create_image()
+        deleted_names = [thumb.file.name for thumb in deleted_image.thumbs.all()]
+        # thumb files are left behind by the CASCADE
+        deleted_image.delete()
+
+        orphan = self.create_file(f'photos/{self.user.pk}/orphan.jpg')
+        recent = self.create_file(f'photos/{self.user.pk}/recent.jpg', age=0)
+        for name in deleted_names:
+            os.utime(default_storage.path(name), (0, 0))
+
+        self.reclaim('--dry-run')
+        self.assertTrue(default_storage.exists(orphan))
+
+        # names of images and of sprite sheets, and a batch of image orphans
+        with self.assertNumQueries(3):
+            self.reclaim()
+
+        self.assertFalse(default_storage.exists(orphan))
+        for name in deleted_names:
+            self.assertFalse(default_storage.exists(name))
+
+        # files of existing rows and recently written files are kept
+        self.assertTrue(default_storage.exists(recent))
+        self.assertTrue(default_storage.exists(kept_image.file.name))
+        for thumb in kept_image.thumbs.all():
+            self.assertTrue(default_storage.exists(thumb.file.name))
@@ -0,0 +1,96 @@
+import datetime
+from unittest import mock
+
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, override_settings
+
+from thumbs.storage_urls import CachedUrlProvider, get_signed_url_expiry
+
+
+class CountingStorage(FileSystemStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_calls = 0
+
+    def url(self, name):
+        self.url_calls += 1
+        return super().url(name)
+
+
+class SignedStorage(CountingStorage):
+    querystring_auth = True
+    querystring_expire = 600
+
+
+class TestCachedUrlProvider(SimpleTestCase):
+    def setUp(self):
+        self.provider = CachedUrlProvider(ttl=3600, max_size=2, signed_margin=300)
+
+    def test_memoizes_urls(self):
+        storage = CountingStorage(base_url='/media/')
+
+        for _ in range(3):
+            url = self.provider.url('photos/1/a.jpg', storage)
+
+        self.assertEqual('/media/photos/1/a.jpg', url)
+        self.assertEqual(1, storage.url_calls)
+
+    def test_storage_key(self):
+        # storages are compared by what they store, not by identity
+        self.provider.url('a.jpg', CountingStorage(location='/tmp/a', base_url='/media/'))
+        same = CountingStorage(location='/tmp/a', base_url='/media/')
+        other = CountingStorage(location='/tmp/b', base_url='/other/')
+
+        self.assertEqual('/media/a.jpg', self.provider.url('a.jpg', same))
+        self.assertEqual('/other/a.jpg', self.provider.url('a.jpg', other))
+        self.assertEqual((0, 1), (same.url_calls, other.url_calls))
+
+    @override_settings(THUMBS_URL_CACHE_TTL=1000, THUMBS_URL_CACHE_SIGNED_MARGIN=100)
+    def test_settings_read_on_access(self):
+        provider = CachedUrlProvider()
+        self.assertEqual(1000, provider.get_ttl(CountingStorage()))
+        self.assertEqual(500, provider.get_ttl(SignedStorage()))
+
+        with override_settings(THUMBS_URL_CACHE_TTL=20):
+            self.assertEqual(20, provider.get_ttl(CountingStorage()))
+
+    def test_evicts_least_recently_used(self):
+        storage = CountingStorage(base_url='/media/')
+
+        for name in ['a.jpg', 'b.jpg', 'a.jpg', 'c.jpg', 'a.jpg', 'b.jpg']:
+            self.provider.url(name, storage)
+
+        # b.jpg evicted by c.jpg, a.jpg kept as recently used
+        self.assertEqual(4, storage.url_calls)
+
+    def test_ttl_expiry(self):
+        storage = CountingStorage(base_url='/media/')
+
+        with mock.patch('thumbs.storage_urls.time.monotonic', return_value=1000):
+            self.provider.url('a.jpg', storage)
+        with mock.patch('thumbs.storage_urls.time.monotonic', return_value=1000 + 3599):
+            self.provider.url('a.jpg', storage)
+        self.assertEqual(1, storage.url_calls)
+
+        with mock.patch('thumbs.storage_urls.time.monotonic', return_value=1000 + 3601):
+            self.provider.url('a.jpg', storage)
+        self.assertEqual(2, storage.url_calls)
+
+    def test_signed_url_ttl(self):
+        storage = SignedStorage(base_url='/media/')
+        self.assertEqual(300, self.provider.get_ttl(storage))
+
+        with mock.patch('thumbs.storage_urls.time.monotonic', return_value=1000):
+            self.provider.url('a.jpg', storage)
+        with mock.patch('thumbs.storage_urls.time.monotonic', return_value=1000 + 301):
+            self.provider.url('a.jpg', storage)
+        self.assertEqual(2, storage.url_calls)
+
+    def test_signed_url_expiry(self):
+        self.assertIsNone(get_signed_url_expiry(FileSystemStorage()))
+        self.assertEqual(600, get_signed_url_expiry(SignedStorage()))
+
+        storage = FileSystemStorage()
+        storage.querystring_auth = True
+        storage.expiration = datetime.timedelta(minutes=2)
+        self.assertEqual(120, get_signed_url_expiry(storage))
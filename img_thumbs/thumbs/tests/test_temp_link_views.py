@@ -3,6 +3,7 @@ import datetime
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files import File
+from django.db import connection
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -47,7 +48,7 @@ class TestGetImageTempLinkView(APITestCase):
         self.image_ids_to_delete = []
 
         for user in [self.link_user, self.nolink_user]:
-            with open(TEST_IMAGES[0], 'rb') as f:
+            with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
                 img = UserImage.objects.create(
                     user=user,
                     file = File(f)
@@ -146,7 +147,7 @@ class TestParseImageTempLinkView(APITestCase):
 
         self.image_ids_to_delete = []
 
-        with open(TEST_IMAGES[0], 'rb') as f:
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
             img = UserImage.objects.create(
                 user=self.user,
                 file = File(f)
@@ -209,4 +210,107 @@ class TestParseImageTempLinkView(APITestCase):
             temp_link = temp_link[:-1]
             response = self.client.get(temp_link)
             self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
-            
\ No newline at end of file
+            
+
+class TestGetImageTempLinksBatchView(APITestCase):
+    def setUp(self):
+        allow_links_plan = ThumbPlan.objects.create(
+            name = 'Links_PLAN',
+            use_expiring_links=True,
+            use_source_img=True
+        )
+
+        disallow_links_plan = ThumbPlan.objects.create(
+            name = 'No Links_PLAN',
+            use_expiring_links=False,
+            use_source_img=True
+        )
+
+        self.link_user = User.objects.create_user(
+            username=f'link_user',
+            email=f'link_@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.link_user,
+            plan = allow_links_plan
+        )
+
+        self.nolink_user = User.objects.create_user(
+            username=f'no_link_user',
+            email=f'no_link_@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.nolink_user,
+            plan = disallow_links_plan
+        )
+
+        self.image_ids_to_delete = []
+        self.images = {}
+
+        for user in [self.link_user, self.nolink_user]:
+            self.images[user.pk] = []
+            for img_file in TEST_IMAGES:
+                with open(img_file, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+                    img = UserImage.objects.create(
+                        user=user,
+                        file = File(f)
+                    )
+                self.images[user.pk].append(img)
+                self.image_ids_to_delete.append(img.pk)
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def test_create_links(self):
+        self.client.force_authenticate(self.link_user)
+
+        own_ids = [img.pk for img in self.images[self.link_user.pk]]
+        other_ids = [img.pk for img in self.images[self.nolink_user.pk]]
+
+        # select + insert, created links are fetched back on backends without bulk insert returning
+        queries = 2 if connection.features.can_return_rows_from_bulk_insert else 3
+        with self.assertNumQueries(queries):
+            response = self.client.post('/thumbs/get_img_temp_links/', {
+                'ids': own_ids + other_ids + [-1],
+                'exp': settings.TEMP_LINK_MIN_SECONDS
+            }, format='json')
+
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(set(own_ids), set(response.data['links'].keys()))
+        self.assertEqual(sorted(other_ids + [-1]), response.data['not_found'])
+        self.assertEqual(len(own_ids), ImageTempLink.objects.count())
+
+        for img in self.images[self.link_user.pk]:
+            img_response = self.client.get(response.data['links'][img.pk])
+            self.assertEqual(status.HTTP_302_FOUND, img_response.status_code)
+            self.assertEqual(img_response.url, img.file.url)
+
+    def test_create_links_wrong_plan(self):
+        self.client.force_authenticate(self.nolink_user)
+
+        response = self.client.post('/thumbs/get_img_temp_links/', {
+            'ids': [img.pk for img in self.images[self.nolink_user.pk]],
+            'exp': settings.TEMP_LINK_MIN_SECONDS
+        }, format='json')
+
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_create_links_wrong_exp(self):
+        self.client.force_authenticate(self.link_user)
+
+        response = self.client.post('/thumbs/get_img_temp_links/', {
+            'ids': [img.pk for img in self.images[self.link_user.pk]],
+            'exp': settings.TEMP_LINK_MAX_SECONDS + 1
+        }, format='json')
+
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_create_links_too_many(self):
+        self.client.force_authenticate(self.link_user)
+
+        response = self.client.post('/thumbs/get_img_temp_links/', {
+            'ids': list(range(settings.TEMP_LINK_BATCH_MAX + 1)),
+            'exp': settings.TEMP_LINK_MIN_SECONDS
+        }, format='json')
+
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
@@ -0,0 +1,208 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APITestCase
+
+from thumbs.models import ThumbPlan, ThumbUser, UserImage
+from thumbs.throttling import (TokenBucket, cache_lock, counter_slot,
+                               processing_slot)
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestTokenBucket(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_consume(self):
+        bucket = TokenBucket('test', capacity=2, rate=1)
+
+        with mock.patch('thumbs.throttling.time.time', return_value=1000):
+            self.assertEqual(0, bucket.consume())
+            self.assertEqual(0, bucket.consume())
+            self.assertAlmostEqual(1, bucket.consume())
+
+        with mock.patch('thumbs.throttling.time.time', return_value=1000.5):
+            self.assertAlmostEqual(0.5, bucket.consume())
+
+        with mock.patch('thumbs.throttling.time.time', return_value=1001):
+            self.assertEqual(0, bucket.consume())
+
+
+class TestCacheLock(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_lock_timeout(self):
+        cache.add('test:lock', 'other')
+
+        with self.assertRaises(Throttled):
+            with cache_lock('test', timeout=0.05):
+                pass
+        # the lock of the other holder is kept
+        self.assertEqual('other', cache.get('test:lock'))
+
+    def test_expired_lock_release(self):
+        with cache_lock('test'):
+            # the lock expired and was taken by another worker
+            cache.set('test:lock', 'other')
+        self.assertEqual('other', cache.get('test:lock'))
+
+    def test_release(self):
+        with cache_lock('test'):
+            self.assertIsNotNone(cache.get('test:lock'))
+        self.assertIsNone(cache.get('test:lock'))
+
+
+class TestProcessingSlot(TestCase):
+    def setUp(self):
+        self.plan = ThumbPlan.objects.create(
+            name = 'LIMITED_PLAN',
+            max_concurrent_jobs=1
+        )
+        self.users = [
+            User.objects.create_user(username=f'test_user_{idx}')
+            for idx in range(2)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_concurrent_jobs(self):
+        with processing_slot(self.users[0], self.plan, 1):
+            with self.assertRaises(Throttled):
+                with processing_slot(self.users[0], self.plan, 1):
+                    pass
+
+            # other users are not affected
+            with processing_slot(self.users[1], self.plan, 1):
+                pass
+
+        # slot is freed after the job
+        with processing_slot(self.users[0], self.plan, 1):
+            pass
+
+    @override_settings(THUMBS_JOB_SLOT_TIMEOUT=1)
+    def test_counter_expiration(self):
+        # counters in use don't expire, so the limit holds under steady load
+        with counter_slot('thumbs:jobs:test', 2) as first:
+            time.sleep(0.6)
+            with counter_slot('thumbs:jobs:test', 2) as second:
+                time.sleep(0.6)
+                with counter_slot('thumbs:jobs:test', 2) as third:
+                    self.assertEqual((True, True, False), (first, second, third))
+
+    def test_pixel_budget(self):
+        self.plan.daily_pixel_budget = 100
+
+        with processing_slot(self.users[0], self.plan, 60):
+            pass
+
+        with self.assertRaises(Throttled):
+            with processing_slot(self.users[0], self.plan, 60):
+                pass
+
+        # failed jobs are refunded
+        with self.assertRaises(ValueError):
+            with processing_slot(self.users[0], self.plan, 40):
+                raise ValueError
+
+        with processing_slot(self.users[0], self.plan, 40):
+            pass
+
+
+class TestUploadThrottling(APITestCase):
+    def setUp(self):
+        self.rules = create_test_rules()
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+        cache.clear()
+
+    def create_plan(self, **kwargs):
+        plan = ThumbPlan.objects.create(
+            name = 'LIMITED_PLAN',
+            use_source_img=True,
+            **kwargs
+        )
+        plan.thumb_rules.set([self.rules[0]])
+
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+        self.client.force_authenticate(self.user)
+
+    def upload(self, **extra):
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart', **extra
+            )
+        if response.status_code == status.HTTP_201_CREATED:
+            for img in response.data['urls'].values():
+                self.image_ids_to_delete.append(img['id'])
+        return response
+
+    def test_uploads_per_minute(self):
+        self.create_plan(uploads_per_minute=2)
+
+        self.assertEqual(status.HTTP_201_CREATED, self.upload().status_code)
+        self.assertEqual(status.HTTP_201_CREATED, self.upload().status_code)
+
+        response = self.upload()
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+        self.assertIn('Retry-After', response)
+
+    def test_idempotent_retry_not_throttled(self):
+        self.create_plan(uploads_per_minute=1)
+
+        response = self.upload(HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+
+        # the bucket is empty, but a retry gets the stored response
+        with open(TEST_IMAGES[0], 'rb') as f:
+            retry = self.client.post(
+                '/thumbs/upload_img/',
+                {'file':f}, format='multipart', HTTP_IDEMPOTENCY_KEY='upload-1'
+            )
+        self.assertEqual(status.HTTP_201_CREATED, retry.status_code)
+        self.assertEqual(response.data, retry.data)
+
+        response = self.upload(HTTP_IDEMPOTENCY_KEY='upload-2')
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+
+    def test_upload_sessions_per_minute(self):
+        self.create_plan(uploads_per_minute=1)
+
+        data = {'filename': 'image.jpg', 'size': 1000}
+        response = self.client.post('/thumbs/uploads/', data)
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        session_url = response.data['url']
+
+        response = self.client.post('/thumbs/uploads/', data)
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+
+        # finalized sessions count towards the same upload rate as upload_img
+        self.assertEqual(status.HTTP_201_CREATED, self.upload().status_code)
+        response = self.client.post(session_url + 'finalize/')
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+
+    def test_daily_pixel_budget(self):
+        self.create_plan(daily_pixel_budget=1)
+
+        response = self.upload()
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+        self.assertFalse(UserImage.objects.filter(user=self.user).exists())
@@ -0,0 +1,158 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APITestCase
+
+from thumbs.async_views import image_list_view
+from thumbs.authentication import create_token, parse_token
+from thumbs.models import ThumbPlan, ThumbUser, UserImage, plan_cache
+
+from .utils import TEST_IMAGES, create_test_rules, delete_test_files
+
+
+class TestTokenUser(TestCase):
+    def setUp(self):
+        plan_cache.clear()
+        self.plan = ThumbPlan.objects.create(name='BASIC_PLAN')
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = self.plan
+        )
+
+    def get_token(self):
+        return create_token(self.user)
+
+    def test_lazy_user(self):
+        token = self.get_token()
+
+        with self.assertNumQueries(0):
+            user = parse_token(token)
+            self.assertTrue(user.is_authenticated)
+            self.assertEqual(self.user, user)
+            self.assertEqual(self.user.pk, user.pk)
+
+        # deferred fields are loaded together
+        with self.assertNumQueries(1):
+            self.assertEqual('test_user', user.username)
+            self.assertEqual('user@test.com', user.email)
+
+        # plans are cached per process
+        with self.assertNumQueries(1):
+            self.assertEqual(self.plan, user.thumb_user.plan)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.plan, parse_token(token).thumb_user.plan)
+
+    def test_without_plan(self):
+        user = User.objects.create_user(username='no_plan')
+
+        token_user = parse_token(create_token(user))
+        self.assertFalse(hasattr(token_user, 'thumb_user'))
+
+    def test_deleted_user(self):
+        user = parse_token(self.get_token())
+        self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            user.username
+
+    def test_invalid_tokens(self):
+        token = self.get_token()
+
+        with self.assertRaises(AuthenticationFailed):
+            parse_token(token[:-1])
+        with override_settings(THUMBS_TOKEN_MAX_AGE=-1):
+            with self.assertRaises(AuthenticationFailed):
+                parse_token(token)
+
+
+class TestTokenAuthentication(APITestCase):
+    def setUp(self):
+        plan_cache.clear()
+        plan = ThumbPlan.objects.create(
+            name = 'ENTERPRISE_PLAN',
+            use_source_img=True,
+            use_expiring_links=True
+        )
+        plan.thumb_rules.set(create_test_rules()[:1])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com',
+            password='test_password'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+
+    def get_token_client(self):
+        self.client.login(username='test_user', password='test_password')
+        response = self.client.post('/thumbs/token/')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["token"]}')
+        return client
+
+    def count_queries(self, client, *args):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(*args)
+        self.assertLess(response.status_code, 300)
+        return len(context)
+
+    def test_upload_and_list(self):
+        client = self.get_token_client()
+
+        with open(TEST_IMAGES[0], 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/thumbs/upload_img/', {'file':f}, format='multipart')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+        self.assertEqual(self.user.pk, UserImage.objects.get(pk=response.data['id']).user_id)
+
+        # no session row and user to load
+        session_queries = self.count_queries(self.client, '/thumbs/list_img/')
+        self.assertEqual(session_queries - 2, self.count_queries(client, '/thumbs/list_img/'))
+
+        link_args = ('/thumbs/get_img_temp_link/', {'img': response.data['id'], 'exp': 300})
+        session_queries = self.count_queries(self.client, *link_args)
+        self.assertEqual(session_queries - 4, self.count_queries(client, *link_args))
+
+    def test_invalid_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+
+        response = client.get('/thumbs/list_img/')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    async def test_async_view(self):
+        request = AsyncRequestFactory().get('/thumbs/list_img/')
+        request.META['HTTP_AUTHORIZATION'] = f'Bearer {await sync_to_async(create_token)(self.user)}'
+        request.user = AnonymousUser()
+
+        response = await image_list_view(request)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        request.META['HTTP_AUTHORIZATION'] = 'Bearer invalid'
+        response = await image_list_view(request)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_inactive_user_renewal(self):
+        client = self.get_token_client()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        response = client.post('/thumbs/token/')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
@@ -0,0 +1,179 @@
+import datetime
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from thumbs.models import ThumbPlan, ThumbUser, UploadSession, UserImage
+
+from .utils import (NON_IMAGE_FILE, TEST_IMAGES, create_test_rules,
+                    delete_test_files)
+
+
+class TestUploadSessionViews(APITestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            THUMBS_UPLOAD_TEMP_DIR=self.temp_dir.name,
+            THUMBS_UPLOAD_MAX_CHUNK=1024 * 1024
+        )
+        self.settings_override.enable()
+
+        self.rules = create_test_rules()
+        plan = ThumbPlan.objects.create(
+            name = 'SINGLE_PLAN',
+            use_source_img=True
+        )
+        plan.thumb_rules.set([self.rules[0]])
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='user@test.com'
+        )
+        ThumbUser.objects.create(
+            user = self.user,
+            plan = plan
+        )
+
+        self.image_ids_to_delete = []
+
+    def tearDown(self):
+        delete_test_files(self.image_ids_to_delete)
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def create_session(self, path):
+        response = self.client.post(
+            '/thumbs/uploads/',
+            {'filename': os.path.basename(path), 'size': os.path.getsize(path)}
+        )
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        return response.data['url']
+
+    def put_chunk(self, url, data, offset):
+        return self.client.put(
+            url, data,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_chunked_upload(self):
+        self.client.force_authenticate(self.user)
+
+        with open(TEST_IMAGES[0], 'rb') as f:
+            content = f.read()
+
+        url = self.create_session(TEST_IMAGES[0])
+        chunk_size = len(content) // 3 + 1
+
+        for offset in range(0, len(content), chunk_size):
+            # finalize is refused until all chunks are uploaded
+            response = self.client.post(url + 'finalize/')
+            self.assertEqual(status.HTTP_409_CONFLICT, response.status_code)
+
+            response = self.put_chunk(url, content[offset:offset + chunk_size], offset)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(min(offset + chunk_size, len(content)), response.data['offset'])
+
+        self.assertFalse(UserImage.objects.filter(user=self.user).exists())
+
+        # the assembled file is validated from disk, not read into memory
+        with mock.patch('django.forms.fields.BytesIO', side_effect=AssertionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url + 'finalize/')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+        self.assertIn(self.rules[0].height, response.data['urls'])
+        original = UserImage.objects.get(pk=response.data['urls']['original']['id'])
+        with open(original.file.path, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+    def test_finalize_retry(self):
+        self.client.force_authenticate(self.user)
+
+        with open(TEST_IMAGES[0], 'rb') as f:
+            content = f.read()
+
+        url = self.create_session(TEST_IMAGES[0])
+        self.put_chunk(url, content, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url + 'finalize/')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        for img in response.data['urls'].values():
+            self.image_ids_to_delete.append(img['id'])
+
+        # a retried finalize gets the same image, it isn't created again
+        retry = self.client.post(url + 'finalize/')
+        self.assertEqual(status.HTTP_201_CREATED, retry.status_code)
+        self.assertEqual(response.data, retry.data)
+        self.assertEqual(1, UserImage.objects.filter(user=self.user, parent__isnull=True).count())
+
+    def test_resume_after_interrupted_chunk(self):
+        self.client.force_authenticate(self.user)
+
+        with open(TEST_IMAGES[0], 'rb') as f:
+            content = f.read()
+
+        url = self.create_session(TEST_IMAGES[0])
+        self.put_chunk(url, content[:1000], 0)
+
+        # a retry of an already stored chunk gets the current offset
+        response = self.put_chunk(url, content[:1000], 0)
+        self.assertEqual(status.HTTP_409_CONFLICT, response.status_code)
+        self.assertEqual(1000, response.data['offset'])
+
+        response = self.client.get(url)
+        self.assertEqual(1000, response.data['offset'])
+
+        response = self.put_chunk(url, content[1000:], 1000)
+        self.assertEqual(len(content), response.data['offset'])
+
+    def test_finalize_non_image(self):
+        self.client.force_authenticate(self.user)
+
+        with open(NON_IMAGE_FILE, 'rb') as f:
+            content = f.read()
+
+        url = self.create_session(NON_IMAGE_FILE)
+        self.put_chunk(url, content, 0)
+
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_other_user_session(self):
+        self.client.force_authenticate(self.user)
+        url = self.create_session(TEST_IMAGES[0])
+
+        other_user = User.objects.create_user(
+            username='other_user',
+            email='other@test.com'
+        )
+        self.client.force_authenticate(other_user)
+
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_delete_expired(self):
+        self.client.force_authenticate(self.user)
+        url = self.create_session(TEST_IMAGES[0])
+        self.put_chunk(url, b'0' * 100, 0)
+
+        session = UploadSession.objects.get()
+        self.assertTrue(os.path.exists(session.temp_path))
+
+        UploadSession.objects.update(created=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(1, UploadSession.delete_expired())
+        self.assertFalse(os.path.exists(session.temp_path))
@@ -1,6 +1,7 @@
 import os
 import pathlib
 
+from thumbs.cold_storage import get_cold_storage
 from thumbs.models import ThumbRule, UserImage
 
 TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_images')
@@ -16,6 +17,8 @@ def delete_test_files(ids):
         img = UserImage.objects.get(pk=id)
         if img.file:
             os.remove(img.file.path)
+        if img.cold_file:
+            get_cold_storage().delete(img.cold_file)
 
 def create_test_rules():
     rules = [] 
@@ -24,4 +27,4 @@ def create_test_rules():
             height = idx*200
         )
         rules.append(rule)
-    return rules
\ No newline at end of file
+    return rules
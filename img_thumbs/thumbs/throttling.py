@@ -0,0 +1,185 @@
+'''
+Upload limits tied to ThumbPlan, kept in a Django cache shared by all the workers:
+uploads per minute (token bucket), concurrent thumbnail jobs per user
+and a daily pixel budget. Processing capacity of a worker and priority
+of plans are left to thumbs.scheduler.
+'''
+import datetime
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+def get_cache():
+    return caches[settings.THUMBS_THROTTLE_CACHE]
+
+@contextmanager
+def cache_lock(key, timeout=5):
+    '''
+    Short lived lock based on cache.add, serializes read-modify-write of a bucket.
+    Held for at most timeout seconds, Throttled is raised if it isn't acquired within that time.
+    '''
+    cache = get_cache()
+    lock_key = f'{key}:lock'
+    # a lock which expired and was taken by another worker is left to it on release
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, token, timeout=timeout):
+        if time.monotonic() > deadline:
+            raise Throttled(wait=1, detail='Server busy, try again.')
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+class TokenBucket():
+    '''
+    Token bucket of a given capacity, refilled continuously at rate tokens / second
+    '''
+    def __init__(self, key, capacity, rate):
+        self.key = f'thumbs:bucket:{key}'
+        self.capacity = capacity
+        self.rate = rate
+
+    def consume(self, tokens=1):
+        '''
+        Takes tokens from the bucket. Returns 0 on success,
+        otherwise seconds to wait until enough tokens are available.
+        '''
+        cache = get_cache()
+        with cache_lock(self.key):
+            now = time.time()
+            available, updated = cache.get(self.key, (self.capacity, now))
+            available = min(self.capacity, available + (now - updated) * self.rate)
+
+            if available >= tokens:
+                cache.set(self.key, (available - tokens, now), timeout=self.get_timeout())
+                return 0
+
+            cache.set(self.key, (available, now), timeout=self.get_timeout())
+            return (tokens - available) / self.rate
+
+    def get_timeout(self):
+        # the bucket is full again after this time, so the entry can expire
+        return int(self.capacity / self.rate) + 1
+
+
+def get_plan(user):
+    if not user or not user.is_authenticated or not hasattr(user, 'thumb_user'):
+        return None
+    return user.thumb_user.plan
+
+
+class PlanUploadThrottle(BaseThrottle):
+    '''
+    Limits upload requests per minute, according to user's plan
+    '''
+    scope = 'uploads'
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+
+        plan = get_plan(request.user)
+        if plan is None or not plan.uploads_per_minute:
+            return True
+
+        bucket = TokenBucket(
+            f'{self.scope}:{request.user.pk}',
+            capacity=plan.uploads_per_minute,
+            rate=plan.uploads_per_minute / 60
+        )
+        self.wait_time = bucket.consume()
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class PlanUploadSessionThrottle(PlanUploadThrottle):
+    '''
+    Limits resumable upload sessions started per minute, at the upload rate of user's plan
+    '''
+    scope = 'upload-sessions'
+
+
+def get_pixel_budget_key(user):
+    return f'thumbs:pixels:{user.pk}:{timezone.now().date().isoformat()}'
+
+def charge_pixel_budget(user, plan, pixels):
+    '''
+    Adds pixels to user's daily counter, raises Throttled if the budget is exceeded.
+    Returns the counter key, so the charge can be refunded.
+    '''
+    if not plan.daily_pixel_budget:
+        return None
+
+    cache = get_cache()
+    key = get_pixel_budget_key(user)
+
+    cache.add(key, 0, timeout=24 * 60 * 60 + 60)
+    used = cache.incr(key, pixels)
+    if used > plan.daily_pixel_budget:
+        cache.decr(key, pixels)
+        now = timezone.now()
+        tomorrow = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time(), tzinfo=now.tzinfo
+        )
+        raise Throttled(
+            wait=(tomorrow - now).total_seconds(),
+            detail='Daily pixel budget exceeded.'
+        )
+    return key
+
+@contextmanager
+def counter_slot(key, limit):
+    '''
+    Holds one of limit slots of a shared counter, yields False if none is free
+    '''
+    cache = get_cache()
+    # counters expire once no slots are taken or released for THUMBS_JOB_SLOT_TIMEOUT,
+    # so slots leaked by killed workers are eventually freed
+    timeout = settings.THUMBS_JOB_SLOT_TIMEOUT
+    cache.add(key, 0, timeout=timeout)
+    try:
+        count = cache.incr(key)
+        cache.touch(key, timeout)
+    except ValueError:
+        # counter expired in between
+        cache.add(key, 1, timeout=timeout)
+        count = 1
+
+    try:
+        yield count <= limit
+    finally:
+        try:
+            cache.decr(key)
+            cache.touch(key, timeout)
+        except ValueError:
+            pass
+
+@contextmanager
+def processing_slot(user, plan, pixels):
+    '''
+    Guards a thumbnail job - charges the daily pixel budget and takes a slot
+    from user's concurrent jobs. Pixels are refunded if the job fails.
+    '''
+    budget_key = charge_pixel_budget(user, plan, pixels)
+
+    try:
+        with counter_slot(f'thumbs:jobs:{user.pk}', plan.max_concurrent_jobs or float('inf')) as user_slot:
+            if not user_slot:
+                raise Throttled(wait=1, detail='Too many concurrent uploads.')
+            yield
+    except Exception:
+        if budget_key is not None:
+            get_cache().decr(budget_key, pixels)
+        raise
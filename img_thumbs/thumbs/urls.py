@@ -1,11 +1,36 @@
+from django.conf import settings
 from django.urls import path
 
-from thumbs import views
+from thumbs import async_views, views
+
+
+def select_view(route_name, sync_view, async_view):
+    '''
+    Picks an async-native view for routes listed in THUMBS_ASYNC_ROUTES
+    '''
+    if route_name in settings.THUMBS_ASYNC_ROUTES:
+        return async_view
+    return sync_view
 
 app_name = 'thumbs'
 urlpatterns = [
     path('upload_img/', views.ImageUploadView.as_view()),
-    path('list_img/', views.ImageListView.as_view()),
+    path('uploads/', views.UploadSessionCreateView.as_view()),
+    path('uploads/<uuid:session_id>/', views.UploadSessionView.as_view(), name='uploadSession'),
+    path('uploads/<uuid:session_id>/finalize/', views.UploadSessionFinalizeView.as_view()),
+    path('list_img/', select_view(
+        'list_img',
+        views.ImageListView.as_view(),
+        async_views.image_list_view
+    )),
     path('get_img_temp_link/', views.GetImageTempLink.as_view()),
-    path('tmp/<str:slug>', views.ParseImageTempLink.as_view(), name='tmpLink')
+    path('get_img_temp_links/', views.GetImageTempLinksBatch.as_view()),
+    path('tmp/<str:slug>', select_view(
+        'tmpLink',
+        views.ParseImageTempLink.as_view(),
+        async_views.parse_image_temp_link_view
+    ), name='tmpLink'),
+    path('token/', views.TokenView.as_view()),
+    path('sprites/', views.SpriteSheetView.as_view()),
+    path('metrics', views.MetricsView.as_view(), name='metrics')
 ]
\ No newline at end of file
@@ -1,9 +1,12 @@
 import datetime
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core import signing
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.db.models import Q
-from django.http.response import HttpResponseRedirect
+from django.http.response import HttpResponse, HttpResponseRedirect
+from django.urls import reverse
 from django.utils import timezone
 from rest_framework import permissions, status
 from rest_framework.exceptions import (NotFound, PermissionDenied,
@@ -12,59 +15,365 @@ from rest_framework.generics import CreateAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from thumbs.models import ImageTempLink, UserImage
+from thumbs.authentication import create_token
+from thumbs.db_routing import read_database, replica_reads, stick_to_primary
+from thumbs.idempotency import (get_idempotency_key, get_upload_fingerprint,
+                                idempotency_store)
+from thumbs.metrics import (CONTENT_TYPE, list_requests, listed_images,
+                            registry, temp_links_expired, temp_links_issued,
+                            temp_links_redeemed, uploads)
+from thumbs.models import (ImageTempLink, SpriteSheet, ThumbPlan, ThumbRule,
+                           UploadSession, UserImage)
+from thumbs.profiling import profile_request
+from thumbs.scheduler import record_rule_request
 from thumbs.serializers import UserImageCreateSerializer
+from thumbs.sprites import SpriteSheetBuilder
+from thumbs.storage_urls import get_file_url
+from thumbs.throttling import (PlanUploadSessionThrottle, PlanUploadThrottle,
+                               get_plan, processing_slot)
+
+
+def get_srcset(urls):
+    '''
+    srcset attribute value - variants of known width, from the narrowest one
+    '''
+    widths = {}
+    for variant in urls.values():
+        if variant['width'] is not None:
+            widths.setdefault(variant['width'], variant['url'])
+    return ', '.join(f'{url} {width}w' for width, url in sorted(widths.items()))
+
+def get_image_data(img):
+    urls = img.get_all_urls()
+    return {
+        'id': img.pk,
+        'placeholder': img.placeholder,
+        'urls': urls,
+        'srcset': get_srcset(urls)
+    }
+
+def get_upload_response_data(img):
+    return {
+        'message':'OK',
+        **get_image_data(img),
+        'duplicate_of': img.duplicate_of_id
+    }
+
+def save_with_limits(serializer, user):
+    '''
+    Saves a validated image upload (running the thumbnail pipeline)
+    within the processing limits of user's plan
+    '''
+    plan = get_plan(user)
+    file = serializer.validated_data.get('file', None)
+    if plan is None or not file:
+        # invalid uploads are rejected by the serializer
+        return serializer.save()
+
+    width, height = file.image.size
+    with processing_slot(user, plan, width * height):
+        img = serializer.save()
+    uploads.inc(plan=plan.name)
+    return img
+
+def get_image_list(user):
+    '''
+    Returns a list of all images (incl. thumbs urls) owned by a user
+    '''
+    images = UserImage.objects.filter(
+        Q(user=user) &
+        Q(parent__isnull=True)
+    ).order_by('pk')
+
+    img_list = []
+    for img in images:
+        img_list.append(get_image_data(img))
+
+    list_requests.inc()
+    listed_images.inc(len(img_list))
+    return img_list
+
+def parse_expiration(value):
+    '''
+    Validates temp link expiration time (in seconds)
+    '''
+    try:
+        expiration = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError
+
+    if expiration < settings.TEMP_LINK_MIN_SECONDS or expiration > settings.TEMP_LINK_MAX_SECONDS:
+        raise ValidationError
+    return expiration
+
+def parse_temp_link_slug(slug):
+    '''
+    Decodes a temp link slug into ImageTempLink pk
+    '''
+    try:
+        signer = signing.Signer()
+        return int(signer.unsign(slug))
+    except (ValueError, TypeError, signing.BadSignature):
+        raise ValidationError
+
+def get_temp_link_url(pk):
+    '''
+    Returns an image file url for a valid, not expired ImageTempLink
+    '''
+    queryset = ImageTempLink.objects.select_related('image').filter(pk=pk)
+    link_obj = queryset.first()
+    if link_obj is None and read_database.get() is not None:
+        # links created moments ago by other clients may not be on the replica yet
+        link_obj = queryset.using(DEFAULT_DB_ALIAS).first()
+    if link_obj is None:
+        raise NotFound
+
+    if not link_obj.image or not link_obj.image.file.name:
+        raise NotFound
+
+    if link_obj.expiration < timezone.now():
+        temp_links_expired.inc()
+        raise NotFound
+
+    if link_obj.image.thumb_rule_id is not None:
+        record_rule_request(link_obj.image.thumb_rule_id)
+
+    temp_links_redeemed.inc()
+
+    return get_file_url(link_obj.image.file.name, link_obj.image.file.storage)
 
 
 # Create your views here.
-class ImageUploadView(CreateAPIView):
+class IdempotentUploadMixin():
+    '''
+    Throttles are skipped for retries which get a stored response,
+    only the request which processed the upload counts towards the upload rate
+    '''
+    def get_idempotency_lookup(self, request):
+        '''
+        Returns (key, fingerprint) of the request, None if it isn't idempotent
+        '''
+        raise NotImplementedError
+
+    def check_throttles(self, request):
+        lookup = self.get_idempotency_lookup(request)
+        if lookup is not None and idempotency_store.get_stored(request.user.pk, *lookup) is not None:
+            return
+        super().check_throttles(request)
+
+class ImageUploadView(IdempotentUploadMixin, CreateAPIView):
     '''
     Allows to upload image by a registered user.
     Thumbnails are created according to users's plan.
     Image urls (incl. thumbs) are returned in a response.
+    Requests with an Idempotency-Key header are processed only once per key.
     '''
     serializer_class = UserImageCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [PlanUploadThrottle]
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['user'] = self.request.user
         return context
 
+    def get_idempotency_lookup(self, request):
+        key = get_idempotency_key(request)
+        if key is None:
+            return None
+        return key, get_upload_fingerprint(request)
+
     def create(self, request, *args, **kwargs):
+        lookup = self.get_idempotency_lookup(request)
+        if lookup is None:
+            status_code, data = self.process_upload(request)
+        else:
+            # retries with the same Idempotency-Key get the original response
+            key, fingerprint = lookup
+            status_code, data = idempotency_store.run(
+                scope=request.user.pk,
+                key=key,
+                fingerprint=fingerprint,
+                func=lambda: self.process_upload(request)
+            )
+
+        response = Response(data, status=status_code)
+        if status_code == status.HTTP_201_CREATED:
+            stick_to_primary(response)
+        return response
+
+    def process_upload(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            img = serializer.save()
+            with profile_request(request):
+                img = save_with_limits(serializer, request.user)
+            return status.HTTP_201_CREATED, get_upload_response_data(img)
+
+        return status.HTTP_400_BAD_REQUEST, serializer.errors
+
+def get_upload_session_data(session):
+    return {
+        'id': session.pk,
+        'offset': session.offset,
+        'size': session.size
+    }
+
+def get_upload_session(request, session_id, lock=False):
+    '''
+    Returns a not expired upload session of request user
+    '''
+    queryset = UploadSession.objects.filter(user=request.user)
+    if lock:
+        queryset = queryset.select_for_update()
+
+    try:
+        session = queryset.get(pk=session_id)
+    except UploadSession.DoesNotExist:
+        raise NotFound
 
-            data = {
-                'message':'OK',
-                'id':img.pk,
-                'urls': img.get_all_urls()
-            }
+    if session.is_expired:
+        session.delete()
+        raise NotFound
 
-            return Response(data, status=status.HTTP_201_CREATED)
+    return session
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+class UploadSessionCreateView(APIView):
+    '''
+    Starts a resumable upload of a large image.
+    Necessary data: filename and size (in bytes).
+    Returns session id and url, chunks are then PUT to the url.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [PlanUploadSessionThrottle]
+
+    def post(self, request):
+        if not hasattr(request.user, 'thumb_user'):
+            raise ValidationError
+
+        filename = request.data.get('filename', None)
+        if not filename or len(filename) > 255:
+            raise ValidationError({'filename': 'Invalid filename.'})
+
+        try:
+            size = int(request.data.get('size', None))
+            if size <= 0 or size > settings.THUMBS_UPLOAD_MAX_SIZE:
+                raise ValidationError({'size': 'Invalid size.'})
+        except (TypeError, ValueError):
+            raise ValidationError({'size': 'Invalid size.'})
+
+        session = UploadSession.objects.create(
+            user=request.user,
+            filename=filename,
+            size=size
+        )
+
+        data = get_upload_session_data(session)
+        data['url'] = request.build_absolute_uri(
+            reverse('thumbs:uploadSession', args=[session.pk])
+        )
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class UploadSessionView(APIView):
+    '''
+    GET returns current offset of an upload session (to resume from).
+    PUT appends a chunk sent as a raw body, Upload-Offset header has to match
+    the current session offset.
+    DELETE aborts the upload.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = []
+
+    def get(self, request, session_id):
+        session = get_upload_session(request, session_id)
+        return Response(get_upload_session_data(session), status=status.HTTP_200_OK)
+
+    def put(self, request, session_id):
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', None))
+            length = int(request.META.get('CONTENT_LENGTH', None))
+        except (TypeError, ValueError):
+            raise ValidationError
+
+        if length <= 0 or length > settings.THUMBS_UPLOAD_MAX_CHUNK:
+            raise ValidationError
+
+        with transaction.atomic():
+            session = get_upload_session(request, session_id, lock=True)
+
+            if offset != session.offset:
+                return Response(get_upload_session_data(session), status=status.HTTP_409_CONFLICT)
+
+            if offset + length > session.size:
+                raise ValidationError
+
+            session.append_chunk(offset, request.stream, length)
+
+        return Response(get_upload_session_data(session), status=status.HTTP_200_OK)
+
+    def delete(self, request, session_id):
+        session = get_upload_session(request, session_id)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadSessionFinalizeView(IdempotentUploadMixin, APIView):
+    '''
+    Completes a resumable upload - the image is created from the uploaded file
+    and thumbnails are generated. Returns the same data as upload_img.
+    A session is finalized once, concurrent or retried calls get the result of the first one.
+    Images count towards the upload rate of user's plan, as upload_img ones.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [PlanUploadThrottle]
+
+    def get_idempotency_lookup(self, request):
+        session_id = self.kwargs['session_id']
+        return f'upload-session:{session_id}', str(session_id)
+
+    def post(self, request, session_id):
+        key, fingerprint = self.get_idempotency_lookup(request)
+        status_code, data = idempotency_store.run(
+            scope=request.user.pk,
+            key=key,
+            fingerprint=fingerprint,
+            func=lambda: self.finalize(request, session_id)
+        )
+
+        response = Response(data, status=status_code)
+        if status_code == status.HTTP_201_CREATED:
+            stick_to_primary(response)
+        return response
+
+    def finalize(self, request, session_id):
+        with transaction.atomic():
+            session = get_upload_session(request, session_id, lock=True)
+
+            if not session.is_complete:
+                return status.HTTP_409_CONFLICT, get_upload_session_data(session)
+
+            with session.open_file() as upload:
+                serializer = UserImageCreateSerializer(
+                    data={'file': upload},
+                    context={'user': request.user}
+                )
+                if not serializer.is_valid():
+                    session.delete()
+                    return status.HTTP_400_BAD_REQUEST, serializer.errors
+
+                with profile_request(request):
+                    img = save_with_limits(serializer, request.user)
+
+            session.delete()
+        return status.HTTP_201_CREATED, get_upload_response_data(img)
 
 class ImageListView(APIView):
     '''
-    Lists all images owned by request user
+    Lists all images owned by request user, read from a replica (see thumbs.db_routing)
     '''
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        images = UserImage.objects.filter(
-            Q(user=request.user) &
-            Q(parent__isnull=True)
-        ).prefetch_related('thumbs__thumb_rule')
-
-        img_list = []
-        for img in images:
-            img_list.append( {
-                'id': img.pk,
-                'urls': img.get_all_urls()
-            })
-
+        with replica_reads(request):
+            img_list = get_image_list(request.user)
         return Response(img_list, status=status.HTTP_200_OK)
 
 class GetImageTempLink(APIView):
@@ -81,14 +390,9 @@ class GetImageTempLink(APIView):
         except (TypeError, ValueError, UserImage.DoesNotExist):
             raise NotFound
 
-        try:
-            expiration = int(self.request.query_params.get('exp', None))
-            if expiration < settings.TEMP_LINK_MIN_SECONDS or expiration > settings.TEMP_LINK_MAX_SECONDS:
-                raise ValidationError
-        except (TypeError, ValueError):
-            raise ValidationError
+        expiration = parse_expiration(self.request.query_params.get('exp', None))
 
-        if image.user != request.user or not request.user.thumb_user.plan.use_expiring_links:
+        if image.user_id != request.user.pk or not request.user.thumb_user.plan.use_expiring_links:
             raise PermissionDenied
 
         if not image.file.name:
@@ -100,36 +404,151 @@ class GetImageTempLink(APIView):
             image=image,
             expiration=expiration_datetime
         )
+        temp_links_issued.inc()
 
         relative_url = link.generate_link()
         uri = request.build_absolute_uri(relative_url)
 
-        return Response(uri, status=status.HTTP_201_CREATED)
+        return stick_to_primary(Response(uri, status=status.HTTP_201_CREATED))
+
+class GetImageTempLinksBatch(APIView):
+    '''
+    Generates ImageTempLink objects for many images at once.
+    Necessary data: ids (list of Image object ids) and exp (expiration time in seconds).
+    Returns a map of image id to url, ids of missing images or images
+    not owned by request user are listed in not_found.
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get('ids', None)
+        if not isinstance(ids, list) or not ids or len(ids) > settings.TEMP_LINK_BATCH_MAX:
+            raise ValidationError({'ids': 'Invalid ids.'})
+        try:
+            ids = set(int(i) for i in ids)
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'Invalid ids.'})
+
+        expiration = parse_expiration(request.data.get('exp', None))
+
+        # ownership and plan are checked in the same query
+        images = list(UserImage.objects.filter(
+            pk__in=ids,
+            user=request.user,
+            user__thumb_user__plan__use_expiring_links=True
+        ).exclude(file='').exclude(file__isnull=True).only('pk'))
+
+        if not images and not ThumbPlan.objects.filter(
+            thumbuser__user=request.user,
+            use_expiring_links=True
+        ).exists():
+            raise PermissionDenied
+
+        expiration_datetime = timezone.now() + datetime.timedelta(seconds=expiration)
+        links = ImageTempLink.objects.bulk_create([
+            ImageTempLink(image=image, expiration=expiration_datetime)
+            for image in images
+        ])
+
+        if links and links[0].pk is None:
+            # backends which don't return pks from bulk inserts
+            links = ImageTempLink.objects.filter(
+                image__in=images,
+                expiration=expiration_datetime
+            )
+
+        urls = {}
+        for link in links:
+            urls[link.image_id] = request.build_absolute_uri(link.generate_link())
+        temp_links_issued.inc(len(urls))
+
+        data = {
+            'links': urls,
+            'not_found': sorted(ids - set(urls.keys()))
+        }
+        return stick_to_primary(Response(data, status=status.HTTP_201_CREATED))
 
 class ParseImageTempLink(APIView):
     '''
     Decodes a slug value, pointing to ImageTempLink objects.
     If valid, returns a redirecto to image file url.
+    The link is read from a replica (see thumbs.db_routing).
     '''
     def get(self, request, slug):
+        pk = parse_temp_link_slug(slug)
+        with replica_reads(request):
+            url = get_temp_link_url(pk)
 
-        try:
-            signer = signing.Signer()
-            pk = int(signer.unsign(slug))
-        except (ValueError, TypeError, signing.BadSignature):
-            raise ValidationError
+        return HttpResponseRedirect(url)
 
-        try:
-            link_obj = ImageTempLink.objects.get(pk=pk)
-        except ImageTempLink.DoesNotExist:
-            raise NotFound
+class TokenView(APIView):
+    '''
+    Issues a signed token for request user, to authenticate further requests
+    with an Authorization: Bearer <token> header (see thumbs.authentication).
+    '''
+    permission_classes = [permissions.IsAuthenticated]
 
-        if not link_obj.image or not link_obj.image.file.name:
+    def post(self, request):
+        # users of renewed tokens may be deleted or deactivated since
+        if not User.objects.filter(pk=request.user.pk, is_active=True).exists():
+            raise PermissionDenied
+
+        data = {
+            'token': create_token(request.user),
+            'expires_in': settings.THUMBS_TOKEN_MAX_AGE
+        }
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class SpriteSheetView(APIView):
+    '''
+    Returns a sprite sheet of request user's thumbnails of one rule (see thumbs.sprites),
+    with offsets of the thumbnails by image id.
+    Necessary query params: rule (thumb rule key, e.g. 200 or 300w), optional page (from 0).
+    '''
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        rule = ThumbRule.get_by_key(request.query_params.get('rule', ''))
+        if rule is None:
             raise NotFound
+        try:
+            page = int(request.query_params.get('page', 0))
+            if page < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValidationError({'page': 'Invalid page.'})
 
-        if link_obj.expiration < timezone.now():
+        sheet, pages = SpriteSheetBuilder(request.user, rule).refresh(page)
+        if sheet is None and (pages or page > 0):
             raise NotFound
 
-        url = link_obj.image.file.url
+        data = {
+            'rule': rule.get_key(),
+            'page': page,
+            'pages': pages,
+            'url': None,
+            'width': 0,
+            'height': 0,
+            'images': {}
+        }
+        if sheet is not None:
+            data.update({
+                'url': get_file_url(sheet.file.name, SpriteSheet.file.field.storage),
+                'width': sheet.width,
+                'height': sheet.height,
+                'images': {
+                    entry['id']: {key: entry[key] for key in ('x', 'y', 'width', 'height')}
+                    for entry in sheet.entries
+                }
+            })
+        return Response(data, status=status.HTTP_200_OK)
 
-        return HttpResponseRedirect(url)
+class MetricsView(APIView):
+    '''
+    Metrics of the thumbnail pipeline (all worker processes), in the Prometheus text format.
+    Available to staff users only.
+    '''
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.exposition(), content_type=CONTENT_TYPE)